@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from .models import CustomUser
+from . import search
+from .models import CustomUser, OutboxEmail
+from .pagination import EstimatedCountPaginator
+from .user_cache import invalidate_users
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'user_type', 'email_verified', 'is_staff')
@@ -9,6 +13,10 @@ class CustomUserAdmin(UserAdmin):
     search_fields = ('username', 'email', 'first_name', 'last_name')
     ordering = ('-date_joined',)
     readonly_fields = ('date_joined', 'last_updated')
+    # Estimated totals instead of COUNT(*) over the whole table, and no
+    # second count for the "N total" link next to filtered results
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
@@ -26,10 +34,38 @@ class CustomUserAdmin(UserAdmin):
     )
     
     actions = ['mark_email_verified']
+
+    def get_search_results(self, request, queryset, search_term):
+        # One FTS5 lookup instead of an icontains scan per field and term
+        if not search.is_supported(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        pks = search.matching_pks(search_term)
+        if pks is None:
+            return queryset, False
+        return queryset.filter(pk__in=pks), False
     
     def mark_email_verified(self, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
         updated = queryset.update(email_verified=True)
+        # update() skips post_save
+        invalidate_users(pks)
         self.message_user(request, f"{updated} users marked as email verified.")
     mark_email_verified.short_description = "Mark selected users as email verified"
 
 admin.site.register(CustomUser, CustomUserAdmin)
+
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'sent_at', 'attempts', 'last_error')
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=OutboxEmail.STATUS_SENT).update(
+            status=OutboxEmail.STATUS_PENDING, next_attempt_at=timezone.now(), attempts=0
+        )
+        self.message_user(request, f"{updated} emails rescheduled for delivery.")
+    retry_now.short_description = "Retry selected emails now"
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
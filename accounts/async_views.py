@@ -0,0 +1,198 @@
+"""
+Async versions of the busiest views, used instead of `accounts.views` when
+ASYNC_VIEWS is on (the default under `usermgmt/asgi.py`).
+
+Under ASGI a sync view runs in the thread-sensitive adapter. These run on
+the event loop instead:
+
+- Simple reads use the async ORM.
+- Transactions and form validation go to a worker thread through
+  `sync_to_async`, sharing their code with the sync views.
+- Password hashes are awaited on the hashing process pool, so no thread
+  waits for them.
+- Email is queued in the outbox as before; no view talks to SMTP.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth import alogin, alogout, get_user_model
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.tokens import default_token_generator
+from django.db import DEFAULT_DB_ALIAS
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.encoding import force_str
+from django.utils.http import url_has_allowed_host_and_scheme, urlsafe_base64_decode
+from django.utils.safestring import mark_safe
+
+from . import metrics
+from .emails import render_email
+from .forms import CustomAuthenticationForm, UserProfileUpdateForm, UserRegisterForm
+from .hashing import amake_password
+from .profile_cache import get_cached_card, render_card
+from .routers import replica_aliases
+from .throttling import posted_field, throttle
+from .uploads import image_uploads
+from .views import create_unverified_user, lookup_profile_user, mark_email_verified, update_profile
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+async def load_user(request):
+    """
+    Resolve the user (and with it the session) up front. Templates and
+    context processors read `request.user` synchronously, which must not
+    reach the database from the event loop.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+@throttle('register_ip')
+async def register(request):
+    await load_user(request)
+    if request.method == 'POST':
+        form = UserRegisterForm(request.POST)
+        # Uniqueness checks and password validators query the database
+        if await sync_to_async(form.is_valid)():
+            try:
+                # The form has built the instance; hash its password off the loop
+                user = form.instance
+                user.password = await amake_password(form.cleaned_data['password1'])
+                await sync_to_async(create_unverified_user)(user, request.get_host())
+                messages.success(request, 'Account created successfully! Please check your email to verify your account.')
+                return redirect('login')
+
+            except Exception as e:
+                logger.exception('Error during registration')
+                metrics.inc('accounts_registration_errors_total', error=type(e).__name__)
+                messages.error(request, 'An error occurred during registration. Please try again.')
+    else:
+        form = UserRegisterForm()
+    return render(request, 'accounts/register.html', {'form': form})
+
+
+async def aget_user_fresh(pk):
+    """`views.get_user_fresh()` with the async ORM."""
+    try:
+        return await User.objects.aget(pk=pk)
+    except User.DoesNotExist:
+        if not replica_aliases():
+            raise
+        return await User.objects.using(DEFAULT_DB_ALIAS).aget(pk=pk)
+
+
+async def verify_email(request, uidb64, token):
+    try:
+        uid = force_str(urlsafe_base64_decode(uidb64))
+        user = await aget_user_fresh(uid)
+    except (TypeError, ValueError, OverflowError, User.DoesNotExist):
+        user = None
+
+    if user is not None and default_token_generator.check_token(user, token):
+        if user.email_verified:
+            messages.info(request, 'Your email has already been verified.')
+        else:
+            context = {
+                'user': user,
+                'login_url': request.build_absolute_uri(reverse('login')),
+            }
+            plain_message, html_message = render_email('accounts/email/welcome.html', context)
+            await sync_to_async(mark_email_verified)(user, plain_message, html_message)
+            messages.success(request, 'Email verified successfully! You can now log in.')
+        return redirect('login')
+    messages.error(request, 'The verification link is invalid or has expired.')
+    return redirect('verification_failed')
+
+
+def login_redirect_url(request, user):
+    """The `next` URL if it is safe, else the user's own profile (as CustomLoginView does)."""
+    url = request.POST.get('next', request.GET.get('next', ''))
+    if url_has_allowed_host_and_scheme(url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        return url
+    return reverse('profile', kwargs={'username': user.username})
+
+
+# Throttled before the form runs, so rejected attempts never hash a password
+@throttle('login_ip')
+@throttle('login_identifier', key=posted_field('username'))
+async def login(request):
+    await load_user(request)
+    if request.method == 'POST':
+        form = CustomAuthenticationForm(request, data=request.POST)
+        if await form.ais_valid():
+            user = form.get_user()
+            if not user.email_verified:
+                messages.warning(request, 'Please verify your email before logging in.')
+                return redirect('login')
+            await alogin(request, user)
+            return redirect(login_redirect_url(request, user))
+    else:
+        form = CustomAuthenticationForm(request)
+    context = {'form': form, 'next': request.POST.get('next', request.GET.get('next', ''))}
+    return render(request, 'accounts/login.html', context)
+
+
+async def custom_logout(request):
+    # alogout() flushes the whole session (row and cache entry) in one go
+    await alogout(request)
+    messages.success(request, 'You have been successfully logged out.')
+    return redirect('login')
+
+
+@login_required
+@image_uploads
+async def profile(request, username=None):
+    current = await load_user(request)
+    if username and request.method == 'GET' and username.lower() != current.username.lower():
+        # Someone else's profile: serve the card from cache without touching the DB
+        card = await sync_to_async(get_cached_card, thread_sensitive=False)(username)
+        if card is not None:
+            context = {
+                'profile_card': mark_safe(card),
+                'is_self': False,
+                'form': None,
+            }
+            return render(request, 'accounts/profile.html', context)
+
+    if username and username == current.username:
+        # Your own profile: request.user is already loaded
+        user = current
+        is_self = True
+    elif username:
+        user = await sync_to_async(lookup_profile_user)(username)
+        if user.username != username:
+            return redirect('profile', username=user.username)
+        is_self = current == user
+    else:
+        user = current
+        is_self = True
+
+    if request.method == 'POST' and is_self:
+        form = UserProfileUpdateForm(
+            request.POST, request.FILES, instance=user, upload_errors=getattr(request, 'upload_errors', None),
+        )
+        if await sync_to_async(update_profile)(form, user):
+            messages.success(request, 'Your profile has been updated.')
+            return redirect('profile', username=user.username)
+    elif is_self:
+        form = UserProfileUpdateForm(instance=user)
+    else:
+        form = None
+
+    context = {
+        'profile_user': user,
+        'is_self': is_self,
+        'form': form,
+    }
+    if not is_self:
+        context['profile_card'] = mark_safe(await sync_to_async(render_card, thread_sensitive=False)(user))
+    return render(request, 'accounts/profile.html', context)
+
+
+@login_required
+@image_uploads
+async def profile_edit(request):
+    return await profile(request)
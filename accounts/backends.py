@@ -0,0 +1,72 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from . import user_cache
+from .hashing import acheck_password, amake_password
+
+UserModel = get_user_model()
+
+
+class EmailOrUsernameModelBackend(ModelBackend):
+    """
+    Authenticate with either a username or an email address.
+
+    Both identifiers are resolved in one query: an exact match on the unique
+    username index OR'ed with a match on the Lower(email) index. When both
+    match different accounts, an identifier containing "@" prefers the email
+    match, mirroring how the login form has always behaved.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        candidates = list(UserModel._default_manager.filter_by_identifier(username)[:2])
+        user = self.pick_user(username, candidates)
+        if user is None:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user (#20760).
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        """The same lookup with the async ORM; the password is hashed without blocking the event loop."""
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        candidates = [user async for user in UserModel._default_manager.filter_by_identifier(username)[:2]]
+        user = self.pick_user(username, candidates)
+        if user is None:
+            await amake_password(password)
+            return None
+        if await acheck_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        """The session's user, from `accounts.user_cache` rather than a query per request."""
+        if not user_cache.enabled():
+            # Other workers' invalidations would not reach a per-process cache
+            return super().get_user(user_id)
+        try:
+            user = user_cache.get_user(UserModel, user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
+
+    @staticmethod
+    def pick_user(identifier, candidates):
+        if len(candidates) < 2:
+            return candidates[0] if candidates else None
+        by_username = next(u for u in candidates if u.username == identifier)
+        by_email = next(u for u in candidates if u is not by_username)
+        return by_email if '@' in identifier else by_username
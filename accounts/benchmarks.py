@@ -0,0 +1,257 @@
+"""
+Per-view benchmarks: latency percentiles and SQL query counts for every URL
+in `accounts/urls.py`, driven through the test client against a seeded
+database.
+
+Each `Scenario` declares a query budget. `run_scenarios` measures them and
+`check_results` flags budget overruns and regressions against a stored
+baseline. `manage.py benchmark_views` runs this at several database sizes
+and `accounts.tests.ViewQueryBudgetTests` enforces the budgets in the test
+suite. Both run with `USER_CACHE_ENABLED` and `PROFILE_CACHE_ENABLED`, as a
+deployment with a shared cache does.
+"""
+import itertools
+import json
+import statistics
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import search
+from .models import CustomUser
+from .pagination import encode_cursor
+
+PASSWORD = 'Bench-password-123'
+SEED_PREFIX = 'seed'
+# Latency regressions smaller than this are treated as noise
+NOISE_FLOOR_MS = 2.0
+# Not counted against budgets: they differ between autocommit and the
+# savepoints a TestCase wraps everything in.
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+def seed_users(total, batch_size=5000):
+    """Grow the seeded population to `total` users (all verified, one shared password hash)."""
+    existing = CustomUser.objects.filter(username__startswith=SEED_PREFIX).count()
+    encoded = make_password(PASSWORD)
+    for start in range(existing, total, batch_size):
+        users = [
+            CustomUser(
+                username=f'{SEED_PREFIX}{i}', email=f'{SEED_PREFIX}{i}@example.com',
+                first_name='Seed', last_name=f'User{i}', password=encoded, email_verified=True,
+            )
+            for i in range(start, min(start + batch_size, total))
+        ]
+        CustomUser.objects.bulk_create(users, batch_size=batch_size)
+    if total > existing:
+        search.rebuild(CustomUser, 'default')
+
+
+class Context:
+    """State shared by the scenarios of one run."""
+
+    def __init__(self, size):
+        self.size = size
+        self.counter = itertools.count()
+        self.client = Client()
+        # Someone in the middle of the table, so lookups aren't trivially cached pages
+        self.user = CustomUser.objects.get(username=f'{SEED_PREFIX}{size // 2}')
+        self.other = CustomUser.objects.get(username=f'{SEED_PREFIX}{size // 3}')
+
+    def unique(self):
+        return f'bench{next(self.counter)}_{time.monotonic_ns()}'
+
+    def login(self):
+        # Staying logged in between requests, as a real client does, keeps the
+        # user cache warm; a fresh login saves last_login and invalidates it.
+        if self.client.session.get(SESSION_KEY) != str(self.user.pk):
+            self.client.force_login(self.user)
+
+    def logout(self):
+        self.client.logout()
+
+    def unverified_user(self):
+        name = self.unique()
+        return CustomUser.objects.create_user(name, f'{name}@example.com', PASSWORD)
+
+
+class Scenario:
+    """
+    One request to benchmark. `prepare(ctx)` runs before every measured
+    request, outside the timing and query count, and returns the request's
+    `(path, data)`.
+    """
+
+    def __init__(self, name, method, budget, prepare, expect=(200,)):
+        self.name = name
+        self.method = method
+        self.budget = budget
+        self.prepare = prepare
+        self.expect = expect
+
+    def request(self, ctx, path, data):
+        return getattr(ctx.client, self.method)(path, data or {})
+
+
+def _anonymous(url_name, *args, data=None):
+    def prepare(ctx):
+        ctx.logout()
+        return reverse(url_name, args=args), data(ctx) if callable(data) else data
+    return prepare
+
+
+def _logged_in(path_func, data=None):
+    def prepare(ctx):
+        ctx.login()
+        return path_func(ctx), data(ctx) if callable(data) else data
+    return prepare
+
+
+def _register_data(ctx):
+    name = ctx.unique()
+    return {
+        'username': name, 'email': f'{name}@example.com', 'first_name': 'Bench', 'last_name': 'Mark',
+        'user_type': 'community', 'password1': PASSWORD, 'password2': PASSWORD,
+    }
+
+
+def _verify_email(ctx):
+    ctx.logout()
+    user = ctx.unverified_user()
+    return reverse('verify-email', args=[user.get_uid(), default_token_generator.make_token(user)]), None
+
+
+def _login_post(ctx):
+    ctx.logout()
+    return reverse('login'), {'username': ctx.user.username, 'password': PASSWORD}
+
+
+def _reset_confirm(ctx):
+    ctx.logout()
+    return reverse('password_reset_confirm', args=[ctx.user.get_uid(), default_token_generator.make_token(ctx.user)]), None
+
+
+def _profile_other_cold(ctx):
+    ctx.login()
+    cache.clear()
+    ctx.login()  # the session lived in the cache too
+    return reverse('profile', args=[ctx.other.username]), None
+
+
+def _directory_page(ctx):
+    # A page deep into the filtered list, reached through its cursor
+    cursor = encode_cursor(ctx.user.date_joined, ctx.user.pk)
+    return {'user_type': 'community', 'email_verified': 'true', 'cursor': cursor}
+
+
+def _profile_update(ctx):
+    return {'first_name': 'Seed', 'last_name': ctx.unique()[:30], 'bio': 'Benchmarking'}
+
+
+SCENARIOS = [
+    Scenario('register GET', 'get', 0, _anonymous('register')),
+    Scenario('register POST', 'post', 7, _anonymous('register', data=_register_data), expect=(302,)),
+    Scenario('verify_email', 'get', 3, _verify_email, expect=(302,)),
+    Scenario('verification_failed', 'get', 0, _anonymous('verification_failed')),
+    Scenario('login GET', 'get', 0, _anonymous('login')),
+    Scenario('login POST', 'post', 4, _login_post, expect=(302,)),
+    Scenario('logout', 'get', 2, _logged_in(lambda ctx: reverse('logout')), expect=(302,)),
+    Scenario('password_reset GET', 'get', 0, _anonymous('password_reset')),
+    Scenario('password_reset POST', 'post', 3, _anonymous('password_reset', data=lambda ctx: {'email': ctx.user.email}), expect=(302,)),
+    Scenario('password_reset_done', 'get', 0, _anonymous('password_reset_done')),
+    Scenario('password_reset_confirm', 'get', 3, _reset_confirm, expect=(302,)),
+    Scenario('password_reset_complete', 'get', 0, _anonymous('password_reset_complete')),
+    Scenario('profile (own)', 'get', 0, _logged_in(lambda ctx: reverse('profile_edit'))),
+    Scenario('profile (other, cached)', 'get', 0, _logged_in(lambda ctx: reverse('profile', args=[ctx.other.username]))),
+    Scenario('profile (other, cold)', 'get', 2, _profile_other_cold),
+    Scenario('profile update POST', 'post', 4, _logged_in(lambda ctx: reverse('profile_edit'), data=_profile_update), expect=(302,)),
+    Scenario('search', 'get', 2, _logged_in(lambda ctx: reverse('search_users'), data={'q': 'seed user1'})),
+    Scenario('directory', 'get', 1, _logged_in(lambda ctx: reverse('user_directory'))),
+    Scenario('directory (filtered, by cursor)', 'get', 1, _logged_in(lambda ctx: reverse('user_directory'), data=_directory_page)),
+    Scenario('test_email', 'get', 0, _anonymous('test_email'), expect=(302,)),
+]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def count_queries(captures):
+    return sum(
+        not query['sql'].startswith(TRANSACTION_STATEMENTS)
+        for capture in captures for query in capture.captured_queries
+    )
+
+
+def measure(scenario, ctx, iterations):
+    """Run `scenario` `iterations` times (after one warm-up) and summarise it."""
+    timings, queries = [], []
+    for i in range(iterations + 1):
+        path, data = scenario.prepare(ctx)
+        with ExitStack() as stack:
+            captures = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            started = time.perf_counter()
+            response = scenario.request(ctx, path, data)
+            elapsed = time.perf_counter() - started
+        if response.status_code not in scenario.expect:
+            raise AssertionError(
+                f'{scenario.name}: expected status {scenario.expect}, got {response.status_code}'
+            )
+        if i:  # the first request warms caches and template loaders
+            timings.append(elapsed * 1000)
+            queries.append(count_queries(captures))
+    timings.sort()
+    return {
+        'queries': max(queries),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+    }
+
+
+def run_scenarios(size, iterations, scenarios=SCENARIOS):
+    ctx = Context(size)
+    return {scenario.name: measure(scenario, ctx, iterations) for scenario in scenarios}
+
+
+def check_results(results, baseline=None, tolerance=0.5, scenarios=SCENARIOS):
+    """
+    Return a list of failure messages: query budget overruns, more queries
+    than the baseline, or a p50 more than `tolerance` slower than baseline.
+    """
+    budgets = {scenario.name: scenario.budget for scenario in scenarios}
+    failures = []
+    for name, result in results.items():
+        if result['queries'] > budgets[name]:
+            failures.append(f'{name}: {result["queries"]} queries, budget is {budgets[name]}')
+        base = (baseline or {}).get(name)
+        if not base:
+            continue
+        if result['queries'] > base['queries']:
+            failures.append(f'{name}: {result["queries"]} queries, baseline was {base["queries"]}')
+        slower = result['p50_ms'] - base['p50_ms']
+        if slower > NOISE_FLOOR_MS and result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            failures.append(f'{name}: p50 {result["p50_ms"]} ms, baseline was {base["p50_ms"]} ms')
+    return failures
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, baseline):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
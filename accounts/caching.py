@@ -0,0 +1,20 @@
+"""
+Whether a cache is seen by every worker process.
+
+Invalidation through the cache (accounts.profile_cache,
+accounts.session_backend, accounts.user_cache) only reaches the other workers
+when they all talk to the same cache. The default LocMem cache is private to
+each process.
+"""
+from django.conf import settings
+
+# Backends whose entries live in one process's memory, or nowhere
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared(alias='default'):
+    """True for Redis, Memcached, database and file caches."""
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_BACKENDS
@@ -0,0 +1,36 @@
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+
+def is_busy_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_busy(func):
+    """
+    Retry a write a few times with backoff when SQLite reports it is locked.
+
+    Only retries at the outermost level: inside an atomic block the
+    enclosing transaction has already failed and must be retried as a
+    whole, so the error is re-raised there. Wrap the function that opens
+    the transaction.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = getattr(settings, 'DATABASE_BUSY_RETRIES', 3)
+        backoff = getattr(settings, 'DATABASE_BUSY_BACKOFF', 0.05)
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt >= retries or connection.in_atomic_block or not is_busy_error(e):
+                    raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+    return wrapper
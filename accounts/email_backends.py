@@ -0,0 +1,334 @@
+import os
+import re
+import smtplib
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.mail.backends import smtp
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+from . import metrics
+# Errors that concern a single message: the connection stays usable and the
+# relay is clearly up, so they neither poison the pool nor trip the breaker.
+from .outbox import MESSAGE_ERRORS
+
+
+def sendmail_pipelined(connection, from_addr, to_addrs, msg):
+    """
+    `SMTP.sendmail()` with ESMTP PIPELINING (RFC 2920): MAIL, every RCPT and
+    DATA go out in one write and their replies are read together, so a
+    message costs two round-trips instead of three plus one per recipient.
+    Relays that don't advertise PIPELINING get the stock `sendmail()`.
+    Returns the refused recipients, like `sendmail()`.
+    """
+    connection.ehlo_or_helo_if_needed()
+    if not connection.has_extn('pipelining'):
+        return connection.sendmail(from_addr, to_addrs, msg)
+    options = f' SIZE={len(msg)}' if connection.has_extn('size') else ''
+    commands = [f'MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}']
+    commands += [f'RCPT TO:{smtplib.quoteaddr(to)}' for to in to_addrs]
+    commands.append('DATA')
+    connection.send(''.join(f'{command}\r\n' for command in commands))
+
+    mail_reply = connection.getreply()
+    refused = {}
+    for to in to_addrs:
+        code, response = connection.getreply()
+        if code not in (250, 251):
+            refused[to] = (code, response)
+    data_reply = connection.getreply()
+    if data_reply[0] == 354 and (mail_reply[0] != 250 or len(refused) == len(to_addrs)):
+        # The relay should have refused DATA here; end the empty message it is waiting for
+        connection.send(b'.\r\n')
+        data_reply = connection.getreply()
+    if mail_reply[0] != 250:
+        _abort(connection, mail_reply[0])
+        raise smtplib.SMTPSenderRefused(*mail_reply, from_addr)
+    if len(refused) == len(to_addrs):
+        _abort(connection, data_reply[0])
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if data_reply[0] != 354:
+        _abort(connection, data_reply[0])
+        raise smtplib.SMTPDataError(*data_reply)
+
+    # Dot-stuffing, as SMTP.data() does
+    data = re.sub(br'(?m)^\.', b'..', msg)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    connection.send(data + b'.\r\n')
+    code, response = connection.getreply()
+    if code != 250:
+        _abort(connection, code)
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+def _abort(connection, code):
+    """End a failed mail transaction the way `sendmail()` does."""
+    if code == 421:
+        connection.close()
+        return
+    try:
+        connection.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+class CircuitOpenError(smtplib.SMTPException):
+    """Raised instead of connecting while the relay is considered down."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `threshold` failures in a row the circuit opens and every caller
+    fails fast for `reset_timeout` seconds. Then a single trial call is let
+    through: success closes the circuit, failure re-opens it.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Per-process pool of authenticated SMTP connections to one relay.
+
+    At most `size` idle connections are kept; extra connections released
+    under load are closed rather than queued, so callers never block on the
+    pool. Connections idle for longer than `max_idle` seconds are dropped,
+    and ones idle for a while are checked with NOOP before reuse.
+    """
+    NOOP_AFTER = 15
+
+    def __init__(self, size, max_idle, max_messages, breaker):
+        self.size = size
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.breaker = breaker
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, connect):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.max_idle:
+                self._discard(connection)
+                continue
+            if idle_for > self.NOOP_AFTER:
+                try:
+                    if connection.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected()
+                except (OSError, smtplib.SMTPException):
+                    self._discard(connection)
+                    continue
+            return connection
+        connection = connect()
+        connection.pooled_sent = 0
+        return connection
+
+    def release(self, connection, reusable=True):
+        if reusable and connection.pooled_sent < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((connection, time.monotonic()))
+                    return
+        self._discard(connection)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.quit()
+        except (OSError, smtplib.SMTPException):
+            connection.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def use_certifi_bundle():
+    """
+    Verify TLS against certifi's CA bundle, if it is installed and
+    SSL_CERT_FILE isn't set already. Called before connecting rather than
+    from settings, so workers that never send mail don't import certifi.
+    """
+    if 'SSL_CERT_FILE' in os.environ:
+        return
+    try:
+        import certifi
+    except ImportError:
+        return
+    os.environ['SSL_CERT_FILE'] = certifi.where()
+
+
+def get_pool(backend):
+    """Return the pool for the backend's relay, creating it on first use in this process."""
+    key = (os.getpid(), backend.host, backend.port, backend.username, backend.use_tls, backend.use_ssl)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            breaker = CircuitBreaker(
+                getattr(settings, 'EMAIL_CIRCUIT_BREAKER_THRESHOLD', 5),
+                getattr(settings, 'EMAIL_CIRCUIT_BREAKER_RESET', 30),
+            )
+            pool = _pools[key] = SMTPConnectionPool(
+                getattr(settings, 'EMAIL_POOL_SIZE', 4),
+                getattr(settings, 'EMAIL_POOL_MAX_IDLE', 300),
+                getattr(settings, 'EMAIL_POOL_MAX_MESSAGES', 100),
+                breaker,
+            )
+        return pool
+
+
+def reset_pools():
+    """Close every pooled connection and forget all breaker state."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.clear()
+
+
+class PooledEmailBackend(smtp.EmailBackend):
+    """
+    Drop-in replacement for Django's SMTP backend that reuses connections.
+
+    `open()` borrows an already authenticated connection from the process
+    pool and `close()` hands it back, so `EmailMessage.send()` and batches
+    passed to `send_messages()` skip the connect/STARTTLS/AUTH round-trips,
+    and each message's commands are pipelined where the relay allows it.
+    While the circuit breaker is open, `open()` raises `CircuitOpenError`
+    immediately instead of waiting on a dead relay.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = get_pool(self)
+        self._broken = False
+
+    def open(self):
+        if self.connection:
+            return False
+        if not self.pool.breaker.allow():
+            metrics.inc('accounts_smtp_failures_total', kind='circuit_open')
+            if self.fail_silently:
+                return None
+            raise CircuitOpenError(f"SMTP relay {self.host}:{self.port} is unavailable; not connecting")
+        try:
+            self.connection = self.pool.acquire(self._connect)
+        except OSError:
+            metrics.inc('accounts_smtp_failures_total', kind='connect')
+            self.pool.breaker.record_failure()
+            if not self.fail_silently:
+                raise
+            return None
+        if self.pool.breaker.state != CircuitBreaker.CLOSED:
+            # The half-open trial got a working connection: the relay is back.
+            self.pool.breaker.record_success()
+        self._broken = False
+        return True
+
+    def _connect(self):
+        use_certifi_bundle()
+        connection_params = {"local_hostname": DNS_NAME.get_fqdn()}
+        if self.timeout is not None:
+            connection_params["timeout"] = self.timeout
+        if self.use_ssl:
+            connection_params["context"] = self.ssl_context
+        connection = self.connection_class(self.host, self.port, **connection_params)
+        try:
+            if not self.use_ssl and self.use_tls:
+                connection.starttls(context=self.ssl_context)
+            if self.username and self.password:
+                connection.login(self.username, self.password)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        self.pool.release(connection, reusable=not self._broken)
+
+    def send_messages(self, email_messages):
+        """Send in chunks so no connection carries more than EMAIL_POOL_MAX_MESSAGES."""
+        email_messages = list(email_messages)
+        step = self.pool.max_messages
+        return sum(
+            super(PooledEmailBackend, self).send_messages(email_messages[i:i + step])
+            for i in range(0, len(email_messages), step)
+        )
+
+    def _send(self, email_message):
+        if not email_message.recipients():
+            return False
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [sanitize_address(addr, encoding) for addr in email_message.recipients()]
+        message = email_message.message()
+        try:
+            with metrics.timed('accounts_smtp_send_duration_seconds'):
+                sendmail_pipelined(self.connection, from_email, recipients, message.as_bytes(linesep="\r\n"))
+        except MESSAGE_ERRORS:
+            metrics.inc('accounts_smtp_failures_total', kind='message')
+            if not self.fail_silently:
+                raise
+            return False
+        except OSError:
+            # Timeouts and disconnects: the connection is unusable and the
+            # relay may be down.
+            metrics.inc('accounts_smtp_failures_total', kind='connection')
+            self._broken = True
+            self.pool.breaker.record_failure()
+            if not self.fail_silently:
+                raise
+            return False
+        self.connection.pooled_sent += 1
+        self.pool.breaker.record_success()
+        return True
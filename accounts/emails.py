@@ -0,0 +1,82 @@
+import html
+import re
+from functools import lru_cache
+
+from django.template import Context, engines
+from django.utils.html import strip_tags
+
+# Blocks whose text content must not end up in the plain-text part.
+NON_TEXT_BLOCKS = re.compile(r'<(head|style|script)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+# Tags that end a line of text.
+LINE_BREAKS = re.compile(r'<br\s*/?>|</(p|div|h[1-6]|li|tr|ul|ol|table|center)\s*>', re.IGNORECASE)
+BLANK_LINES = re.compile(r'\n\s*\n+')
+# Links, whose target would otherwise be stripped along with the tag.
+LINKS = re.compile(r'<a\b[^>]*?\bhref\s*=\s*(["\'])(.*?)\1[^>]*>(.*?)</a\s*>', re.IGNORECASE | re.DOTALL)
+
+
+def _link_text(match):
+    href, label = match[2], ' '.join(match[3].split())
+    return f'{label} ({href})' if label and label != href else href
+
+
+def plain_text_source(source):
+    """
+    Turn an HTML email template's source into a plain-text template source.
+
+    Tags are stripped once here, at compile time, instead of running
+    `strip_tags` over every rendered message; a link keeps its target after
+    its label. Template tags and variables pass through untouched, and the
+    result is rendered without autoescaping since it is not HTML.
+    """
+    text = NON_TEXT_BLOCKS.sub('', source)
+    text = LINKS.sub(_link_text, text)
+    text = LINE_BREAKS.sub('\n', text)
+    text = html.unescape(strip_tags(text))
+    lines = [line.strip() for line in text.splitlines()]
+    text = BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+    return '{% autoescape off %}' + text + '\n{% endautoescape %}'
+
+
+class EmailTemplate:
+    """An HTML email template and its derived plain-text twin, compiled once."""
+
+    def __init__(self, name):
+        engine = engines['django']
+        self.name = name
+        self.html = engine.get_template(name).template
+        self.text = engine.from_string(plain_text_source(self.html.source)).template
+
+    def render(self, context):
+        """Return `(plain_text, html)` for one context dict."""
+        return self.render_batch([context])[0]
+
+    def render_batch(self, contexts):
+        """
+        Render `(plain_text, html)` pairs for many recipients.
+
+        One template Context is reused across the batch and each recipient's
+        variables are pushed on top of it, so per-message work is just the
+        two template renders.
+        """
+        results = []
+        context = Context(autoescape=True)
+        for values in contexts:
+            with context.push(values):
+                results.append((self.text.render(context), self.html.render(context)))
+        return results
+
+
+@lru_cache(maxsize=None)
+def get_email_template(name):
+    """Return the compiled `EmailTemplate` for `name`, compiling it on first use in this process."""
+    return EmailTemplate(name)
+
+
+def render_email(name, context):
+    """Render the email template `name` and return `(plain_text, html)`."""
+    return get_email_template(name).render(context)
+
+
+def render_email_batch(name, contexts):
+    """Render the email template `name` once per context; returns a list of `(plain_text, html)`."""
+    return get_email_template(name).render_batch(contexts)
@@ -1,8 +1,12 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordResetForm, SetPasswordForm, PasswordChangeForm
-from django.contrib.auth import password_validation
+from django.contrib.auth import aauthenticate, password_validation
+from django.db import transaction
+from django.template import loader
 from django.utils.translation import gettext_lazy as _
 from .models import CustomUser
+from .emails import render_email
+from .outbox import enqueue_email
 
 
 class UserRegisterForm(UserCreationForm):
@@ -16,24 +20,37 @@ class UserRegisterForm(UserCreationForm):
     
     def clean_email(self):
         email = self.cleaned_data.get('email')
-        if CustomUser.objects.filter(email=email).exists():
+        if CustomUser.objects.filter_by_email(email).exists():
             raise forms.ValidationError("This email is already in use.")
         return email
 
 
 class CustomAuthenticationForm(AuthenticationForm):
+    # Emails are resolved by accounts.backends.EmailOrUsernameModelBackend
     username = forms.CharField(label='Username or Email', widget=forms.TextInput(attrs={'autofocus': True}))
-    
-    def clean_username(self):
-        username = self.cleaned_data.get('username')
-        # Allow login with email
-        if '@' in username:
+
+    _defer_authentication = False
+
+    def clean(self):
+        if self._defer_authentication:
+            return self.cleaned_data
+        return super().clean()
+
+    async def ais_valid(self):
+        """`is_valid()` for async views: credentials are checked with `aauthenticate()`."""
+        self._defer_authentication = True
+        if not self.is_valid():
+            return False
+        username, password = self.cleaned_data.get('username'), self.cleaned_data.get('password')
+        if username is not None and password:
+            self.user_cache = await aauthenticate(self.request, username=username, password=password)
             try:
-                user = CustomUser.objects.get(email=username)
-                return user.username
-            except CustomUser.DoesNotExist:
-                pass
-        return username
+                if self.user_cache is None:
+                    raise self.get_invalid_login_error()
+                self.confirm_login_allowed(self.user_cache)
+            except forms.ValidationError as error:
+                self.add_error(None, error)
+        return not self.errors
 
 
 class CustomPasswordResetForm(PasswordResetForm):
@@ -45,10 +62,25 @@ class CustomPasswordResetForm(PasswordResetForm):
     
     def clean_email(self):
         email = self.cleaned_data.get('email')
-        if not CustomUser.objects.filter(email=email).exists():
+        if not CustomUser.objects.filter_by_email(email).exists():
             raise forms.ValidationError("No user found with this email address.")
         return email
 
+    def get_users(self, email):
+        """Like PasswordResetForm.get_users, but through the Lower(email) index instead of iexact."""
+        active_users = CustomUser.objects.filter_by_email(email).filter(is_active=True)
+        return (u for u in active_users if u.has_usable_password())
+
+    def send_mail(self, subject_template_name, email_template_name, context,
+                  from_email, to_email, html_email_template_name=None):
+        """Queue the reset email in the outbox instead of sending it inline."""
+        subject = loader.render_to_string(subject_template_name, context)
+        # Email subject *must not* contain newlines
+        subject = ''.join(subject.splitlines())
+        # Both parts come from the HTML template; the plain one is pre-stripped
+        body, html_body = render_email(html_email_template_name or email_template_name, context)
+        enqueue_email(subject, body, [to_email], html_body, from_email)
+
 
 class CustomSetPasswordForm(SetPasswordForm):
     new_password1 = forms.CharField(
@@ -72,6 +104,34 @@ class UserProfileUpdateForm(forms.ModelForm):
             'bio': forms.Textarea(attrs={'rows': 4}),
         }
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, upload_errors=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['email'].disabled = True  # Email can't be changed directly
+        # Files refused while they were uploaded (accounts.uploads), by field
+        self.upload_errors = upload_errors or {}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for field, error in self.upload_errors.items():
+            if field in self.fields:
+                self.add_error(field, error)
+        return cleaned_data
+
+    def save(self, commit=True):
+        if 'profile_picture' in self.changed_data:
+            # Variants belong to the previous picture; new ones are rendered in the background
+            previous = self.initial.get('profile_picture')
+            released = list(self.instance.avatar_variants.values())
+            if previous:
+                released.append(previous.name)
+            self.instance.avatar_variants = {}
+            storage = self.instance._meta.get_field('profile_picture').storage
+            # Only once the row stops pointing at them: a rolled-back save
+            # must leave the old picture's references in place.
+            transaction.on_commit(lambda: release_media(storage, released))
+        return super().save(commit)
+
+
+def release_media(storage, names):
+    for name in names:
+        storage.delete(name)
@@ -0,0 +1,234 @@
+import asyncio
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing import get_context
+
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import (
+    PBKDF2PasswordHasher, get_hasher, identify_hasher, make_password, verify_password,
+)
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+
+from . import metrics
+
+DEFAULT_POOL = {
+    'WORKERS': 2,  # processes; 0 hashes inline in the calling thread
+    'MAX_PENDING': 32,  # hashes queued or running before new ones are shed
+    'TIMEOUT': 5,  # seconds to wait for a queued hash
+}
+
+
+class HashingOverloaded(Exception):
+    """Raised instead of queueing a hash when the pool is saturated."""
+
+
+def pbkdf2_worker(digest_name, password, salt, iterations):
+    # Top-level so the spawn-based pool can pickle it by reference.
+    return hashlib.pbkdf2_hmac(digest_name, password, salt, iterations)
+
+
+class HashingService:
+    """
+    Runs PBKDF2 on a bounded process pool.
+
+    The calling thread waits on a future, so it releases the GIL while the
+    hash is computed elsewhere. At most `MAX_PENDING` hashes may be queued or
+    running at once; beyond that `HashingOverloaded` is raised immediately
+    rather than letting the queue (and the latency of every login) grow.
+    """
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'))
+            return self._executor
+
+    def pbkdf2(self, password, salt, iterations, digest_name):
+        password, salt = force_bytes(password), force_bytes(salt)
+        if not self.workers:
+            return pbkdf2_worker(digest_name, password, salt, iterations)
+        future = self._submit(digest_name, password, salt, iterations)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingOverloaded("Timed out waiting for the password hashing pool")
+
+    async def apbkdf2(self, password, salt, iterations, digest_name):
+        """Like `pbkdf2()`, but awaits the pool instead of blocking a thread on it."""
+        password, salt = force_bytes(password), force_bytes(salt)
+        if not self.workers:
+            return await sync_to_async(pbkdf2_worker, thread_sensitive=False)(digest_name, password, salt, iterations)
+        future = self._submit(digest_name, password, salt, iterations)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise HashingOverloaded("Timed out waiting for the password hashing pool")
+
+    def _submit(self, digest_name, password, salt, iterations):
+        # The slot is held until the job is done, not until the caller stops
+        # waiting: cancel() cannot stop a job the pool has already started.
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded("Too many password hashes in progress")
+        try:
+            future = self.executor.submit(pbkdf2_worker, digest_name, password, salt, iterations)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_service = None
+_service_pid = None
+_service_lock = threading.Lock()
+
+
+def get_hashing_service():
+    global _service, _service_pid
+    with _service_lock:
+        # A pool started before a fork (e.g. warmed up in a preloading
+        # master) belongs to the parent; each process gets its own.
+        if _service is None or _service_pid != os.getpid():
+            config = {**DEFAULT_POOL, **getattr(settings, 'PASSWORD_HASHING_POOL', {})}
+            _service = HashingService(config['WORKERS'], config['MAX_PENDING'], config['TIMEOUT'])
+            _service_pid = os.getpid()
+        return _service
+
+
+@receiver(setting_changed)
+def reset_hashing_service(*, setting, **kwargs):
+    global _service
+    if setting == 'PASSWORD_HASHING_POOL':
+        with _service_lock:
+            if _service is not None:
+                _service.shutdown()
+            _service = None
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the key derivation run by the
+    `HashingService` pool.
+
+    Keeps the `pbkdf2_sha256` algorithm name and encoding, so existing
+    password hashes verify unchanged. It must replace, not precede,
+    `PBKDF2PasswordHasher` in `PASSWORD_HASHERS`.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        with metrics.timed('accounts_password_hash_duration_seconds', algorithm=self.algorithm):
+            hash = get_hashing_service().pbkdf2(password, salt, iterations, self.digest().name)
+        return format_pbkdf2(self.algorithm, iterations, salt, hash)
+
+    async def aencode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        with metrics.timed('accounts_password_hash_duration_seconds', algorithm=self.algorithm):
+            hash = await get_hashing_service().apbkdf2(password, salt, iterations, self.digest().name)
+        return format_pbkdf2(self.algorithm, iterations, salt, hash)
+
+
+async def amake_password(password):
+    """`make_password()` for async code: the event loop never runs the hash itself."""
+    hasher = get_hasher('default')
+    if isinstance(hasher, PooledPBKDF2PasswordHasher) and password is not None:
+        return await hasher.aencode(password, hasher.salt())
+    return await sync_to_async(make_password, thread_sensitive=False)(password)
+
+
+async def acheck_password(user, password):
+    """
+    `user.check_password()` for async code, including the upgrade of an
+    outdated hash. Django's own `acheck_password()` hashes on the event loop.
+    """
+    encoded = user.password
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        hasher = None
+    if isinstance(hasher, PooledPBKDF2PasswordHasher) and password is not None:
+        decoded = hasher.decode(encoded)
+        is_correct = constant_time_compare(
+            encoded, await hasher.aencode(password, decoded['salt'], decoded['iterations'])
+        )
+        preferred = get_hasher('default')
+        must_update = preferred.algorithm != hasher.algorithm or preferred.must_update(encoded)
+    else:
+        is_correct, must_update = await sync_to_async(verify_password, thread_sensitive=False)(password, encoded)
+    if is_correct and must_update:
+        user.password = await amake_password(password)
+        await user.asave(update_fields=['password'])
+    return is_correct
+
+
+def format_pbkdf2(algorithm, iterations, salt, hash):
+    hash = base64.b64encode(hash).decode("ascii").strip()
+    return "%s$%d$%s$%s" % (algorithm, iterations, salt, hash)
+
+
+class BulkPasswordHasher:
+    """
+    Hashes many passwords in parallel on a dedicated process pool, for bulk
+    imports. Unlike `HashingService` it never sheds work: the caller
+    decides how much to submit at once.
+
+    PBKDF2 hashers run on the pool; any other default hasher (or
+    `workers=0`) hashes inline with `make_password`.
+    """
+
+    def __init__(self, workers):
+        self.hasher = get_hasher('default')
+        self.executor = None
+        if workers and isinstance(self.hasher, PBKDF2PasswordHasher):
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+
+    def submit(self, passwords):
+        """Start hashing `passwords`; pass the result to `collect()` for the encoded hashes."""
+        if self.executor is None:
+            return [make_password(password, hasher=self.hasher) for password in passwords]
+        hasher, iterations = self.hasher, self.hasher.iterations
+        pending = []
+        for password in passwords:
+            salt = hasher.salt()
+            future = self.executor.submit(
+                pbkdf2_worker, hasher.digest().name, force_bytes(password), force_bytes(salt), iterations
+            )
+            pending.append((salt, future))
+        return pending
+
+    def collect(self, pending):
+        if self.executor is None:
+            return pending
+        return [
+            format_pbkdf2(self.hasher.algorithm, self.hasher.iterations, salt, future.result())
+            for salt, future in pending
+        ]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,182 @@
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from multiprocessing import get_context
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics
+from .profile_cache import invalidate_profile
+from .user_cache import invalidate_users
+
+logger = logging.getLogger(__name__)
+
+# (variant key, Pillow format, save options)
+AVATAR_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def avatar_sizes():
+    return tuple(getattr(settings, 'AVATAR_SIZES', (64, 128, 256)))
+
+
+def render_avatar_variants(data, sizes, max_dimension):
+    """
+    Decode an uploaded image and return re-encoded variants as bytes.
+
+    Runs in a worker process, so it only deals in bytes: no ORM, no storage.
+    Orientation is baked in from the EXIF tag and no metadata (EXIF, ICC,
+    comments) is carried over to the outputs. Returns a dict mapping
+    `"original"` and `"<size>.<ext>"` keys to encoded bytes.
+    """
+    # Imported here: Pillow costs ~10 ms and only the avatar workers need it
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+        results = {}
+        original = image.copy()
+        original.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        results['original'] = _encode(original, 'JPEG', AVATAR_FORMATS[1][2])
+        for size in sizes:
+            square = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            for ext, fmt, options in AVATAR_FORMATS:
+                results[f'{size}.{ext}'] = _encode(square, fmt, options)
+        return results
+
+
+def _encode(image, fmt, options):
+    buffer = BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+_executor = None
+_store_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process pool avatars are rendered in, starting it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'AVATAR_WORKERS', 2),
+                mp_context=get_context('spawn'),
+            )
+        return _executor
+
+
+def get_store_executor():
+    """Return the thread that saves rendered avatars, starting it on first use."""
+    global _store_executor
+    with _executor_lock:
+        if _store_executor is None:
+            _store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='avatar-store')
+        return _store_executor
+
+
+def schedule_avatar_processing(user):
+    """Render the user's avatar variants in the process pool once the current transaction commits."""
+    pk, name = user.pk, user.profile_picture.name
+    transaction.on_commit(lambda: submit_avatar_processing(pk, name))
+
+
+def submit_avatar_processing(pk, name):
+    """Start rendering `name`; returns a future for `store_avatar_variants()`'s result."""
+    from .models import CustomUser
+
+    storage = CustomUser._meta.get_field('profile_picture').storage
+    with storage.open(name, 'rb') as f:
+        data = f.read()
+    max_dimension = getattr(settings, 'AVATAR_MAX_DIMENSION', 1024)
+    rendered = get_executor().submit(render_avatar_variants, data, avatar_sizes(), max_dimension)
+    stored = Future()
+    rendered.add_done_callback(partial(_store_from_future, pk, name, stored))
+    return stored
+
+
+def _store_from_future(pk, name, stored, rendered):
+    # Runs on the process pool's management thread, which also collects every
+    # other worker's result: hand the disk and database work to another thread.
+    get_store_executor().submit(store_rendered_avatar, pk, name, rendered, stored)
+
+
+def store_rendered_avatar(pk, name, rendered, stored):
+    """Save the variants a finished render produced into `stored`, logging and counting failures."""
+    try:
+        result = store_avatar_variants(pk, name, rendered.result())
+    except Exception as e:
+        logger.exception('Avatar processing failed for user %s (%s)', pk, name)
+        metrics.inc('accounts_avatar_processing_total', result='failed')
+        stored.set_exception(e)
+    else:
+        metrics.inc('accounts_avatar_processing_total', result='stored' if result else 'superseded')
+        stored.set_result(result)
+    finally:
+        close_old_connections()
+
+
+def store_avatar_variants(pk, name, rendered):
+    """
+    Save rendered variants and point the user at them.
+
+    The row is only updated if it still references `name`; if the user
+    uploaded another picture in the meantime the new files are discarded.
+    """
+    from .models import CustomUser
+
+    storage = CustomUser._meta.get_field('profile_picture').storage
+    stem = PurePosixPath(name).stem
+    saved = {}
+    for key, blob in rendered.items():
+        if key == 'original':
+            target = f'profile_pics/{stem}.jpg'
+        else:
+            size, ext = key.split('.')
+            target = f'profile_pics/avatars/{stem}_{size}.{ext}'
+        saved[key] = storage.save(target, ContentFile(blob))
+
+    original = saved.pop('original')
+    with transaction.atomic():
+        rows = CustomUser.objects.select_for_update().filter(pk=pk, profile_picture=name)
+        previous = rows.values_list('avatar_variants', flat=True).first()
+        updated = rows.update(
+            profile_picture=original,
+            avatar_variants=saved,
+            last_updated=timezone.now(),
+        )
+        if updated:
+            # The raw upload still carries its metadata; only the clean copy is
+            # kept. Variants rendered before (process_avatars --all) are replaced.
+            released = [name, *(previous or {}).values()]
+
+            def release():
+                for stored in released:
+                    storage.delete(stored)
+            transaction.on_commit(release)
+    if not updated:
+        for stored in [original, *saved.values()]:
+            storage.delete(stored)
+        return False
+    # update() skips post_save, so drop the cached profile card and user by hand
+    invalidate_profile(pk)
+    invalidate_users([pk])
+    return True
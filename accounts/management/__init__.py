@@ -1,4 +0,0 @@
-import os
-
-# Create the management package directories if they don't exist
-os.makedirs(os.path.dirname(__file__), exist_ok=True)
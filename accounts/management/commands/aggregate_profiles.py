@@ -0,0 +1,69 @@
+import os
+import pstats
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Merges the request profiles in PROFILING["DIR"]: prints the hottest functions and '
+        'optionally writes one combined .prof and/or .folded file'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', action='append', default=[], help='Only profiles of this URL name (repeatable)')
+        parser.add_argument('--slower-than', type=int, default=0, metavar='MS', help='Only requests that took at least this long')
+        parser.add_argument('--top', type=int, default=25, help='Rows to print')
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key for cProfile output')
+        parser.add_argument('--prof-out', help='Write the merged cProfile stats here')
+        parser.add_argument('--folded-out', help='Write the merged stack samples here (flamegraph.pl / speedscope input)')
+
+    def handle(self, *args, **options):
+        directory = profiling.config()['DIR']
+        selected = []
+        for name in profiling.profile_files(directory):
+            _, _, view, ms = profiling.parse_name(name)
+            if (not options['view'] or view in options['view']) and ms >= options['slower_than']:
+                selected.append(os.path.join(directory, name))
+        if not selected:
+            raise CommandError(f'No matching profiles in {directory}')
+
+        prof = [path for path in selected if path.endswith('.prof')]
+        folded = [path for path in selected if path.endswith('.folded')]
+        if prof:
+            stats = pstats.Stats(*prof, stream=self.stdout)
+            self.stdout.write(f'{len(prof)} cProfile profiles')
+            stats.sort_stats(options['sort']).print_stats(options['top'])
+            if options['prof_out']:
+                stats.dump_stats(options['prof_out'])
+        if folded:
+            stacks = Counter()
+            for path in folded:
+                with open(path) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        stacks[stack] += int(count)
+            self.stdout.write(f'{len(folded)} sampled profiles, {sum(stacks.values())} samples')
+            self.print_hottest(stacks, options['top'])
+            if options['folded_out']:
+                with open(options['folded_out'], 'w') as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f'{stack} {count}\n')
+
+    def print_hottest(self, stacks, top):
+        """Per-function share of samples: on the stack at all (inclusive) and at its top (self)."""
+        total = sum(stacks.values())
+        inclusive, own = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            for frame in set(frames):
+                inclusive[frame] += count
+            own[frames[-1]] += count
+        self.stdout.write(f'  {"incl":>6} {"self":>6}  function')
+        # Where the samples landed, then what called into the rest
+        ranked = sorted(inclusive, key=lambda frame: (own[frame], inclusive[frame]), reverse=True)
+        for frame in ranked[:top]:
+            self.stdout.write(f'  {inclusive[frame] / total:>6.1%} {own[frame] / total:>6.1%}  {frame}')
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from accounts import benchmarks
+
+SERVERS = ('wsgi', 'asgi')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares request capacity of the sync views behind a WSGI thread pool with the async views '
+        'on one ASGI event loop, at several numbers of concurrent clients. Each client logs in, '
+        'views two profiles and logs out, repeatedly.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[8, 32, 128],
+            help='Numbers of simultaneous clients to run with',
+        )
+        parser.add_argument('--rounds', type=int, default=3, help='Login/profile/logout rounds per client')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads (as in gunicorn --threads)')
+        parser.add_argument(
+            '--fast-hashing', action='store_true',
+            help='Use MD5 password hashing so login measures the request handling rather than PBKDF2',
+        )
+        parser.add_argument('--server', choices=SERVERS, help='Run only this side, in this process, and print JSON')
+
+    def handle(self, *args, **options):
+        if options['server']:
+            results = self.run_server(options)
+            self.stdout.write(json.dumps(results))
+            return
+
+        # urls.py picks the sync or async views at import, so each side gets its own process
+        results = {}
+        for server in SERVERS:
+            self.stdout.write(f'Running {server}...')
+            command = [
+                sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_asgi', '--server', server,
+                '--rounds', str(options['rounds']), '--threads', str(options['threads']),
+                '--concurrency', *map(str, options['concurrency']),
+            ]
+            if options['fast_hashing']:
+                command.append('--fast-hashing')
+            env = {**os.environ, 'ASYNC_VIEWS': '1' if server == 'asgi' else '0', 'WARMUP': '0'}
+            completed = subprocess.run(command, env=env, capture_output=True, text=True)
+            if completed.returncode:
+                raise CommandError(f'{server} run failed:\n{completed.stderr}')
+            results[server] = json.loads(completed.stdout.strip().splitlines()[-1])
+        self.report(results, options)
+
+    def run_server(self, options):
+        if (options['server'] == 'asgi') != settings.ASYNC_VIEWS:
+            raise CommandError('Set ASYNC_VIEWS=1 for --server asgi and ASYNC_VIEWS=0 for --server wsgi')
+        overrides = {'THROTTLE_ENABLED': False}
+        if options['fast_hashing']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        try:
+            with override_settings(**overrides):
+                benchmarks.seed_users(max(options['concurrency']) + 1)
+                run = run_wsgi if options['server'] == 'wsgi' else run_asgi
+                # One unmeasured client first, so both sides start warm
+                run(1, 1, options['threads'])
+                return {
+                    str(clients): summarize(*run(clients, options['rounds'], options['threads']))
+                    for clients in options['concurrency']
+                }
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+    def report(self, results, options):
+        self.stdout.write(f'\n{options["threads"]} WSGI threads, {options["rounds"]} rounds per client')
+        self.stdout.write(f'  {"clients":>7} {"server":<6} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"errors":>6}')
+        for clients in options['concurrency']:
+            for server in SERVERS:
+                result = results[server][str(clients)]
+                self.stdout.write(
+                    f'  {clients:>7} {server:<6} {result["throughput"]:>8.1f} '
+                    f'{result["p50_ms"]:>8.1f} {result["p99_ms"]:>8.1f} {result["errors"]:>6}'
+                )
+        self.stdout.write('')
+
+
+def session_requests(index):
+    """The requests one client makes per round: `(method, path, data, expected status)`."""
+    username = f'{benchmarks.SEED_PREFIX}{index}'
+    other = f'{benchmarks.SEED_PREFIX}{index + 1}'
+    return [
+        ('post', reverse('login'), {'username': username, 'password': benchmarks.PASSWORD}, 302),
+        ('get', reverse('profile', kwargs={'username': username}), None, 200),
+        ('get', reverse('profile', kwargs={'username': other}), None, 200),
+        ('post', reverse('logout'), None, 302),
+    ]
+
+
+def run_wsgi(clients, rounds, threads):
+    """Client threads share `threads` request slots, like requests queueing for a worker's threads."""
+    slots = threading.BoundedSemaphore(threads)
+    timings, errors = [], []
+
+    def client(index):
+        http = Client()
+        for _ in range(rounds):
+            for method, path, data, expected in session_requests(index):
+                started = time.perf_counter()
+                with slots:
+                    response = getattr(http, method)(path, data)
+                timings.append(time.perf_counter() - started)
+                if response.status_code != expected:
+                    errors.append(response.status_code)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return timings, errors, time.perf_counter() - started
+
+
+def run_asgi(clients, rounds, threads):
+    """Every client is a coroutine on one event loop; `threads` does not apply."""
+    timings, errors = [], []
+
+    async def client(index):
+        http = AsyncClient()
+        for _ in range(rounds):
+            for method, path, data, expected in session_requests(index):
+                started = time.perf_counter()
+                response = await getattr(http, method)(path, data)
+                timings.append(time.perf_counter() - started)
+                if response.status_code != expected:
+                    errors.append(response.status_code)
+
+    async def main():
+        await asyncio.gather(*(client(index) for index in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return timings, errors, time.perf_counter() - started
+
+
+def summarize(timings, errors, elapsed):
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'throughput': round(len(timings) / elapsed, 1),
+        'p50_ms': round(benchmarks.percentile(timings, 0.5) * 1000, 2),
+        'p99_ms': round(benchmarks.percentile(timings, 0.99) * 1000, 2),
+        'errors': len(errors),
+    }
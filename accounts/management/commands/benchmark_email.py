@@ -0,0 +1,68 @@
+import time
+
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.management.base import BaseCommand
+
+from accounts.email_backends import PooledEmailBackend, reset_pools
+from accounts.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = 'Measures SMTP throughput of the stock and pooled email backends against a relay'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, nargs='+', default=[1000, 10000], help='Message counts to benchmark')
+        parser.add_argument('--host', help='SMTP relay host (default: start a local sink)')
+        parser.add_argument('--port', type=int, default=25)
+
+    def handle(self, *args, **options):
+        sink = None
+        host, port = options['host'], options['port']
+        if not host:
+            sink = SMTPSink().start()
+            host, port = sink.host, sink.port
+            self.stdout.write(f'Using local SMTP sink on {host}:{port}')
+
+        connection_args = {'host': host, 'port': port, 'username': '', 'password': '', 'use_tls': False, 'use_ssl': False}
+        scenarios = [
+            ('stock, one send() per message', self.send_individually, EmailBackend),
+            ('pooled, one send() per message', self.send_individually, PooledEmailBackend),
+            ('pooled, send_messages() batch', self.send_batch, PooledEmailBackend),
+        ]
+        try:
+            for count in options['messages']:
+                for label, run, backend_class in scenarios:
+                    reset_pools()
+                    connections_before = sink.connections if sink else 0
+                    messages = [self.build_message(i) for i in range(count)]
+                    started = time.perf_counter()
+                    run(messages, lambda: backend_class(**connection_args))
+                    elapsed = time.perf_counter() - started
+                    line = f'{count:>6} msgs  {label:<32} {elapsed:8.2f}s  {count / elapsed:9.0f} msg/s'
+                    if sink:
+                        line += f'  {sink.connections - connections_before} connections'
+                    self.stdout.write(line)
+        finally:
+            reset_pools()
+            if sink:
+                sink.stop()
+
+    @staticmethod
+    def build_message(i):
+        message = EmailMultiAlternatives(
+            'Verify your email address', 'Plain body', 'noreply@example.com', [f'user{i}@example.com']
+        )
+        message.attach_alternative('<p>HTML body</p>', 'text/html')
+        return message
+
+    @staticmethod
+    def send_individually(messages, make_backend):
+        # What the views did before the outbox: a fresh backend per message.
+        for message in messages:
+            message.connection = make_backend()
+            message.send()
+
+    @staticmethod
+    def send_batch(messages, make_backend):
+        make_backend().send_messages(messages)
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from accounts.emails import get_email_template, render_email, render_email_batch
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Compares messages rendered per second with render_to_string+strip_tags and accounts.emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='Messages to render per scenario')
+        parser.add_argument('--template', default='accounts/email/verification.html')
+
+    def handle(self, *args, **options):
+        name, count = options['template'], options['count']
+        contexts = [
+            {
+                'user': CustomUser(username=f'user{i}', first_name=f'First{i}', email=f'user{i}@example.com'),
+                'verification_url': f'http://localhost:8000/accounts/verify-email/MQ/token-{i}/',
+                'login_url': 'http://localhost:8000/accounts/login/',
+                'protocol': 'http', 'domain': 'localhost:8000', 'site_domain': 'localhost:8000',
+                'uid': 'MQ', 'token': f'token-{i}', 'site_name': 'User Management System',
+            }
+            for i in range(count)
+        ]
+        get_email_template(name)  # compile outside the timed region
+
+        def before():
+            for context in contexts:
+                html_message = render_to_string(name, context)
+                strip_tags(html_message)
+
+        def after():
+            for context in contexts:
+                render_email(name, context)
+
+        def batch():
+            render_email_batch(name, contexts)
+
+        for label, run in (
+            ('render_to_string + strip_tags', before),
+            ('render_email', after),
+            ('render_email_batch', batch),
+        ):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label:<32} {count / elapsed:9.0f} msgs/s')
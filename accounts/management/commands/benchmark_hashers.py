@@ -0,0 +1,66 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+from accounts.hashing import PooledPBKDF2PasswordHasher, get_hashing_service
+
+
+class Command(BaseCommand):
+    help = 'Measures password hashes per second for each configured hasher on this host'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=2.0, help='How long to run each measurement')
+        parser.add_argument('--target-ms', type=float, default=250.0, help='Desired time per hash, used to suggest iteration counts')
+
+    def handle(self, *args, **options):
+        seconds = options['seconds']
+        password, salt = 'correct horse battery staple', 'benchmarksalt1234'
+        cpus = os.cpu_count() or 1
+        self.stdout.write(f'{cpus} CPUs available\n')
+
+        for hasher in get_hashers():
+            try:
+                hasher.encode(password, salt)
+            except (ValueError, TypeError) as e:
+                self.stdout.write(f'{hasher.algorithm:<20} skipped ({e})')
+                continue
+
+            if isinstance(hasher, PooledPBKDF2PasswordHasher):
+                service = get_hashing_service()
+                workers = service.workers or 1
+                # Single-stream latency through the pool, then the pool saturated.
+                rate = self.measure(lambda: hasher.encode(password, salt), seconds)
+                pooled = self.measure(lambda: hasher.encode(password, salt), seconds, concurrency=workers)
+                self.stdout.write(
+                    f'{hasher.algorithm:<20} {rate:8.1f} hashes/s per request, '
+                    f'{pooled:8.1f} hashes/s with {workers} pool workers'
+                )
+            else:
+                rate = self.measure(lambda: hasher.encode(password, salt), seconds)
+                self.stdout.write(f'{hasher.algorithm:<20} {rate:8.1f} hashes/s on one core')
+
+            iterations = getattr(hasher, 'iterations', None)
+            if iterations:
+                suggested = int(iterations * options['target_ms'] / (1000.0 / rate))
+                self.stdout.write(
+                    f'{"":<20} {1000.0 / rate:8.1f} ms/hash at {iterations} iterations; '
+                    f'~{suggested} iterations for {options["target_ms"]:.0f} ms'
+                )
+
+    @staticmethod
+    def measure(func, seconds, concurrency=1):
+        def run():
+            count = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                func()
+                count += 1
+            return count
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as threads:
+            total = sum(threads.map(lambda _: run(), range(concurrency)))
+        return total / (time.perf_counter() - started)
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from accounts import benchmarks
+from accounts.serving import OFFLOAD_HEADERS
+
+# (label, MEDIA_OFFLOAD, request headers)
+MODES = (
+    ('python', None, {}),
+    ('range', None, {'Range': 'bytes=0-65535'}),
+    ('offload', 'x-accel-redirect', {}),
+    ('304', None, None),  # If-None-Match with the file's ETag
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures /media/ throughput with file bodies streamed through Python, as 64 KiB ranges, '
+        'handed to the front server with X-Accel-Redirect, and answered with 304s, for several file sizes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[16, 256, 4096], help='File sizes in KiB')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per file size and mode')
+        parser.add_argument('--offload', choices=sorted(OFFLOAD_HEADERS), default='x-accel-redirect')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        try:
+            results = {}
+            for size in options['sizes']:
+                path = write_blob(media_root, size * 1024)
+                for label, offload, headers in MODES:
+                    if label == 'offload':
+                        offload = options['offload']
+                    with override_settings(MEDIA_ROOT=media_root, MEDIA_OFFLOAD=offload):
+                        results[size, label] = measure(f'/media/{path}', headers, options['requests'])
+        finally:
+            teardown_test_environment()
+            shutil.rmtree(media_root)
+        self.report(results, options)
+
+    def report(self, results, options):
+        self.stdout.write(f'\n{options["requests"]} sequential requests per row; "offload" uses {options["offload"]}')
+        self.stdout.write(
+            f'  {"size KiB":>8} {"mode":<8} {"status":>6} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"MiB/s via Python":>17}'
+        )
+        for (size, label), result in results.items():
+            self.stdout.write(
+                f'  {size:>8} {label:<8} {result["status"]:>6} {result["throughput"]:>8.0f} '
+                f'{result["p50_ms"]:>8.2f} {result["p99_ms"]:>8.2f} {result["python_mib_s"]:>17.1f}'
+            )
+        self.stdout.write(
+            '\nOffloaded responses carry no body: the front server sends the file. Under gunicorn, '
+            'full-file responses can also use sendfile() through wsgi.file_wrapper, which the test '
+            'client does not provide.\n'
+        )
+
+
+def write_blob(media_root, size):
+    """A file of random bytes, named the way ContentAddressedStorage names it."""
+    content = os.urandom(size)
+    digest = hashlib.sha256(content).hexdigest()
+    path = f'profile_pics/{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+    os.makedirs(os.path.dirname(os.path.join(media_root, path)), exist_ok=True)
+    with open(os.path.join(media_root, path), 'wb') as f:
+        f.write(content)
+    return path
+
+
+def measure(url, headers, requests):
+    client = Client()
+    if headers is None:
+        headers = {'If-None-Match': client.get(url)['ETag']}
+    read_body(client.get(url, headers=headers))  # warm up
+
+    timings, sent, status = [], 0, None
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        sent += read_body(response)
+        timings.append(time.perf_counter() - request_started)
+        status = response.status_code
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'status': status,
+        'throughput': requests / elapsed,
+        'p50_ms': benchmarks.percentile(timings, 0.5) * 1000,
+        'p99_ms': benchmarks.percentile(timings, 0.99) * 1000,
+        'python_mib_s': sent / elapsed / 2 ** 20,
+    }
+
+
+def read_body(response):
+    """Consume the body the way a WSGI server would; returns its length."""
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    response.close()
+    return size
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def write_worker(path, pragmas, immediate, writes, timeout):
+    # Top-level so the spawn-based pool can pickle it by reference.
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name}={value}')
+    done = locked = 0
+    for i in range(writes):
+        try:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            # Read-then-write, like a session or last_login update.
+            conn.execute('SELECT count(*) FROM bench WHERE worker = ?', (os.getpid(),)).fetchone()
+            conn.execute('INSERT INTO bench (worker, payload) VALUES (?, ?)', (os.getpid(), 'x' * 200))
+            conn.execute('COMMIT')
+            done += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            locked += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+    conn.close()
+    return done, locked
+
+
+class Command(BaseCommand):
+    help = 'Measures concurrent SQLite write throughput with the default journal versus the configured pragmas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Writer processes')
+        parser.add_argument('--writes', type=int, default=500, help='Write transactions per worker')
+        parser.add_argument('--timeout', type=float, default=0.1, help='sqlite3 busy timeout in seconds for the default mode')
+
+    def handle(self, *args, **options):
+        workers, writes = options['workers'], options['writes']
+        configured = getattr(settings, 'SQLITE_PRAGMAS', {})
+        busy_timeout = configured.get('busy_timeout', 5000) / 1000
+        modes = [
+            ('default (rollback journal)', {}, False, options['timeout']),
+            ('configured (SQLITE_PRAGMAS)', configured, True, busy_timeout),
+        ]
+        self.stdout.write(f'{workers} workers x {writes} writes, {os.cpu_count() or 1} CPUs\n')
+        for label, pragmas, immediate, timeout in modes:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                conn = sqlite3.connect(path)
+                for name, value in pragmas.items():
+                    conn.execute(f'PRAGMA {name}={value}')
+                conn.execute('CREATE TABLE bench (id INTEGER PRIMARY KEY, worker INTEGER, payload TEXT)')
+                conn.execute('CREATE INDEX bench_worker ON bench (worker)')
+                conn.commit()
+                conn.close()
+
+                started = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+                    futures = [
+                        pool.submit(write_worker, path, pragmas, immediate, writes, timeout)
+                        for _ in range(workers)
+                    ]
+                    results = [f.result() for f in futures]
+                elapsed = time.perf_counter() - started
+
+            done = sum(d for d, _ in results)
+            locked = sum(l for _, l in results)
+            self.stdout.write(
+                f'{label:<30} {done / elapsed:9.1f} writes/s  '
+                f'{locked:6d} "database is locked" errors  ({elapsed:.2f}s)'
+            )
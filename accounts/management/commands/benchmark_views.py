@@ -0,0 +1,88 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from accounts import benchmarks
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'accounts', 'benchmark_baseline.json')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks every accounts view through the test client against a seeded test database, '
+        'reporting latency percentiles and query counts, and fails on query budget overruns or '
+        'regressions against the stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 100000],
+            help='Seeded user counts to run at, e.g. --sizes 1000 100000 1000000',
+        )
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per view and size')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Allowed p50 slowdown against the baseline, as a fraction (0.5 = 50%%)',
+        )
+        parser.add_argument(
+            '--fast-hashing', action='store_true',
+            help='Use MD5 password hashing so login and register measure the view rather than PBKDF2',
+        )
+        parser.add_argument('--view', action='append', default=[], help='Only run the named scenario(s)')
+
+    def handle(self, *args, **options):
+        scenarios = benchmarks.SCENARIOS
+        if options['view']:
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['view']]
+            if not scenarios:
+                raise CommandError('No scenario matches --view; choose from: ' + ', '.join(s.name for s in benchmarks.SCENARIOS))
+        # Budgets assume the user and profile caches, which production turns on with a shared cache
+        overrides = {'THROTTLE_ENABLED': False, 'USER_CACHE_ENABLED': True, 'PROFILE_CACHE_ENABLED': True}
+        if options['fast_hashing']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        baseline = benchmarks.load_baseline(options['baseline'])
+        hashing = 'fast' if options['fast_hashing'] else 'configured'
+
+        # Test databases and the locmem email backend, as under `manage.py test`
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        failures = []
+        try:
+            with override_settings(**overrides):
+                for size in sorted(options['sizes']):
+                    self.stdout.write(f'Seeding {size} users...')
+                    benchmarks.seed_users(size)
+                    results = benchmarks.run_scenarios(size, options['iterations'], scenarios)
+                    self.report(size, results, scenarios)
+                    key = f'{size}/{hashing}'
+                    for failure in benchmarks.check_results(results, baseline.get(key), options['tolerance'], scenarios):
+                        failures.append(f'[{size} users] {failure}')
+                    if options['update_baseline']:
+                        baseline.setdefault(key, {}).update(results)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        if options['update_baseline']:
+            benchmarks.save_baseline(options['baseline'], baseline)
+            self.stdout.write(f'Baseline written to {options["baseline"]}')
+        if failures:
+            raise CommandError('View benchmarks failed:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('All views within their query budgets and baseline'))
+
+    def report(self, size, results, scenarios):
+        self.stdout.write(f'\n{size} users')
+        self.stdout.write(f'  {"view":<26} {"queries":>7} {"budget":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for scenario in scenarios:
+            result = results[scenario.name]
+            self.stdout.write(
+                f'  {scenario.name:<26} {result["queries"]:>7} {scenario.budget:>6} '
+                f'{result["p50_ms"]:>8.1f} {result["p95_ms"]:>8.1f} {result["p99_ms"]:>8.1f}'
+            )
+        self.stdout.write('')
@@ -0,0 +1,158 @@
+import os
+import re
+import time
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import CustomUser, MediaBlob
+from accounts.storage import ContentAddressedStorage
+from accounts.user_cache import invalidate_users
+
+# <dir>/<h[:2]>/<h[2:4]>/<sha256><ext>, as ContentAddressedStorage names blobs
+BLOB_NAME = re.compile(r'(?:.+/)?([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(?:\.\w+)?')
+
+
+class Command(BaseCommand):
+    help = 'Garbage-collects unreferenced content-addressed media blobs in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24, help='Only collect blobs unreferenced for at least this long')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--rebuild', action='store_true', help='Recount references from the database before collecting')
+        parser.add_argument('--adopt', action='store_true', help='Move files uploaded before content addressing into blob storage, merging duplicates')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without touching anything')
+
+    def handle(self, *args, **options):
+        self.storage = CustomUser._meta.get_field('profile_picture').storage
+        if not isinstance(self.storage, ContentAddressedStorage):
+            self.stdout.write(self.style.WARNING('profile_picture does not use ContentAddressedStorage; nothing to do.'))
+            return
+
+        if options['adopt']:
+            self.adopt_legacy_files(options['dry_run'])
+        if options['rebuild']:
+            self.rebuild_refcounts(options['dry_run'])
+        self.collect(options['grace_hours'], options['batch_size'], options['dry_run'])
+        self.sweep_orphans(options['grace_hours'], options['batch_size'], options['dry_run'])
+
+    def referenced_names(self):
+        references = Counter()
+        for picture, variants in CustomUser.objects.values_list('profile_picture', 'avatar_variants').iterator():
+            if picture:
+                references[picture] += 1
+            references.update((variants or {}).values())
+        return references
+
+    def rebuild_refcounts(self, dry_run):
+        references = self.referenced_names()
+        changed = 0
+        for blob in MediaBlob.objects.iterator():
+            actual = references.pop(blob.name, 0)
+            if blob.refcount != actual:
+                changed += 1
+                if not dry_run:
+                    MediaBlob.objects.filter(pk=blob.pk).update(refcount=actual, updated_at=timezone.now())
+        self.stdout.write(f'Corrected {changed} reference counts')
+
+    def adopt_legacy_files(self, dry_run):
+        """Re-store files referenced under their upload name so identical ones share a blob."""
+        blob_names = set(MediaBlob.objects.values_list('name', flat=True))
+        adopted = 0
+        for user in CustomUser.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True).iterator():
+            name = user.profile_picture.name
+            if name in blob_names or not self.storage.exists(name):
+                continue
+            adopted += 1
+            self.stdout.write(f'Adopting {name}')
+            if dry_run:
+                continue
+            with self.storage.open(name, 'rb') as f:
+                blob_name = self.storage.save(name, File(f))
+            blob_names.add(blob_name)
+            with transaction.atomic():
+                updated = CustomUser.objects.filter(pk=user.pk, profile_picture=name).update(profile_picture=blob_name)
+            if updated:
+                invalidate_users([user.pk])
+                if not CustomUser.objects.filter(profile_picture=name).exists():
+                    self.storage.purge(name)
+            else:
+                self.storage.delete(blob_name)
+        self.stdout.write(f'Adopted {adopted} legacy files')
+
+    def collect(self, grace_hours, batch_size, dry_run):
+        cutoff = timezone.now() - timedelta(hours=grace_hours)
+        candidates = MediaBlob.objects.filter(refcount__lte=0, updated_at__lt=cutoff).order_by('pk')
+        started = time.perf_counter()
+        removed = freed = 0
+        last_pk = 0
+        while True:
+            batch = list(candidates.filter(pk__gt=last_pk).values_list('pk', 'name', 'size')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            if dry_run:
+                removed += len(batch)
+                freed += sum(size for _, _, size in batch)
+                continue
+            pks = [pk for pk, _, _ in batch]
+            # Re-check the count in the DELETE so a blob re-referenced since the
+            # SELECT survives; only files whose rows are gone get unlinked.
+            MediaBlob.objects.filter(pk__in=pks, refcount__lte=0).delete()
+            survivors = set(MediaBlob.objects.filter(pk__in=pks).values_list('pk', flat=True))
+            for pk, name, size in batch:
+                if pk in survivors:
+                    continue
+                self.storage.purge(name)
+                removed += 1
+                freed += size
+        elapsed = time.perf_counter() - started
+        verb = 'Would remove' if dry_run else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {removed} blobs ({freed / 1024 / 1024:.1f} MiB) in {elapsed:.2f}s'
+        ))
+
+    def blob_files(self, cutoff):
+        """Names of blob files on disk last modified before `cutoff`."""
+        root = self.storage.location
+        for directory, subdirectories, files in os.walk(root):
+            if directory == root and '.incoming' in subdirectories:
+                subdirectories.remove('.incoming')
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                if BLOB_NAME.fullmatch(name) and os.path.getmtime(path) < cutoff.timestamp():
+                    yield name
+
+    def sweep_orphans(self, grace_hours, batch_size, dry_run):
+        """
+        Remove blob files that have no MediaBlob row, e.g. left behind by a
+        crash between moving the file into place and the reference commit, or
+        by a restored database. The grace period keeps files whose row is
+        still in an open transaction.
+        """
+        cutoff = timezone.now() - timedelta(hours=grace_hours)
+        removed = freed = 0
+        names = self.blob_files(cutoff)
+        while batch := list(islice(names, batch_size)):
+            known = set(MediaBlob.objects.filter(name__in=batch).values_list('name', flat=True))
+            for name in batch:
+                if name in known:
+                    continue
+                size = self.storage.size(name)
+                if not dry_run:
+                    # Checked again right before unlinking, as collect() re-checks in its DELETE
+                    if MediaBlob.objects.filter(name=name).exists():
+                        continue
+                    self.storage.purge(name)
+                removed += 1
+                freed += size
+        verb = 'Would remove' if dry_run else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {removed} orphaned files ({freed / 1024 / 1024:.1f} MiB)'
+        ))
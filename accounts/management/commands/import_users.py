@@ -0,0 +1,270 @@
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import identify_hasher
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.urls import reverse
+
+from accounts import search
+from accounts.emails import render_email_batch
+from accounts.hashing import BulkPasswordHasher
+from accounts.models import CustomUser
+from accounts.outbox import build_outbox_email, enqueue_emails
+
+# Columns an input row may set; anything else is ignored.
+FIELDS = ('username', 'email', 'first_name', 'last_name', 'user_type', 'bio', 'email_verified', 'is_active')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+# Never copied into the rejects file
+SECRET_COLUMNS = ('password', 'password_hash')
+
+
+class Command(BaseCommand):
+    help = 'Bulk-imports users from a CSV or JSON Lines file, resumably'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users created per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Password hashing processes (0 hashes inline)')
+        parser.add_argument('--checkpoint', help='File recording progress; an interrupted import resumes from it')
+        parser.add_argument('--rejects', help='Write invalid and conflicting rows here as JSON Lines, with the reason')
+        parser.add_argument('--send-verification', action='store_true', help='Queue a verification email for each new user')
+        parser.add_argument('--base-url', help='Site URL for verification links, e.g. https://example.com')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['send_verification'] and not options['base_url']:
+            raise CommandError('--send-verification needs --base-url to build the verification links')
+        fmt = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'jsonl')
+        self.using = options['database']
+        self.base_url = (options['base_url'] or '').rstrip('/')
+        self.send_verification = options['send_verification']
+        self.stats = {'rows': 0, 'created': 0, 'conflicts': 0, 'invalid': 0}
+
+        checkpoint = options['checkpoint']
+        skip = self.load_checkpoint(checkpoint, options['path'])
+        if skip:
+            self.stdout.write(f'Resuming after row {skip}')
+
+        rejects = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+        hasher = BulkPasswordHasher(options['workers'])
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            rows = islice(self.read_rows(stream, fmt), skip, None)
+            position = skip
+            # Hash the next chunk's passwords while the current one is written
+            pending = None
+            for batch in self.chunks(rows, options['chunk_size']):
+                prepared = self.prepare(batch, hasher, rejects)
+                if pending is not None:
+                    position = self.write(*pending, hasher, rejects)
+                    self.save_checkpoint(checkpoint, options['path'], position)
+                    self.report(started)
+                pending = prepared
+            if pending is not None:
+                position = self.write(*pending, hasher, rejects)
+                self.save_checkpoint(checkpoint, options['path'], position)
+        finally:
+            hasher.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+            if rejects:
+                rejects.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.stats["created"]} users from {self.stats["rows"]} rows '
+            f'({self.stats["conflicts"]} already existed, {self.stats["invalid"]} invalid) '
+            f'in {elapsed:.1f}s, {self.stats["rows"] / elapsed if elapsed else 0:.0f} rows/s'
+        ))
+
+    def read_rows(self, stream, fmt):
+        """Yield `(row_number, data, error)` for each input row."""
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(stream), start=1):
+                yield number, row, None
+            return
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, None, f'invalid JSON: {e}'
+                continue
+            if not isinstance(row, dict):
+                yield number, None, 'expected a JSON object'
+                continue
+            yield number, row, None
+
+    @staticmethod
+    def chunks(rows, size):
+        while True:
+            batch = list(islice(rows, size))
+            if not batch:
+                return
+            yield batch
+
+    def prepare(self, batch, hasher, rejects):
+        """
+        Validate a chunk and start hashing its passwords. Returns the chunk's
+        last row number, `(row_number, row, user)` for each valid row, and
+        the pending password hashes.
+        """
+        entries = []
+        for number, row, error in batch:
+            self.stats['rows'] += 1
+            user = None
+            if error is None:
+                user, error = self.build_user(row)
+            if error:
+                self.reject(rejects, number, row, error, 'invalid')
+            else:
+                entries.append((number, row, user))
+
+        # Plain-text passwords go to the pool; pre-hashed and missing ones are already set
+        to_hash = [i for i, (_, _, user) in enumerate(entries) if not user.password]
+        # Hashed exactly as given, like Django's own password fields (strip=False)
+        pending = hasher.submit([str(entries[i][1]['password']) for i in to_hash])
+        return batch[-1][0], entries, (to_hash, pending)
+
+    def build_user(self, row):
+        data = {field: row[field] for field in FIELDS if row.get(field) not in (None, '')}
+        for flag in ('email_verified', 'is_active'):
+            if flag in data and not isinstance(data[flag], bool):
+                data[flag] = str(data[flag]).strip().lower() in TRUE_VALUES
+        for field, value in data.items():
+            if isinstance(value, str):
+                data[field] = value.strip()
+        if not data.get('email'):
+            return None, 'email is required'
+        data['email'] = CustomUser.objects.normalize_email(data['email'])
+        user = CustomUser(**data)
+
+        password_hash = (row.get('password_hash') or '').strip()
+        if password_hash:
+            try:
+                identify_hasher(password_hash)
+            except ValueError:
+                return None, 'password_hash is not in a recognised format'
+            user.password = password_hash
+        elif row.get('password') in (None, ''):
+            # No password supplied: the user sets one through password reset
+            user.set_unusable_password()
+
+        try:
+            user.clean_fields(exclude=['password'])
+        except ValidationError as e:
+            return None, '; '.join(f'{field}: {" ".join(messages)}' for field, messages in e.message_dict.items())
+        return user, None
+
+    def write(self, last_number, entries, hashes, hasher, rejects):
+        """Insert one chunk, skipping rows whose username or email is taken. Returns the chunk's last row number."""
+        to_hash, pending = hashes
+        for i, encoded in zip(to_hash, hasher.collect(pending)):
+            entries[i][2].password = encoded
+
+        users = self.drop_conflicts(entries, rejects)
+        with transaction.atomic(using=self.using):
+            # ignore_conflicts covers rows created concurrently since the check
+            CustomUser.objects.using(self.using).bulk_create(users, ignore_conflicts=True)
+            # Conflict-ignoring inserts don't return primary keys; look them up
+            rows = CustomUser.objects.using(self.using).filter(
+                username__in=[user.username for user in users]
+            ).values_list('username', 'email', 'pk')
+            pks = {(username, email.lower()): pk for username, email, pk in rows}
+            created = []
+            for user in users:
+                user.pk = pks.get((user.username, user.email.lower()))
+                if user.pk is not None:
+                    user._state.adding = False
+                    user._state.db = self.using
+                    created.append(user)
+            # bulk_create sends no post_save signals
+            search.index_users(created, self.using)
+            if self.send_verification:
+                self.queue_verification(created)
+        self.stats['created'] += len(created)
+        self.stats['conflicts'] += len(users) - len(created)
+        return last_number
+
+    def drop_conflicts(self, entries, rejects):
+        usernames = {user.username for _, _, user in entries}
+        emails = {user.email.lower() for _, _, user in entries}
+        existing = CustomUser.objects.using(self.using).alias(email_lower=Lower('email')).filter(
+            Q(username__in=usernames) | (~Q(email='') & Q(email_lower__in=emails))
+        ).order_by().values_list('username', 'email')
+        taken_usernames, taken_emails = set(), set()
+        for username, email in existing:
+            taken_usernames.add(username)
+            taken_emails.add(email.lower())
+
+        kept = []
+        for number, row, user in entries:
+            if user.username in taken_usernames:
+                self.reject(rejects, number, row, 'username already exists', 'conflicts')
+            elif user.email.lower() in taken_emails:
+                self.reject(rejects, number, row, 'email already in use', 'conflicts')
+            else:
+                # Also catches duplicates within the input itself
+                taken_usernames.add(user.username)
+                taken_emails.add(user.email.lower())
+                kept.append(user)
+        return kept
+
+    def queue_verification(self, users):
+        contexts = [
+            {
+                'user': user,
+                'verification_url': self.base_url + reverse('verify-email', args=[user.get_uid(), user.get_verification_token()]),
+            }
+            for user in users
+        ]
+        rendered = render_email_batch('accounts/email/verification.html', contexts)
+        enqueue_emails([
+            build_outbox_email('Verify your email address', plain, [user.email], html)
+            for user, (plain, html) in zip(users, rendered)
+        ], using=self.using)
+
+    def reject(self, rejects, number, row, reason, stat):
+        self.stats[stat] += 1
+        if rejects:
+            data = {key: '********' if key in SECRET_COLUMNS and value else value for key, value in row.items()}
+            rejects.write(json.dumps({'row': number, 'reason': reason, 'data': data}, default=str) + '\n')
+
+    def report(self, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{self.stats["rows"]} rows read, {self.stats["created"]} created, '
+            f'{self.stats["rows"] / elapsed:.0f} rows/s'
+        )
+
+    @staticmethod
+    def load_checkpoint(path, source):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('source') != source:
+            raise CommandError(f'Checkpoint {path} belongs to {checkpoint.get("source")!r}, not {source!r}')
+        return checkpoint['rows']
+
+    @staticmethod
+    def save_checkpoint(path, source, rows):
+        if not path:
+            return
+        # Written after each chunk commits; replace() keeps it whole on a crash
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'source': source, 'rows': rows}, f)
+        os.replace(path + '.tmp', path)
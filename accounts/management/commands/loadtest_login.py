@@ -0,0 +1,140 @@
+import logging
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from accounts.models import CustomUser
+
+PASSWORD = 'Legit-login-password-1'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures login latency for legitimate users while attackers stuff credentials, '
+        'with throttling off and on. Creates (and afterwards deletes) loadtest_* users; '
+        'run it against a staging database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=15.0, help='Duration of each run')
+        parser.add_argument('--attackers', type=int, default=8, help='Attacker threads')
+        parser.add_argument('--attack-rps', type=float, default=20.0, help='Total attack requests per second')
+        parser.add_argument(
+            '--known-fraction', type=float, default=0.05,
+            help='Share of attack attempts aimed at the legitimate accounts rather than leaked, unknown usernames',
+        )
+        parser.add_argument('--attacker-ips', type=int, default=4, help='Source addresses the attack is spread over')
+        parser.add_argument('--legit', type=int, default=1, help='Legitimate client threads')
+        parser.add_argument('--legit-users', type=int, default=50, help='Accounts the legitimate clients rotate through')
+        parser.add_argument('--legit-pause', type=float, default=1.0, help='Seconds a legitimate client waits between logins')
+        parser.add_argument('--mode', choices=['both', 'off', 'on'], default='both')
+        parser.add_argument(
+            '--rate', action='append', default=[], metavar='SCOPE=RATE',
+            help='Override a THROTTLE_RATES entry for the run, e.g. login_ip=6/m; size limits to what this host can hash',
+        )
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        # One hash for every account keeps setup cheap
+        encoded = make_password(PASSWORD)
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'loadtest_{run_id}_{i}', email=f'loadtest_{run_id}_{i}@example.invalid',
+                password=encoded, email_verified=True,
+            )
+            for i in range(options['legit_users'])
+        ])
+        self.usernames = [user.username for user in users]
+        rates = {**getattr(settings, 'THROTTLE_RATES', {}), **dict(rate.split('=', 1) for rate in options['rate'])}
+        # Every shed or throttled attempt would otherwise be logged
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            modes = ['off', 'on'] if options['mode'] == 'both' else [options['mode']]
+            for number, mode in enumerate(modes):
+                with override_settings(THROTTLE_ENABLED=(mode == 'on'), THROTTLE_RATES=rates):
+                    self.run(f'throttling {mode}', number, options)
+        finally:
+            request_logger.setLevel(level)
+            CustomUser.objects.filter(username__startswith=f'loadtest_{run_id}_').delete()
+
+    def run(self, label, number, options):
+        login_url = reverse('login')
+        deadline = time.perf_counter() + options['seconds']
+        legit_latencies, legit_failures = [], []
+        attack_statuses = []
+        lock = threading.Lock()
+        # Fresh addresses per run so limits from the previous run don't carry over
+        octet = random.randint(0, 255)
+        next_user = iter(range(10 ** 9))
+
+        def legit(thread):
+            client = Client()
+            while time.perf_counter() < deadline:
+                with lock:
+                    index = next(next_user) % len(self.usernames)
+                # Each account logs in from its own address, as real users would
+                address = f'10.{octet}.{100 + number}.{index % 250}'
+                started = time.perf_counter()
+                response = client.post(
+                    login_url, {'username': self.usernames[index], 'password': PASSWORD}, REMOTE_ADDR=address
+                )
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if response.status_code == 302 and 'login' not in response.get('Location', ''):
+                        legit_latencies.append(elapsed)
+                    else:
+                        legit_failures.append(response.status_code)
+                client.logout()
+                time.sleep(options['legit_pause'])
+
+        # Paced so the attack clients, which share this process, don't starve the server side of CPU
+        attack_interval = options['attackers'] / options['attack_rps']
+
+        def attack(thread):
+            clients = [
+                Client(REMOTE_ADDR=f'10.{octet}.{number}.{ip}') for ip in range(options['attacker_ips'])
+            ]
+            while time.perf_counter() < deadline:
+                # Mostly usernames from some other site's leak, a few real ones
+                if random.random() < options['known_fraction']:
+                    username = random.choice(self.usernames)
+                else:
+                    username = f'victim{random.randrange(10 ** 6)}'
+                response = random.choice(clients).post(login_url, {'username': username, 'password': uuid.uuid4().hex})
+                with lock:
+                    attack_statuses.append(response.status_code)
+                time.sleep(attack_interval)
+
+        threads = [threading.Thread(target=legit, args=(i,)) for i in range(options['legit'])]
+        threads += [threading.Thread(target=attack, args=(i,)) for i in range(options['attackers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(f'\n{label}')
+        if legit_latencies:
+            latencies = sorted(legit_latencies)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(
+                f'  legitimate logins: {len(latencies)} ok, {len(legit_failures)} failed {sorted(set(legit_failures))}; '
+                f'p50 {statistics.median(latencies) * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms'
+            )
+        else:
+            self.stdout.write(f'  legitimate logins: none succeeded ({len(legit_failures)} failed {sorted(set(legit_failures))})')
+        rejected = attack_statuses.count(429)
+        self.stdout.write(
+            f'  attack requests: {len(attack_statuses)} ({len(attack_statuses) / options["seconds"]:.0f}/s), '
+            f'{rejected} throttled, {attack_statuses.count(503)} shed by the hashing pool'
+        )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from accounts.images import submit_avatar_processing
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Renders avatar variants for profile pictures that have not been processed yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-process every profile picture, not just missing ones')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['all']:
+            users = users.filter(avatar_variants={})
+
+        futures = []
+        for pk, name in users.values_list('pk', 'profile_picture').iterator():
+            try:
+                futures.append((name, submit_avatar_processing(pk, name)))
+            except OSError as e:
+                self.stdout.write(self.style.WARNING(f'Skipping {name}: {e}'))
+
+        failed = 0
+        for name, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'Failed to process {name}: {e}'))
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(futures) - failed} profile pictures, {failed} failed'))
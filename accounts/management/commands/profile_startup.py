@@ -0,0 +1,93 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter; prints timings as JSON
+PROBE = '''
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'usermgmt.settings')
+os.environ['WARMUP'] = '0'
+import django
+django.setup()
+from django.test import Client
+import usermgmt.wsgi
+ready = time.perf_counter()
+warm = 0.0
+if sys.argv[1] == 'warm':
+    from accounts.warmup import warm_up
+    warm = sum(seconds for _, _, seconds in warm_up())
+client = Client(HTTP_HOST='localhost')
+before = time.perf_counter()
+client.get('/accounts/login/')
+first = time.perf_counter() - before
+before = time.perf_counter()
+client.get('/accounts/login/')
+second = time.perf_counter() - before
+print(json.dumps({'setup': ready - started, 'warmup': warm, 'first': first, 'second': second}))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures worker cold start in fresh interpreters: django.setup() time with an '
+        'import-time breakdown by package, and the first request with and without warmup'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help='Packages to list in the import breakdown')
+
+    def handle(self, *args, **options):
+        env = {**os.environ}
+        # Measure with bytecode caches, as a deployed worker would have them
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        self.run_probe('cold', env)  # writes .pyc files and warms the OS page cache
+
+        for mode in ('cold', 'warm'):
+            results = [self.run_probe(mode, env) for _ in range(options['runs'])]
+            median = {key: statistics.median(r[key] for r in results) * 1000 for key in results[0]}
+            self.stdout.write(
+                f'{mode:<5} setup {median["setup"]:6.1f} ms  warmup {median["warmup"]:6.1f} ms  '
+                f'first request {median["first"]:6.1f} ms  second {median["second"]:5.1f} ms'
+            )
+
+        imports = Counter()
+        for _ in range(options['runs']):
+            for package, microseconds in self.import_times(env).items():
+                imports[package] += microseconds / options['runs']
+        total = sum(imports.values())
+        self.stdout.write(f'\nImport time by top-level package (mean of {options["runs"]} runs, {total / 1000:.1f} ms total):')
+        for package, microseconds in imports.most_common(options['top']):
+            self.stdout.write(f'  {package:<28} {microseconds / 1000:7.1f} ms')
+
+    @staticmethod
+    def run_probe(mode, env):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE, mode],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    @staticmethod
+    def import_times(env):
+        """Cumulative import time in microseconds per top-level package, from `-X importtime`."""
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, 'cold'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stderr
+        packages = Counter()
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            if name.startswith('  '):
+                continue  # nested: already counted in its importer's cumulative time
+            packages[name.strip().split('.')[0]] += int(cumulative)
+        return packages
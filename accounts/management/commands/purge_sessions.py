@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from accounts.session_backend import db_write_interval
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired sessions in small batches so the table is never locked for long'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.05, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        engine = import_string(settings.SESSION_ENGINE + '.SessionStore')
+        model = engine.get_model_class()
+        # Rows of active sessions can lag the cache by up to one write
+        # interval, so only collect rows that expired longer ago than that.
+        cutoff = timezone.now() - timedelta(seconds=db_write_interval())
+        expired = model.objects.filter(expire_date__lt=cutoff)
+
+        started = time.perf_counter()
+        deleted = 0
+        while True:
+            keys = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += model.objects.filter(pk__in=keys).delete()[0]
+            time.sleep(options['sleep'])
+        elapsed = time.perf_counter() - started
+        rate = deleted / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sessions in {elapsed:.2f}s ({rate:.0f}/s)'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from accounts import search
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text user search index and refreshes the table statistics used for estimated counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--skip-analyze', action='store_true', help="Don't run ANALYZE afterwards")
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_supported(using):
+            self.stdout.write(self.style.WARNING(f'{connections[using].vendor} has no FTS5 index; nothing to do.'))
+            return
+
+        started = time.perf_counter()
+        indexed = search.rebuild(CustomUser, using, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} users in {time.perf_counter() - started:.2f}s'))
+
+        if not options['skip_analyze']:
+            with connections[using].cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.stdout.write('Refreshed table statistics')
@@ -1,12 +1,17 @@
+import os
+
 from django.core.management.commands.runserver import Command as RunserverCommand
 from django.core.management import call_command
+from django.utils.autoreload import DJANGO_AUTORELOAD_ENV
 
 class Command(RunserverCommand):
     help = 'Runs the server after creating a superuser if none exists'
 
     def handle(self, *args, **options):
-        # First create superuser if needed
-        call_command('create_superuser_if_none')
+        # First create superuser if needed. Only once per invocation: the
+        # autoreloader re-runs handle() in every child it restarts.
+        if os.environ.get(DJANGO_AUTORELOAD_ENV) != 'true':
+            call_command('create_superuser_if_none')
         
         # Then run the standard runserver command
         super().handle(*args, **options)
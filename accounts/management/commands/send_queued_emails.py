@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails from the outbox in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Emails claimed per batch (default: EMAIL_OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--max-attempts', type=int, default=None, help='Attempts before an email is marked failed (default: EMAIL_OUTBOX_MAX_ATTEMPTS)')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new emails')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait between polls when the outbox is empty')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        try:
+            while True:
+                close_old_connections()
+                sent, failed = deliver_batch(options['batch_size'], options['max_attempts'])
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'Batch delivered: {sent} sent, {failed} failed')
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Outbox drained: {total_sent} sent, {total_failed} failed'))
@@ -0,0 +1,107 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import CustomUser, UserSession
+from accounts.session_backend import delete_user_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes accounts still unverified after UNVERIFIED_ACCOUNT_TTL_DAYS, with their sessions and '
+        'profile pictures, in small batches so the database is never locked for long'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=None,
+            help='Override UNVERIFIED_ACCOUNT_TTL_DAYS (age of the registration, in days)',
+        )
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else getattr(settings, 'UNVERIFIED_ACCOUNT_TTL_DAYS', 7)
+        cutoff = timezone.now() - timedelta(days=days)
+        stale = stale_accounts(cutoff)
+        dry_run = options['dry_run']
+
+        started = time.perf_counter()
+        users = sessions = pictures = batches = 0
+        longest = 0.0
+        last = None
+        while True:
+            page = stale
+            if last is not None:
+                # Keyset on (date_joined, id), the order of customuser_unverified_idx
+                page = page.filter(Q(date_joined__gt=last[0]) | Q(date_joined=last[0], pk__gt=last[1]))
+            batch = list(page.values_list('date_joined', 'pk')[:options['batch_size']])
+            if not batch:
+                break
+            last = batch[-1]
+            pks = [pk for _, pk in batch]
+            batch_started = time.perf_counter()
+            if dry_run:
+                deleted, batch_sessions, batch_pictures = (
+                    len(pks),
+                    UserSession.objects.filter(user_id__in=pks).count(),
+                    with_pictures(CustomUser.objects.filter(pk__in=pks)),
+                )
+            else:
+                deleted, batch_sessions, batch_pictures = delete_accounts(stale, pks)
+            longest = max(longest, time.perf_counter() - batch_started)
+            users += deleted
+            sessions += batch_sessions
+            pictures += batch_pictures
+            batches += 1
+            if not dry_run:
+                time.sleep(options['sleep'])
+
+        elapsed = time.perf_counter() - started
+        rate = users / elapsed if elapsed else 0
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {users} accounts unverified for over {days:g} days, {sessions} sessions and '
+            f'{pictures} profile pictures in {batches} batches, {elapsed:.2f}s ({rate:.0f} accounts/s, '
+            f'longest batch {longest * 1000:.0f} ms)'
+        ))
+
+
+def stale_accounts(cutoff):
+    """
+    Never-verified, never-used accounts registered before `cutoff`, oldest
+    first. Staff and superusers are kept, since createsuperuser leaves them
+    unverified.
+    """
+    return CustomUser.objects.filter(
+        email_verified=False, date_joined__lt=cutoff, last_login__isnull=True, is_staff=False, is_superuser=False,
+    ).order_by('date_joined', 'pk')
+
+
+def with_pictures(users):
+    return users.exclude(profile_picture='').exclude(profile_picture__isnull=True).count()
+
+
+def delete_accounts(stale, pks):
+    """
+    Delete the still-stale accounts among `pks` in one short transaction and
+    return `(accounts, sessions, pictures)`. The post_delete signals release
+    their picture references and search index rows; shared picture blobs are
+    then removed by `gc_media`.
+    """
+    with transaction.atomic():
+        # Re-checked under the write lock: someone may have verified meanwhile
+        pks = list(stale.filter(pk__in=pks).values_list('pk', flat=True))
+        if not pks:
+            return 0, 0, 0
+        users = CustomUser.objects.filter(pk__in=pks)
+        pictures = with_pictures(users)
+        deleted = users.delete()[1].get(CustomUser._meta.label, 0)
+        sessions = delete_user_sessions(pks)
+    return deleted, sessions, pictures
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import profiling
+
+
+class Command(BaseCommand):
+    help = 'Turns sampled profiling of live requests on or off for every worker sharing PROFILING["DIR"]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['on', 'off', 'status'])
+        parser.add_argument('--view', action='append', default=[], help='URL name to profile (repeatable), e.g. profile or login')
+        parser.add_argument('--rate', type=float, default=0.1, help='Fraction of matching requests to profile')
+        parser.add_argument('--mode', choices=profiling.MODES, default=profiling.config()['MODE'])
+        parser.add_argument('--minutes', type=float, default=15, help='Switch off again after this long')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'off':
+            profiling.clear_toggle()
+            self.stdout.write('Profiling off')
+        elif options['action'] == 'on':
+            if not options['view']:
+                raise CommandError('Name at least one --view')
+            if not 0 < options['rate'] <= 1:
+                raise CommandError('--rate must be in (0, 1]')
+            state = profiling.write_toggle(options['view'], options['rate'], options['mode'], options['minutes'] * 60)
+            self.stdout.write(self.describe(state))
+        else:
+            profiling._toggle.reload()
+            state = profiling._toggle.state
+            if state and state['until'] > time.time():
+                self.stdout.write(self.describe(state))
+            else:
+                self.stdout.write('Profiling off')
+            self.stdout.write(f'{len(profiling.profile_files())} profiles in {profiling.config()["DIR"]}')
+
+    @staticmethod
+    def describe(state):
+        return (
+            f'Profiling {", ".join(state["views"])} with {state["mode"]} at {state["rate"]:.0%} '
+            f'for {max(state["until"] - time.time(), 0) / 60:.0f} more minutes'
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from accounts.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the worker warmup (URL patterns, accounts templates, database connections, hashing pool) '
+        'and reports how long each step took. Workers run it themselves from usermgmt/wsgi.py and usermgmt/asgi.py.'
+    )
+
+    def handle(self, *args, **options):
+        total = 0.0
+        for name, count, seconds in warm_up():
+            total += seconds
+            self.stdout.write(f'{name:<14} {count:>4}  {seconds * 1000:8.1f} ms')
+        self.stdout.write(self.style.SUCCESS(f'Warm in {total * 1000:.1f} ms'))
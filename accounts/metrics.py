@@ -0,0 +1,298 @@
+"""
+In-process metrics, exposed in the Prometheus text format at `/metrics`.
+
+Updates are lock-free: every thread records into its own shard and only
+reading a snapshot walks all of them. When a thread exits, its shard is
+folded into a shared "retired" one, so the thread per request of runserver
+doesn't leave shards behind. With several worker processes, set
+`METRICS_DIR` to a directory they share. Each process then writes its
+snapshot there (`<pid>.json`, at most every `METRICS_FLUSH_INTERVAL`
+seconds) and `/metrics` sums the files. Clear the directory when the app is
+redeployed, the way a restarted Prometheus client would reset its counters.
+"""
+import atexit
+import contextvars
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'accounts_http_requests_total': ('counter', 'Requests by URL name, method and status code.', None),
+    'accounts_http_request_duration_seconds': ('histogram', 'Request latency by URL name.', LATENCY_BUCKETS),
+    'accounts_db_queries_per_request': ('histogram', 'SQL queries per request by URL name.', COUNT_BUCKETS),
+    'accounts_db_time_per_request_seconds': ('histogram', 'Time spent in SQL per request by URL name.', LATENCY_BUCKETS),
+    'accounts_smtp_send_duration_seconds': ('histogram', 'Time to hand one message to the SMTP relay.', LATENCY_BUCKETS),
+    'accounts_smtp_failures_total': ('counter', 'SMTP failures by kind (connect, message, connection, circuit_open).', None),
+    'accounts_outbox_emails_total': ('counter', 'Outbox deliveries by result.', None),
+    'accounts_registration_errors_total': ('counter', 'Registrations that failed after the form validated.', None),
+    'accounts_avatar_processing_total': ('counter', 'Avatar renders by result (stored, superseded, failed).', None),
+    'accounts_password_hash_duration_seconds': ('histogram', 'Password hashing time by algorithm.', LATENCY_BUCKETS),
+    'accounts_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).', None),
+}
+
+
+class Shard:
+    """One thread's metric values; only its owner thread writes to it."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def merge_into(self, counters, histograms):
+        # dict.copy() is atomic under the GIL, so the owner thread can keep writing
+        for key, value in self.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, (buckets, total, count) in self.histograms.copy().items():
+            merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+
+
+class _ThreadToken:
+    """Lives in the thread's locals, so it is freed when the thread exits."""
+
+
+_local = threading.local()
+_shards = []
+# Values recorded by threads that have exited (runserver starts one per request)
+_retired = Shard()
+# Reentrant: a thread's shard may be retired by garbage collection while this
+# thread is inside snapshot()
+_shards_lock = threading.RLock()
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = Shard()
+        _local.token = _ThreadToken()
+        weakref.finalize(_local.token, _retire, shard)
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def _retire(shard):
+    with _shards_lock:
+        shard.merge_into(_retired.counters, _retired.histograms)
+        _shards.remove(shard)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name, amount=1, **labels):
+    counters = _shard().counters
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    histograms = _shard().histograms
+    bounds = METRICS[name][2]
+    key = _key(name, labels)
+    entry = histograms.get(key)
+    if entry is None:
+        entry = histograms[key] = [[0] * len(bounds), 0.0, 0]
+    # Values above the last bound only show up in the +Inf bucket (the count)
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            entry[0][i] += 1
+            break
+    entry[1] += value
+    entry[2] += 1
+
+
+class timed:
+    """Context manager observing the block's duration in a histogram."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+class QueryStats:
+    """SQL count and time for one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# A context variable rather than per-connection wrappers so the async ORM's
+# worker threads, which run in a copy of the request's context, report too.
+_request_queries = contextvars.ContextVar('accounts_request_queries', default=None)
+
+
+@contextmanager
+def tracking_queries():
+    stats = QueryStats()
+    token = _request_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_queries.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.seconds += time.perf_counter() - started
+        stats.count += 1
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # connection_created fires again on reconnects of the same wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def snapshot():
+    """
+    This process's values as a JSON-able dict:
+    `{"counters": [[name, labels, value]], "histograms": [[name, labels, buckets, sum, count]]}`,
+    with per-bucket (not cumulative) counts.
+    """
+    counters, histograms = {}, {}
+    # Under the lock, so a shard is never counted both live and retired
+    with _shards_lock:
+        for shard in [_retired, *_shards]:
+            shard.merge_into(counters, histograms)
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), *entry] for (name, labels), entry in histograms.items()],
+    }
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+_last_flush = 0.0
+
+
+def flush(force=False):
+    """Write this process's snapshot to METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds."""
+    global _last_flush
+    directory = metrics_dir()
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+        return
+    _last_flush = now
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot(), f)
+    # Readers never see a half-written file
+    os.replace(tmp, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+atexit.register(lambda: flush(force=True))
+
+
+def collect():
+    """Snapshots of every process: read from METRICS_DIR, or just this one without it."""
+    directory = metrics_dir()
+    if not directory:
+        return [snapshot()]
+    flush(force=True)
+    snapshots = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # removed while we listed the directory
+    return snapshots
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    escaped = (
+        '%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in sorted(labels.items())
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshots):
+    """Sum the snapshots and format them in the Prometheus text exposition format."""
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snap['histograms']:
+            merged = histograms.setdefault(_key(name, labels), [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+
+    lines = []
+    for name, (kind, help_text, bounds) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(dict(labels))} {_number(value)}')
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            labels = dict(labels)
+            cumulative = 0
+            for bound, in_bucket in zip(bounds, buckets):
+                cumulative += in_bucket
+                lines.append(f'{name}_bucket{_labels(labels, le=_number(float(bound)))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget this process's values (tests)."""
+    with _shards_lock:
+        for shard in [_retired, *_shards]:
+            shard.counters.clear()
+            shard.histograms.clear()
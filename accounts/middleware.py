@@ -0,0 +1,173 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics, profiling
+from .hashing import HashingOverloaded
+from .routers import STICKY, WROTE, pinned_reason, pinning
+from .throttling import Throttled
+
+
+class HashingOverloadMiddleware(MiddlewareMixin):
+    """Turn a shed password hash into a 503 the client can retry, instead of a 500."""
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, HashingOverloaded):
+            response = HttpResponse(
+                'The server is busy. Please try again in a few seconds.', status=503, content_type='text/plain'
+            )
+            response['Retry-After'] = '5'
+            return response
+        return None
+
+
+class ThrottleMiddleware(MiddlewareMixin):
+    """Turn a `Throttled` view into a 429 with Retry-After."""
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, Throttled):
+            response = HttpResponse(
+                'Too many attempts. Please wait a moment and try again.', status=429, content_type='text/plain'
+            )
+            response['Retry-After'] = str(max(int(exception.retry_after + 0.5), 1))
+            return response
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes for database replicas.
+
+    A request that writes to the primary gets a short-lived cookie; while it
+    is present the client's reads are routed to the primary too, so e.g. the
+    page after a profile update redirect never shows the pre-update row from
+    a lagging replica.
+    """
+    cookie_name = 'db_pin'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with pinning(STICKY if request.COOKIES.get(self.cookie_name) else None):
+            response = self.get_response(request)
+            self.set_cookie(response)
+        return response
+
+    async def __acall__(self, request):
+        # The routing state is a context variable, so it follows the async ORM into its threads
+        with pinning(STICKY if request.COOKIES.get(self.cookie_name) else None):
+            response = await self.get_response(request)
+            self.set_cookie(response)
+        return response
+
+    def set_cookie(self, response):
+        if pinned_reason() == WROTE:
+            response.set_cookie(
+                self.cookie_name, '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status and SQL per request, labelled with the URL name.
+    Goes first in MIDDLEWARE so the timing covers the other middleware too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with metrics.tracking_queries() as stats:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with metrics.tracking_queries() as stats:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    def record(self, request, response, elapsed, stats):
+        match = request.resolver_match
+        # Unmatched paths share one label so scanners can't blow up the series count
+        view = match.view_name if match else '<unresolved>'
+        metrics.inc('accounts_http_requests_total', view=view, method=request.method, status=response.status_code)
+        metrics.observe('accounts_http_request_duration_seconds', elapsed, view=view)
+        metrics.observe('accounts_db_queries_per_request', stats.count, view=view)
+        metrics.observe('accounts_db_time_per_request_seconds', stats.seconds, view=view)
+        metrics.flush()
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests `accounts.profiling` selects. The view, and any
+    middleware after this one, are covered. Needs to come after
+    AuthenticationMiddleware, which is how the staff-only header is checked.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django awaits process_view when the chain is async
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.finish(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.finish(request, await self.get_response(request))
+
+    def finish(self, request, response):
+        profiler = getattr(request, '_profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            elapsed = time.perf_counter() - request._profiling_started
+            name = profiling.save(profiler, request.resolver_match.view_name, elapsed)
+            if request.META.get('HTTP_X_PROFILE'):
+                response['X-Profile-File'] = name
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.start(request, profiling.choose_mode(request, request.resolver_match.view_name))
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # Only the header needs the user; load it without blocking the loop
+        user = await request.auser() if request.META.get('HTTP_X_PROFILE') else None
+        self.start(request, profiling.choose_mode(request, request.resolver_match.view_name, user))
+
+    def start(self, request, mode):
+        if mode is None:
+            return
+        profiler = profiling.PROFILERS[mode](profiling.config()['INTERVAL'])
+        try:
+            profiler.start()
+        except ValueError:
+            return  # another profiler is active (cProfile is process-wide on Python 3.12+)
+        request._profiler = profiler
+        request._profiling_started = time.perf_counter()
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:51
+
+import accounts.models
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def check_duplicate_emails(apps, schema_editor):
+    # The unique index cannot be built while two accounts share an email
+    # (ignoring case); list them so they can be merged or fixed first.
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    duplicates = (
+        CustomUser.objects.exclude(email='')
+        .annotate(email_lower=django.db.models.functions.text.Lower('email'))
+        .values('email_lower')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+        .values_list('email_lower', flat=True)
+    )
+    duplicates = list(duplicates)
+    if duplicates:
+        raise RuntimeError(
+            "Cannot add unique_lower_email: these emails are used by more than one account: "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_mediablob'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customuser',
+            managers=[
+                ('objects', accounts.models.CustomUserManager()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='customuser_lower_username_idx'),
+        ),
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='unique_lower_email'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# Frozen copy of accounts.search's table definition
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS accounts_customuser_search USING fts5("
+    "username, email, first_name, last_name, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+POPULATE_SQL = (
+    "INSERT INTO accounts_customuser_search (rowid, username, email, first_name, last_name) "
+    "SELECT id, username, email, first_name, last_name FROM accounts_customuser"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite-only; other backends fall back to plain queries
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS accounts_customuser_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_customuser_email_username_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:50
+
+from django.core import signing
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copies of what accounts.session_backend.SessionStore signs sessions with
+SESSION_SALT = 'django.contrib.sessions.SessionStore'
+SESSION_USER_KEY = '_auth_user_id'
+
+
+def copy_live_sessions(apps, schema_editor):
+    """Carry unexpired sessions over from django_session, so nobody is logged out."""
+    Session = apps.get_model('sessions', 'Session')
+    UserSession = apps.get_model('accounts', 'UserSession')
+    batch = []
+    for session in Session.objects.filter(expire_date__gt=timezone.now()).iterator():
+        try:
+            data = signing.loads(session.session_data, salt=SESSION_SALT, serializer=signing.JSONSerializer)
+            user_id = int(data[SESSION_USER_KEY])
+        except (signing.BadSignature, ValueError, KeyError, TypeError):
+            user_id = None
+        batch.append(UserSession(
+            session_key=session.session_key, session_data=session.session_data,
+            expire_date=session.expire_date, user_id=user_id,
+        ))
+        if len(batch) >= 1000:
+            UserSession.objects.bulk_create(batch)
+            batch = []
+    UserSession.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_customuser_directory_indexes'),
+        ('sessions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSession',
+            fields=[
+                ('session_key', models.CharField(max_length=40, primary_key=True, serialize=False, verbose_name='session key')),
+                ('session_data', models.TextField(verbose_name='session data')),
+                ('expire_date', models.DateTimeField(db_index=True, verbose_name='expire date')),
+                ('user_id', models.BigIntegerField(blank=True, db_index=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'session',
+                'verbose_name_plural': 'sessions',
+                'db_table': 'accounts_usersession',
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(copy_live_sessions, migrations.RunPython.noop),
+    ]
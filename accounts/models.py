@@ -1,5 +1,8 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.sessions.base_session import AbstractBaseSession
 from django.db import models
+from django.db.models import Q, Value
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
@@ -7,20 +10,54 @@ from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from django.urls import reverse
 
+from .storage import profile_picture_storage
+
 # Choices for user type
 USER_TYPE_CHOICES = (
     ('community', 'Community Member'),
     ('staff', 'Staff Member'),
 )
 
+class CustomUserManager(UserManager):
+    # The unique Lower(email) index is partial (blank emails are excluded), so
+    # lookups repeat its condition to let the database use it. Ordering is
+    # dropped since at most one row can match.
+
+    def filter_by_email(self, email):
+        """Case-insensitive email lookup that is answered by the Lower(email) index"""
+        return self.alias(email_lower=Lower('email')).filter(
+            ~Q(email=''), email_lower=Lower(Value(email))
+        ).order_by()
+
+    def filter_by_username_ci(self, username):
+        """Case-insensitive username lookup that is answered by the Lower(username) index"""
+        return self.alias(username_lower=Lower('username')).filter(username_lower=Lower(Value(username))).order_by()
+
+    def filter_by_identifier(self, identifier):
+        """Users whose username is `identifier` or whose email matches it case-insensitively"""
+        return self.alias(email_lower=Lower('email')).filter(
+            Q(username=identifier) | (~Q(email='') & Q(email_lower=Lower(Value(identifier))))
+        ).order_by()
+
+    def visible_to(self, user):
+        """Users `user` may list: everyone for staff, otherwise active accounts with a verified email"""
+        if user.is_staff:
+            return self.all()
+        return self.filter(is_active=True, email_verified=True)
+
+
 class CustomUser(AbstractUser):
     user_type = models.CharField(max_length=10, choices=USER_TYPE_CHOICES, default='community')
     email_verified = models.BooleanField(default=False)
-    profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    profile_picture = models.ImageField(upload_to='profile_pics/', storage=profile_picture_storage, blank=True, null=True)
+    # Resized copies of profile_picture keyed by "<size>.<format>", filled in by accounts.images
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(max_length=500, blank=True)
     date_joined = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = CustomUserManager()
+
     def __str__(self):
         return f"{self.username} ({self.get_full_name()})"
     
@@ -36,6 +73,23 @@ class CustomUser(AbstractUser):
         """Get the user profile URL"""
         return reverse('profile', kwargs={'username': self.username})
     
+    def get_avatar_variants(self, fmt):
+        """Return (size, url) pairs for the processed avatar in the given format, smallest first"""
+        storage = self._meta.get_field('profile_picture').storage
+        variants = []
+        for key, name in self.avatar_variants.items():
+            size, ext = key.split('.')
+            if ext == fmt:
+                variants.append((int(size), storage.url(name)))
+        return sorted(variants)
+
+    def clear_avatar_variants(self):
+        """Delete the processed avatar files, e.g. before a new picture is uploaded"""
+        storage = self._meta.get_field('profile_picture').storage
+        for name in self.avatar_variants.values():
+            storage.delete(name)
+        self.avatar_variants = {}
+
     def get_full_name(self):
         """Return the first_name plus the last_name, with a space in between."""
         full_name = f"{self.first_name} {self.last_name}"
@@ -44,5 +98,105 @@ class CustomUser(AbstractUser):
     class Meta:
         verbose_name = 'User'
         verbose_name_plural = 'Users'
-        ordering = ['-date_joined']
+        # id breaks ties, so the order is stable and matches customuser_joined_idx
+        ordering = ['-date_joined', '-id']
+        constraints = [
+            models.UniqueConstraint(Lower('email'), condition=~Q(email=''), name='unique_lower_email'),
+        ]
+        indexes = [
+            models.Index(Lower('username'), name='customuser_lower_username_idx'),
+            # Default ordering and keyset pages (accounts.pagination.keyset_page),
+            # alone and behind the directory and admin filters
+            models.Index(fields=['date_joined', 'id'], name='customuser_joined_idx'),
+            models.Index(fields=['user_type', 'date_joined', 'id'], name='customuser_type_joined_idx'),
+            # Django filters booleans as `WHERE flag` / `WHERE NOT flag`, which a
+            # (flag, ...) index can't serve on SQLite; partial indexes with the
+            # same condition can.
+            models.Index(fields=['date_joined', 'id'], condition=Q(email_verified=True), name='customuser_verified_idx'),
+            models.Index(fields=['date_joined', 'id'], condition=Q(email_verified=False), name='customuser_unverified_idx'),
+            models.Index(fields=['date_joined', 'id'], condition=Q(is_active=True), name='customuser_active_idx'),
+            models.Index(fields=['date_joined', 'id'], condition=Q(is_active=False), name='customuser_inactive_idx'),
+        ]
+
+
+class OutboxEmail(models.Model):
+    """An email queued for delivery by the `send_queued_emails` worker.
+
+    Rows are written in the same transaction as the change that triggered
+    them, so a rolled-back registration never sends mail and a committed
+    one never loses it.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
+    class Meta:
+        verbose_name = 'Outbox email'
+        verbose_name_plural = 'Outbox emails'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+            models.Index(fields=['claim_token'], name='outbox_claim_idx'),
+        ]
+
+
+class MediaBlob(models.Model):
+    """Reference count for a file stored by `ContentAddressedStorage`.
+
+    Blobs whose count has dropped to zero are left on disk until
+    `manage.py gc_media` collects them in bulk.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'updated_at'], name='mediablob_gc_idx'),
+        ]
+
+
+class UserSession(AbstractBaseSession):
+    """A database session that records its user, so a user's sessions can be found by index.
+
+    Not a foreign key: rows are written behind the cache by
+    `accounts.session_backend` and may briefly outlive their user.
+    """
+    user_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+
+    @classmethod
+    def get_session_store_class(cls):
+        from .session_backend import SessionStore
+
+        return SessionStore
 
+    class Meta(AbstractBaseSession.Meta):
+        db_table = 'accounts_usersession'
@@ -0,0 +1,180 @@
+import random
+import smtplib
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboxEmail
+
+# How long a claimed row stays invisible to other workers. A worker that
+# dies mid-batch leaves its rows in "sending"; they become due again after this.
+CLAIM_LEASE = timedelta(minutes=5)
+
+# Errors that concern a single message: the relay answered and refused it.
+# Anything else raised while connecting or sending (refused connections,
+# timeouts, disconnects, an open circuit breaker) is the relay's fault and
+# doesn't count against the email's attempts.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def enqueue_email(subject, body, to, html_body='', from_email=None):
+    """
+    Queue an email for background delivery.
+
+    Call this inside the same `transaction.atomic()` block as the write that
+    triggered the email so both commit (or roll back) together.
+    """
+    outbox_email = build_outbox_email(subject, body, to, html_body, from_email)
+    outbox_email.save()
+    return outbox_email
+
+
+def enqueue_emails(emails, using=None):
+    """Queue many unsaved `build_outbox_email()` results in one bulk insert."""
+    return OutboxEmail.objects.db_manager(using).bulk_create(emails)
+
+
+def build_outbox_email(subject, body, to, html_body='', from_email=None):
+    if isinstance(to, str):
+        to = [to]
+    return OutboxEmail(
+        subject=subject,
+        body=body,
+        html_body=html_body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        to=list(to),
+    )
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with jitter for the given number of failed attempts."""
+    base = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_BASE', 30)
+    cap = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_MAX', 3600)
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_batch(batch_size):
+    """
+    Atomically claim up to `batch_size` due emails for this worker.
+
+    The claim is a single UPDATE guarded by `next_attempt_at`, so two workers
+    racing for the same rows cannot both win them.
+    """
+    now = timezone.now()
+    due = Q(status__in=[OutboxEmail.STATUS_PENDING, OutboxEmail.STATUS_SENDING], next_attempt_at__lte=now)
+    ids = list(
+        OutboxEmail.objects.filter(due).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4()
+    OutboxEmail.objects.filter(due, pk__in=ids).update(
+        status=OutboxEmail.STATUS_SENDING,
+        claim_token=token,
+        next_attempt_at=now + CLAIM_LEASE,
+    )
+    return list(OutboxEmail.objects.filter(claim_token=token, status=OutboxEmail.STATUS_SENDING))
+
+
+def build_message(outbox_email, connection=None):
+    message = EmailMultiAlternatives(
+        outbox_email.subject,
+        outbox_email.body,
+        outbox_email.from_email or settings.DEFAULT_FROM_EMAIL,
+        outbox_email.to,
+        connection=connection,
+    )
+    if outbox_email.html_body:
+        message.attach_alternative(outbox_email.html_body, "text/html")
+    return message
+
+
+def is_connection_error(error):
+    return isinstance(error, (OSError, smtplib.SMTPException)) and not isinstance(error, MESSAGE_ERRORS)
+
+
+def deliver_batch(batch_size=None, max_attempts=None):
+    """
+    Send one batch of due emails over a single SMTP connection.
+
+    Returns a `(sent, not sent)` tuple. Emails the relay refused are
+    rescheduled with backoff until `max_attempts` is reached, after which
+    they are marked failed. If the relay can't be reached, or the connection
+    drops, the rest of the batch is rescheduled without using up an attempt.
+    """
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+    max_attempts = max_attempts or getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent = failed = deferred = 0
+    connection = get_connection(fail_silently=False)
+    connection_error = None
+    try:
+        connection.open()
+    except Exception as e:
+        if not is_connection_error(e):
+            raise
+        connection, connection_error = None, e
+    try:
+        for outbox_email in batch:
+            outbox_email.claim_token = None
+            if connection_error is None:
+                try:
+                    build_message(outbox_email, connection).send(fail_silently=False)
+                except Exception as e:
+                    if is_connection_error(e):
+                        connection_error = e
+                    else:
+                        record_failure(outbox_email, e, max_attempts)
+                        failed += 1
+                        continue
+                else:
+                    record_sent(outbox_email)
+                    sent += 1
+                    continue
+            # Never handed to the relay, or cut off with the connection
+            defer(outbox_email, connection_error)
+            deferred += 1
+    finally:
+        if connection is not None:
+            connection.close()
+        OutboxEmail.objects.bulk_update(
+            batch, ['attempts', 'claim_token', 'status', 'next_attempt_at', 'sent_at', 'last_error']
+        )
+        metrics.inc('accounts_outbox_emails_total', sent, result='sent')
+        metrics.inc('accounts_outbox_emails_total', failed, result='failed')
+        metrics.inc('accounts_outbox_emails_total', deferred, result='deferred')
+    return sent, failed + deferred
+
+
+def record_sent(outbox_email):
+    outbox_email.attempts += 1
+    outbox_email.status = OutboxEmail.STATUS_SENT
+    outbox_email.sent_at = timezone.now()
+    outbox_email.last_error = ''
+
+
+def record_failure(outbox_email, error, max_attempts):
+    outbox_email.attempts += 1
+    outbox_email.last_error = f"{type(error).__name__}: {error}"
+    if outbox_email.attempts >= max_attempts:
+        outbox_email.status = OutboxEmail.STATUS_FAILED
+    else:
+        outbox_email.status = OutboxEmail.STATUS_PENDING
+        outbox_email.next_attempt_at = timezone.now() + backoff_delay(outbox_email.attempts)
+
+
+def defer(outbox_email, error):
+    """Put an email back in the queue without charging it an attempt."""
+    outbox_email.last_error = f"{type(error).__name__}: {error}"
+    outbox_email.status = OutboxEmail.STATUS_PENDING
+    outbox_email.next_attempt_at = timezone.now() + backoff_delay(max(outbox_email.attempts, 1))
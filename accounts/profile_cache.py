@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from . import metrics
+from .caching import is_shared
+
+# Looked up by the username in the URL, so a hit needs no query to find the
+# user: username -> (pk, last_updated timestamp). Exact, not lowercased:
+# "Bob" and "bob" can be two accounts. Other spellings miss and go through
+# the view's database lookup, which redirects them.
+INDEX_KEY = 'profile:user:{}'
+# Reverse entry so a rename can drop the index under the old username.
+OWNER_KEY = 'profile:owner:{}'
+# The rendered card itself, keyed on pk and last_updated so any save that
+# bumps last_updated makes a stale card unreachable even before invalidation.
+CARD_KEY = 'profile:card:{}:{}'
+
+
+def enabled():
+    """PROFILE_CACHE_ENABLED, or by default whether every worker shares the default cache."""
+    setting = getattr(settings, 'PROFILE_CACHE_ENABLED', None)
+    return is_shared() if setting is None else setting
+
+
+def _timeout():
+    return getattr(settings, 'PROFILE_CACHE_TIMEOUT', 300)
+
+
+def get_cached_card(username):
+    """
+    Return the cached profile card html for exactly `username`, or None.
+
+    Only touches the cache, never the database. Always None when the cache
+    is private to this process: another worker's edits could not invalidate it.
+    """
+    if not enabled():
+        return None
+    entry = cache.get(INDEX_KEY.format(username))
+    html = None if entry is None else cache.get(CARD_KEY.format(entry[0], entry[1]))
+    metrics.inc('accounts_cache_requests_total', cache='profile_card', result='miss' if html is None else 'hit')
+    return html
+
+
+def render_card(user):
+    """Render the read-only profile card for `user` and cache it."""
+    html = render_to_string('accounts/profile_card.html', {'profile_user': user, 'is_self': False})
+    if not enabled():
+        return html
+    stamp = user.last_updated.timestamp()
+    cache.set_many({
+        INDEX_KEY.format(user.username): (user.pk, stamp),
+        OWNER_KEY.format(user.pk): user.username,
+        CARD_KEY.format(user.pk, stamp): html,
+    }, _timeout())
+    return html
+
+
+def invalidate_profile(pk, username=None):
+    """Forget the cached card for a user, under both its current and previous username."""
+    keys = [OWNER_KEY.format(pk)]
+    previous = cache.get(OWNER_KEY.format(pk))
+    for name in {previous, username} - {None}:
+        keys.append(INDEX_KEY.format(name))
+    cache.delete_many(keys)
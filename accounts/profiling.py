@@ -0,0 +1,203 @@
+"""
+On-demand profiling of live requests.
+
+Two ways to turn it on, neither needing a deploy:
+
+- A staff user sends `X-Profile: cprofile` (or `sample`) with a request.
+- `manage.py toggle_profiling on --view profile --rate 0.05` writes a
+  toggle file that every worker picks up within a second. It profiles that
+  fraction of requests to the chosen URL names until it expires.
+
+`cprofile` records every call (`.prof`, for pstats/snakeviz). `sample`
+polls the request thread's stack every `PROFILING['INTERVAL']` seconds
+from a helper thread (`.folded`, for flamegraph.pl/speedscope), so the
+request itself runs at nearly full speed. Results go to
+`PROFILING['DIR']`, which keeps only the newest `MAX_FILES`.
+`manage.py aggregate_profiles` merges them.
+"""
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+DEFAULTS = {
+    'DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    'MAX_FILES': 200,
+    'MODE': 'sample',  # default for the toggle; the header names its own
+    'INTERVAL': 0.005,  # seconds between stack samples
+}
+MODES = ('cprofile', 'sample')
+TOGGLE_FILE = 'enabled.json'
+# How often workers re-read the toggle file
+TOGGLE_CHECK_INTERVAL = 1.0
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+class Toggle:
+    """The toggle file's contents, re-read at most once per TOGGLE_CHECK_INTERVAL."""
+
+    def __init__(self):
+        self.checked_at = -TOGGLE_CHECK_INTERVAL
+        self.mtime = None
+        self.state = None
+
+    def current(self):
+        now = time.monotonic()
+        if now - self.checked_at >= TOGGLE_CHECK_INTERVAL:
+            self.checked_at = now
+            self.reload()
+        if self.state and self.state['until'] < time.time():
+            return None
+        return self.state
+
+    def reload(self):
+        path = os.path.join(config()['DIR'], TOGGLE_FILE)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            self.mtime = self.state = None
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(path) as f:
+                self.state = json.load(f)
+            self.mtime = mtime
+        except (OSError, ValueError):
+            self.state = None
+
+
+_toggle = Toggle()
+
+
+def write_toggle(views, rate, mode, seconds):
+    directory = config()['DIR']
+    os.makedirs(directory, exist_ok=True)
+    state = {'views': sorted(views), 'rate': rate, 'mode': mode, 'until': time.time() + seconds}
+    tmp = os.path.join(directory, TOGGLE_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, os.path.join(directory, TOGGLE_FILE))
+    return state
+
+
+def clear_toggle():
+    try:
+        os.remove(os.path.join(config()['DIR'], TOGGLE_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def choose_mode(request, view_name, user=None):
+    """
+    The profiler to run for this request, or None (the common case). Async
+    callers pass the `user` they have already loaded.
+    """
+    requested = request.META.get('HTTP_X_PROFILE')
+    if requested and (user or request.user).is_staff:
+        return requested if requested in MODES else config()['MODE']
+    state = _toggle.current()
+    if state and view_name in state['views'] and random.random() < state['rate']:
+        return state['mode']
+    return None
+
+
+class CProfiler:
+    suffix = '.prof'
+
+    def __init__(self, interval):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread, in collapsed-stack form."""
+    suffix = '.folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+PROFILERS = {'cprofile': CProfiler, 'sample': StackSampler}
+
+
+def save(profiler, view_name, elapsed):
+    """Write a finished profile into the ring buffer and return its file name."""
+    cfg = config()
+    directory = cfg['DIR']
+    os.makedirs(directory, exist_ok=True)
+    # Sortable by time; the view and duration make `ls` useful on its own
+    safe_view = view_name.replace(':', '-').replace('/', '-')
+    name = f'{time.time():.6f}-{os.getpid()}-{safe_view}-{elapsed * 1000:.0f}ms{profiler.suffix}'
+    profiler.write(os.path.join(directory, name))
+    prune(directory, cfg['MAX_FILES'])
+    return name
+
+
+def profile_files(directory=None):
+    directory = directory or config()['DIR']
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.endswith(('.prof', '.folded')))
+
+
+def prune(directory, max_files):
+    for name in profile_files(directory)[:-max_files or None]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # another worker pruned it first
+
+
+def parse_name(name):
+    """`(timestamp, pid, view, milliseconds)` from a profile file name."""
+    stem = name.rsplit('.', 1)[0]
+    timestamp, pid, rest = stem.split('-', 2)
+    view, duration = rest.rsplit('-', 1)
+    return float(timestamp), int(pid), view, int(duration[:-2])
@@ -0,0 +1,68 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set once the current request (or script) has written to the primary, or
+# when the client carries a recent-write cookie; reads then stay on the
+# primary so the writer sees its own changes despite replication lag.
+_pinned = contextvars.ContextVar('accounts_pinned_to_primary', default=None)
+
+WROTE = 'wrote'
+STICKY = 'sticky'
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_primary(reason=WROTE):
+    _pinned.set(reason)
+
+
+def pinned_reason():
+    return _pinned.get()
+
+
+@contextmanager
+def pinning(reason=None):
+    """Scope pinning to a block (one request), restoring the outer state after."""
+    token = _pinned.set(reason)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to the primary and reads to a random replica.
+
+    Reads stay on the primary while pinned (see `ReplicaPinningMiddleware`)
+    and inside a transaction on the primary, so a read following a write in
+    the same transaction sees it.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema by replication from the primary
+        if db in replica_aliases():
+            return False
+        return None
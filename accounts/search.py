@@ -0,0 +1,129 @@
+"""
+Full-text user search backed by an SQLite FTS5 shadow table.
+
+The table mirrors the searchable columns of `CustomUser` keyed by rowid =
+user pk. Signals keep it current and `rebuild_search_index` regenerates it.
+Every query term is a prefix match and all terms must match, so "ali
+wond" finds Alice Wonderland; results are ranked by bm25 with username
+hits weighted highest. Only the admin matches on email: the autocomplete
+endpoint is open to every user and would tell them which addresses have an
+account.
+"""
+import re
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+TABLE = 'accounts_customuser_search'
+COLUMNS = ('username', 'email', 'first_name', 'last_name')
+# bm25 column weights, in COLUMNS order
+WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+# What search_users() matches on for non-staff callers
+PUBLIC_COLUMNS = ('username', 'first_name', 'last_name')
+
+WORD = re.compile(r'\w')
+
+INSERT_SQL = f'INSERT OR REPLACE INTO {TABLE} (rowid, {", ".join(COLUMNS)}) VALUES (%s, %s, %s, %s, %s)'
+
+
+def is_supported(using):
+    return connections[using].vendor == 'sqlite'
+
+
+def match_expression(query, columns=COLUMNS):
+    """
+    Turn free text into an FTS5 MATCH expression: each whitespace-separated
+    term becomes a quoted prefix phrase, so FTS syntax in the input is
+    treated literally, and terms only match in `columns`. Returns '' when
+    nothing searchable remains.
+    """
+    terms = [term for term in query.split() if WORD.search(term)]
+    if not terms:
+        return ''
+    expression = ' '.join('"%s"*' % term.replace('"', '""') for term in terms)
+    if tuple(columns) == COLUMNS:
+        return expression
+    return '{%s}: (%s)' % (' '.join(columns), expression)
+
+
+def index_users(users, using):
+    """Add or refresh the index rows for `users`."""
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        _insert(cursor, [(user.pk, *(getattr(user, column) for column in COLUMNS)) for user in users])
+
+
+def remove_users(pks, using):
+    pks = list(pks)
+    if not pks or not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+
+def rebuild(model, using, batch_size=1000):
+    """Repopulate the index from `model`'s table; returns the number of rows indexed."""
+    if not is_supported(using):
+        return 0
+    indexed = 0
+    # One transaction, so searches never see a half-built index
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        rows = model.objects.using(using).order_by('pk').values_list('pk', *COLUMNS)
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                indexed += _insert(cursor, batch)
+                batch = []
+        indexed += _insert(cursor, batch)
+        # Merge the index b-trees now rather than on later writes
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def _insert(cursor, rows):
+    rows = [(pk, *(value or '' for value in values)) for pk, *values in rows]
+    if rows:
+        cursor.executemany(INSERT_SQL, rows)
+    return len(rows)
+
+
+def matching_pks(query):
+    """
+    A subquery of the pks matching `query`, for `filter(pk__in=...)`, or
+    None if the query has no searchable terms.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return None
+    return RawSQL(f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [expression])
+
+
+def search_users(model, query, limit=20, using=None, columns=PUBLIC_COLUMNS):
+    """Return up to `limit` users matching `query` in `columns`, best match first."""
+    using = using or router.db_for_read(model)
+    if not is_supported(using):
+        # No FTS on this backend: fall back to prefix matches
+        q = Q()
+        for term in query.split():
+            term_q = Q()
+            for column in columns:
+                term_q |= Q(**{f'{column}__istartswith': term})
+            q &= term_q
+        return list(model.objects.using(using).filter(q)[:limit]) if q else []
+
+    expression = match_expression(query, columns)
+    if not expression:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s '
+            f'ORDER BY bm25({TABLE}, {", ".join(map(str, WEIGHTS))}) LIMIT %s',
+            [expression, limit],
+        )
+        pks = [pk for pk, in cursor.fetchall()]
+    users = model.objects.using(using).in_bulk(pks)
+    return [users[pk] for pk in pks if pk in users]
@@ -0,0 +1,208 @@
+"""
+File serving for deployments without a separate web server in front.
+"""
+import mimetypes
+import os
+import re
+import stat as stat_module
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.staticfiles import views as staticfiles_views
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# Suffixes written by accounts.staticfiles, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# MEDIA_OFFLOAD value -> header naming the file for the front server
+OFFLOAD_HEADERS = {'x-accel-redirect': 'X-Accel-Redirect', 'x-sendfile': 'X-Sendfile'}
+RANGE_CHUNK_SIZE = 64 * 1024
+# Names given by accounts.storage.ContentAddressedStorage: the content never changes
+CONTENT_ADDRESSED = re.compile(r'(^|/)[0-9a-f]{64}\.\w+$')
+
+
+def accepted_encodings(header):
+    """The content codings an Accept-Encoding header allows."""
+    accepted = set()
+    for part in header.split(','):
+        coding, *params = part.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+@lru_cache(maxsize=1)
+def hashed_static_names():
+    """Names collectstatic gave a content hash; read once per process."""
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def static_max_age(path):
+    if path in hashed_static_names():
+        # The name changes whenever the content does
+        return 'public, max-age=%d, immutable' % getattr(settings, 'STATIC_MAX_AGE', 31536000)
+    return 'public, max-age=0, must-revalidate'
+
+
+def serve_static(request, path):
+    """
+    Serve a collected static file with far-future caching for hashed names
+    and a pre-compressed variant when the client accepts one.
+    """
+    fullpath = safe_join(settings.STATIC_ROOT, path)
+    if not os.path.isfile(fullpath):
+        if settings.DEBUG:
+            # Not collected yet: fall back to the app/STATICFILES_DIRS finders
+            return staticfiles_views.serve(request, path, insecure=True)
+        raise Http404('"%s" does not exist' % path)
+
+    served, encoding = fullpath, None
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for coding, suffix in ENCODINGS:
+        if coding in accepted and os.path.isfile(fullpath + suffix):
+            served, encoding = fullpath + suffix, coding
+            break
+
+    stat = os.stat(served)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type, _ = mimetypes.guess_type(fullpath)
+        response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream')
+        response.headers.pop('Content-Disposition', None)
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Cache-Control'] = static_max_age(path)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def media_etag(stat):
+    # nginx's format, so the validators match whichever of the two sends the body
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def media_max_age(path):
+    if CONTENT_ADDRESSED.search(path):
+        return 'public, max-age=%d, immutable' % getattr(settings, 'MEDIA_MAX_AGE', 31536000)
+    return 'public, max-age=0, must-revalidate'
+
+
+def media_offload():
+    offload = getattr(settings, 'MEDIA_OFFLOAD', None)
+    if offload is not None and offload not in OFFLOAD_HEADERS:
+        raise ImproperlyConfigured(f'MEDIA_OFFLOAD must be None or one of {", ".join(OFFLOAD_HEADERS)}')
+    return offload
+
+
+def byte_range(header, size):
+    """
+    The `(first, last)` byte positions a single-range `Range` header asks
+    for, clamped to the file, or None to send the whole file. `first >= size`
+    means the range can't be satisfied.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        # Several ranges would need a multipart body; the whole file will do
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)  # the last `suffix` bytes
+            return (max(size - suffix, 0), size - 1) if suffix else (size, size)
+        first, last = int(first), int(last) if last else None
+    except ValueError:
+        return None
+    if first < 0 or (last is not None and last < first):
+        return None
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+def read_range(fullpath, first, last):
+    with open(fullpath, 'rb') as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file with ETag and Last-Modified validators, 304s and
+    single byte ranges. With MEDIA_OFFLOAD set, only the headers are built
+    here and the front server sends the body (and handles ranges itself).
+    """
+    if any(part.startswith('.') for part in path.split('/')):
+        # Uploads in progress (.incoming) and other hidden files
+        raise Http404('"%s" does not exist' % path)
+    fullpath = safe_join(settings.MEDIA_ROOT, path)
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('"%s" does not exist' % path)
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise Http404('"%s" does not exist' % path)
+
+    etag, last_modified = media_etag(stat), http_date(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': media_max_age(path),
+        'Accept-Ranges': 'bytes',
+    }
+    validators = HttpResponse(headers=headers)
+    response = get_conditional_response(request, etag, int(stat.st_mtime), validators)
+    if response is not validators:
+        return response  # 304 or 412
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    offload = media_offload()
+    requested = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if offload == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_OFFLOAD_PREFIX', '/protected-media/')
+        response[OFFLOAD_HEADERS[offload]] = quote(prefix.rstrip('/') + '/' + path)
+    elif offload == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response[OFFLOAD_HEADERS[offload]] = fullpath
+    elif requested and (not if_range or if_range in (etag, last_modified)) and (
+        span := byte_range(requested, stat.st_size)
+    ):
+        first, last = span
+        if first >= stat.st_size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        else:
+            response = StreamingHttpResponse(read_range(fullpath, first, last), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+            response['Content-Length'] = str(last - first + 1)
+    else:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+        response.headers.pop('Content-Disposition', None)
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,137 @@
+"""
+Cache-first sessions with write-behind to the database.
+"""
+import copy
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.cache import caches
+
+from . import metrics
+from .caching import is_shared
+
+KEY_PREFIX = 'accounts.session'
+
+
+def db_write_interval():
+    return getattr(settings, 'SESSION_DB_WRITE_INTERVAL', 60)
+
+
+class SessionStore(CachedDBStore):
+    """
+    Like `cached_db`, but the cache is the primary copy.
+
+    - A save whose data equals what was loaded is skipped entirely, even if
+      the session was marked modified.
+    - Other saves always update the cache, but write through to the
+      database at most once per `SESSION_DB_WRITE_INTERVAL` seconds per
+      session (new sessions, key rotations and logins are always written).
+      With a per-process cache (`SESSION_CACHE_ALIAS` on LocMem) every save
+      writes through, since other workers can only see the database.
+    - Reads fall back to the database on a cache miss, so losing the cache
+      costs at most the changes since the last write-through.
+    """
+    cache_key_prefix = KEY_PREFIX
+
+    @classmethod
+    def get_model_class(cls):
+        from .models import UserSession
+
+        return UserSession
+
+    def create_model_instance(self, data):
+        session = super().create_model_instance(data)
+        try:
+            session.user_id = int(data.get(SESSION_KEY))
+        except (TypeError, ValueError):
+            session.user_id = None
+        return session
+
+    @property
+    def synced_key(self):
+        return self.cache_key + ':synced'
+
+    def load(self):
+        self._from_db = False
+        data = super().load()
+        metrics.inc('accounts_cache_requests_total', cache='session', result='miss' if self._from_db else 'hit')
+        self._loaded = copy.deepcopy(data)
+        return data
+
+    def _get_session_from_db(self):
+        # Only reached on a cache miss
+        self._from_db = True
+        return super()._get_session_from_db()
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if not must_create and getattr(self, '_loaded', None) == data:
+            return
+
+        now = time.time()
+        last_synced = None if must_create else self._cache.get(self.synced_key)
+        # A change of user is written through at once: the row's user_id is
+        # how delete_user_sessions() finds it.
+        user_changed = data.get(SESSION_KEY) != (getattr(self, '_loaded', None) or {}).get(SESSION_KEY)
+        if (
+            last_synced is None or user_changed or not is_shared(settings.SESSION_CACHE_ALIAS)
+            or now - last_synced >= db_write_interval()
+        ):
+            # Write through: database row and cache together
+            super().save(must_create)
+            self._cache.set(self.synced_key, now, self.get_expiry_age())
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+        self._loaded = copy.deepcopy(data)
+
+    def cycle_key(self):
+        # The stock cycle_key() INSERTs the new row right away, and login()
+        # only then records the user. Dropping the key instead makes the
+        # response's save() create the row once, with its user_id.
+        data = self._session
+        key = self.session_key
+        self._session_key = None
+        self._session_cache = data
+        self.modified = True
+        if key:
+            self.delete(key)
+
+    async def acycle_key(self):
+        await sync_to_async(self.cycle_key)()
+
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, must_create=False):
+        await sync_to_async(self.save)(must_create)
+
+    async def adelete(self, session_key=None):
+        await sync_to_async(self.delete)(session_key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        # One DELETE for the row (the stock backend SELECTs it first) and one
+        # round-trip for both cache entries
+        self.model.objects.filter(session_key=session_key).delete()
+        key = self.cache_key_prefix + session_key
+        self._cache.delete_many([key, key + ':synced'])
+
+
+def delete_user_sessions(user_ids):
+    """Delete every session of `user_ids`, row and cache entries; returns how many there were."""
+    model = SessionStore.get_model_class()
+    keys = list(model.objects.filter(user_id__in=user_ids).values_list('session_key', flat=True))
+    if not keys:
+        return 0
+    model.objects.filter(session_key__in=keys).delete()
+    cache_keys = [KEY_PREFIX + key for key in keys]
+    caches[settings.SESSION_CACHE_ALIAS].delete_many(cache_keys + [key + ':synced' for key in cache_keys])
+    return len(keys)
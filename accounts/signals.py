@@ -0,0 +1,62 @@
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .models import CustomUser
+from .profile_cache import invalidate_profile
+from .user_cache import invalidate_users
+
+
+@receiver(post_delete, sender=CustomUser)
+def release_profile_picture(sender, instance, **kwargs):
+    """Give back the storage references held by a deleted user's picture and variants."""
+    if instance.profile_picture:
+        instance.profile_picture.storage.delete(instance.profile_picture.name)
+    instance.clear_avatar_variants()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_profile_card(sender, instance, **kwargs):
+    invalidate_profile(instance.pk, instance.username)
+
+
+@receiver(post_save, sender=CustomUser)
+def index_user(sender, instance, update_fields=None, using=None, **kwargs):
+    # Saves that only touch other columns (last_login on every login, ...)
+    # leave the search index alone.
+    if update_fields is not None and not set(update_fields) & set(search.COLUMNS):
+        return
+    search.index_users([instance], using)
+
+
+@receiver(post_delete, sender=CustomUser)
+def unindex_user(sender, instance, using=None, **kwargs):
+    search.remove_users([instance.pk], using)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, using=None, **kwargs):
+    invalidate_users([instance.pk])
+    if connections[using].in_atomic_block:
+        # A request may reload the old row before the change commits
+        transaction.on_commit(lambda: invalidate_users([instance.pk]), using=using)
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+def invalidate_cached_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        pks = [instance.pk]
+    elif action == 'pre_clear':
+        # clear() from the group or permission side doesn't say which users lose it
+        pks = sender.objects.filter(**{f'{instance._meta.model_name}_id': instance.pk}).values_list(
+            f'{CustomUser._meta.model_name}_id', flat=True
+        )
+    else:
+        pks = pk_set
+    invalidate_users(pks)
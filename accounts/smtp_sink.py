@@ -0,0 +1,100 @@
+import socketserver
+import threading
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of RFC 5321 to accept mail from smtplib and throw it away."""
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        self.reply('220 localhost SMTP sink ready')
+        recipients = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            text = line.decode('ascii', 'replace').strip()
+            command = text.split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250-localhost\r\n' + ('250-PIPELINING\r\n' if sink.pipelining else '') + '250 8BITMIME')
+            elif command == 'RCPT' and any(address in text for address in sink.refuse):
+                self.reply('550 No such user')
+            elif command == 'RCPT':
+                recipients += 1
+                self.reply('250 OK')
+            elif command in ('MAIL', 'RSET'):
+                recipients = 0
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'DATA' and not recipients:
+                self.reply('554 No valid recipients')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b'.\r\n':
+                        break
+                    lines.append(data[1:] if data.startswith(b'.') else data)
+                with sink.lock:
+                    sink.messages += 1
+                    sink.last_message = b''.join(lines)
+                recipients = 0
+                self.reply('250 OK: queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SMTPSink:
+    """
+    A local SMTP server that accepts and counts messages.
+
+    Used as a stand-in relay for tests and `manage.py benchmark_email`:
+
+        with SMTPSink() as sink:
+            ... send to sink.host:sink.port ...
+            sink.messages, sink.connections, sink.last_message
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, pipelining=True, refuse=()):
+        self.pipelining = pipelining
+        # Recipients answered with 550
+        self.refuse = tuple(refuse)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.last_message = None
+        self.connections = 0
+        self._server = _Server((host, port), _SMTPHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
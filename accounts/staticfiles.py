@@ -0,0 +1,71 @@
+"""
+Static files storage: content-hashed names plus pre-compressed variants.
+
+`collectstatic` writes `base.<hash>.css` (so it can be cached forever) and,
+next to each text asset, `.gz` and, if the optional `brotli` package is
+installed, `.br` copies. `accounts.serving.serve_static` picks the variant
+the client accepts.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # optional; gzip alone is always built
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.map', '.html', '.xml', '.ico')
+
+
+def compress_variants(data):
+    """Yield `(suffix, compressed_bytes)` for each encoding we build."""
+    # mtime=0 keeps the output identical across runs
+    yield '.gz', gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Before collectstatic has run (development, tests) templates still
+    # render, with unhashed URLs served by the staticfiles finders.
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def url_converter(self, name, hashed_files, template=None):
+        convert = super().url_converter(name, hashed_files, template)
+
+        def converter(matchobj):
+            try:
+                return convert(matchobj)
+            except ValueError:
+                # A referenced file that isn't there keeps its plain URL
+                # instead of failing collectstatic.
+                return matchobj.group(0)
+        return converter
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        for suffix, compressed in compress_variants(data):
+            if len(compressed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
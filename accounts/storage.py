@@ -0,0 +1,115 @@
+import hashlib
+import os
+import tempfile
+from pathlib import PurePosixPath
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage that keeps one copy of each distinct file.
+
+    Uploads are hashed (SHA-256) while they are streamed to a temporary file
+    and stored as `<upload dir>/<h[:2]>/<h[2:4]>/<h><ext>`, so byte-identical
+    uploads share a single blob and the two-level sharding keeps directories
+    small. Every `save()` takes a reference on the blob (`MediaBlob.refcount`)
+    and `delete()` only gives one back; unreferenced blobs are removed in bulk
+    by `manage.py gc_media`.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from content in _save(); collisions are the point.
+        return name
+
+    def _save(self, name, content):
+        path = PurePosixPath(name)
+        suffix = path.suffix.lower()
+        if getattr(content, 'sha256', None) and hasattr(content, 'temporary_file_path'):
+            # Hashed while it was uploaded (accounts.uploads): move it, don't re-read it
+            return self._store(path, suffix, content.sha256, content.size, content.temporary_file_path())
+
+        incoming = os.path.join(self.location, '.incoming')
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=incoming, suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            return self._store(path, suffix, digest.hexdigest(), size, tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _store(self, path, suffix, hexdigest, size, tmp_path):
+        """Reference the blob for `hexdigest`, moving `tmp_path` into place unless it already exists."""
+        blob_name = str(path.parent / hexdigest[:2] / hexdigest[2:4] / f'{hexdigest}{suffix}')
+        # Take the reference before checking for the file, so a concurrent
+        # gc_media run cannot collect the blob between the check and the count.
+        self.add_reference(blob_name, size)
+        full_path = self.path(blob_name)
+        if os.path.exists(full_path):
+            os.unlink(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # A rename when both are on one filesystem, a copy otherwise
+            file_move_safe(tmp_path, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        return blob_name
+
+    def add_reference(self, name, size):
+        from .models import MediaBlob
+
+        if MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, updated_at=timezone.now()):
+            return
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.create(name=name, size=size, refcount=1)
+        except IntegrityError:
+            # Another request stored the same content first
+            MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, updated_at=timezone.now())
+
+    def delete(self, name):
+        """Drop one reference to `name`; the file stays until `gc_media` runs."""
+        from .models import MediaBlob
+
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        released = MediaBlob.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F('refcount') - 1, updated_at=timezone.now()
+        )
+        if not released and not MediaBlob.objects.filter(name=name).exists():
+            # Not a content-addressed blob (e.g. uploaded before this storage
+            # was introduced): nothing else can share it.
+            super().delete(name)
+
+    def purge(self, name):
+        """Remove the file for `name` and any shard directories it leaves empty."""
+        super().delete(name)
+        directory = os.path.dirname(self.path(name))
+        for _ in range(2):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def profile_picture_storage():
+    return ContentAddressedStorage()
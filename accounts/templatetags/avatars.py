@@ -0,0 +1,28 @@
+from django import template
+
+register = template.Library()
+
+
+@register.inclusion_tag('accounts/avatar.html')
+def avatar(user, display_size=150):
+    """
+    Render a user's avatar as a <picture> that lets the browser pick the
+    smallest processed variant for `display_size` CSS pixels, preferring WebP.
+
+    Falls back to the uploaded file while variants are still being rendered.
+    """
+    webp = user.get_avatar_variants('webp')
+    jpeg = user.get_avatar_variants('jpeg')
+    fallback = None
+    if jpeg:
+        # Smallest JPEG that covers the display size, else the largest one
+        fallback = next((url for size, url in jpeg if size >= display_size), jpeg[-1][1])
+    elif user.profile_picture:
+        fallback = user.profile_picture.url
+    return {
+        'user': user,
+        'display_size': display_size,
+        'webp_srcset': ', '.join(f'{url} {size}w' for size, url in webp),
+        'jpeg_srcset': ', '.join(f'{url} {size}w' for size, url in jpeg),
+        'fallback': fallback,
+    }
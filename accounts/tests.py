@@ -1,3 +1,1477 @@
-from django.test import TestCase
+import gc
+import hashlib
+import importlib
+import json
+import os
+import pstats
+import re
+import shutil
+import smtplib
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import Permission
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.http import Http404
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from . import async_views, benchmarks, images, metrics, profile_cache, profiling, throttling, user_cache
+from .backends import EmailOrUsernameModelBackend
+from .db import retry_on_busy
+from .email_backends import CircuitOpenError, PooledEmailBackend, reset_pools
+from .emails import plain_text_source, render_email, render_email_batch
+from .hashing import HashingOverloaded, HashingService, PooledPBKDF2PasswordHasher
+from .middleware import ReplicaPinningMiddleware
+from .forms import UserProfileUpdateForm
+from .management.commands.fetch_fonts import font_faces
+from .management.commands.sweep_unverified import delete_accounts, stale_accounts
+from .models import CustomUser, MediaBlob, OutboxEmail, UserSession
+from .outbox import backoff_delay, claim_batch, deliver_batch, enqueue_email
+from .routers import pinning
+from .session_backend import SessionStore, delete_user_sessions
+from .smtp_sink import SMTPSink
+from .views import lookup_profile_user
+from .warmup import STEPS, template_names, warm_up
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@override_settings(EMAIL_POOL_MAX_MESSAGES=100, EMAIL_CIRCUIT_BREAKER_THRESHOLD=2, EMAIL_CIRCUIT_BREAKER_RESET=60)
+class PooledEmailBackendTests(SimpleTestCase):
+    def setUp(self):
+        reset_pools()
+        self.addCleanup(reset_pools)
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+
+    def backend(self, port=None):
+        return PooledEmailBackend(
+            host='127.0.0.1', port=port or self.sink.port, username='', password='', use_tls=False, use_ssl=False
+        )
+
+    def message(self, i=0):
+        return EmailMessage('Subject', 'Body', 'noreply@example.com', [f'user{i}@example.com'])
+
+    def test_connection_reused_across_sends(self):
+        for i in range(3):
+            message = self.message(i)
+            message.connection = self.backend()
+            self.assertEqual(message.send(), 1)
+        self.assertEqual(self.sink.messages, 3)
+        self.assertEqual(self.sink.connections, 1)
+
+    @override_settings(EMAIL_POOL_MAX_MESSAGES=10)
+    def test_batch_recycles_connection(self):
+        sent = self.backend().send_messages([self.message(i) for i in range(25)])
+        self.assertEqual(sent, 25)
+        self.assertEqual(self.sink.messages, 25)
+        self.assertEqual(self.sink.connections, 3)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        port = unused_port()
+        for _ in range(2):
+            with self.assertRaises(ConnectionRefusedError):
+                self.backend(port).send_messages([self.message()])
+        with self.assertRaises(CircuitOpenError):
+            self.backend(port).send_messages([self.message()])
+        # Failing silently reports nothing sent instead of raising.
+        backend = PooledEmailBackend(
+            host='127.0.0.1', port=port, username='', password='', use_tls=False, use_ssl=False, fail_silently=True
+        )
+        self.assertEqual(backend.send_messages([self.message()]), 0)
+
+    def count_writes(self, sink, message):
+        backend = self.backend(sink.port)
+        backend.send_messages([self.message()])  # connected, EHLO done
+        with mock.patch.object(smtplib.SMTP, 'send', autospec=True, side_effect=smtplib.SMTP.send) as send:
+            self.assertEqual(backend.send_messages([message]), 1)
+        return send.call_count
+
+    def test_commands_are_pipelined(self):
+        # A lone dot would end the message early if it weren't escaped
+        body = 'Body\n.\nafter a lone dot'
+        message = EmailMessage('Subject', body, 'noreply@example.com', [f'user{i}@example.com' for i in range(3)])
+        # MAIL + 3 RCPT + DATA in one write, the message in another
+        self.assertEqual(self.count_writes(self.sink, message), 2)
+        self.assertEqual(self.sink.messages, 2)
+        self.assertIn(b'\r\n.\r\nafter a lone dot\r\n', self.sink.last_message)
+
+    def test_relays_without_pipelining_get_one_command_per_write(self):
+        sink = SMTPSink(pipelining=False).start()
+        self.addCleanup(sink.stop)
+        message = EmailMessage('Subject', 'Body', 'noreply@example.com', [f'user{i}@example.com' for i in range(3)])
+        self.assertEqual(self.count_writes(sink, message), 6)
+        self.assertEqual(sink.messages, 2)
+
+    def test_refused_recipients(self):
+        sink = SMTPSink(refuse=['nobody@']).start()
+        self.addCleanup(sink.stop)
+        backend = self.backend(sink.port)
+        partly = EmailMessage('Subject', 'Body', 'noreply@example.com', ['user@example.com', 'nobody@example.com'])
+        self.assertEqual(backend.send_messages([partly]), 1)
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            backend.send_messages([EmailMessage('Subject', 'Body', 'noreply@example.com', ['nobody@example.com'])])
+        # The connection survives a refused message
+        self.assertEqual(backend.send_messages([self.message()]), 1)
+        self.assertEqual((sink.messages, sink.connections), (2, 1))
+
+
+@override_settings(EMAIL_OUTBOX_BACKOFF_BASE=30, EMAIL_OUTBOX_BACKOFF_MAX=3600, EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(TestCase):
+    """Queued emails are claimed by one worker, retried with backoff and eventually given up on."""
+
+    def enqueue(self, count):
+        return [enqueue_email('Subject', 'Body', f'user{i}@example.com') for i in range(count)]
+
+    def test_claimed_rows_are_hidden_from_other_workers_until_the_lease_ends(self):
+        self.enqueue(3)
+        first = claim_batch(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual([email.pk for email in claim_batch(5)], [OutboxEmail.objects.order_by('pk').last().pk])
+        self.assertEqual(claim_batch(5), [])
+        # A worker that died mid-batch: its rows come back once the lease runs out
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in first]).update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(sorted(email.pk for email in claim_batch(5)), sorted(email.pk for email in first))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        for attempts, seconds in ((1, 30), (2, 60), (4, 240), (20, 3600)):
+            with self.subTest(attempts):
+                delay = backoff_delay(attempts).total_seconds()
+                self.assertTrue(0.8 * seconds <= delay <= 1.2 * seconds, delay)
+
+    def test_refused_emails_are_retried_until_max_attempts(self):
+        (email,) = self.enqueue(1)
+        refused = smtplib.SMTPRecipientsRefused({'user0@example.com': (550, b'No such user')})
+        with mock.patch('accounts.outbox.get_connection') as get_connection:
+            get_connection.return_value.send_messages.side_effect = refused
+            self.assertEqual(deliver_batch(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_PENDING, 1))
+            self.assertIn('No such user', email.last_error)
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=20))
+            # Not due yet
+            self.assertEqual(deliver_batch(), (0, 0))
+
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(deliver_batch(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_FAILED, 2))
+        self.assertEqual(claim_batch(5), [])
+
+    def test_an_unreachable_relay_costs_no_attempts(self):
+        emails = self.enqueue(2)
+        with mock.patch('accounts.outbox.get_connection') as get_connection:
+            get_connection.return_value.open.side_effect = ConnectionRefusedError('relay down')
+            for _ in range(3):
+                self.assertEqual(deliver_batch(), (0, 2))
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_PENDING, 0))
+            self.assertIn('relay down', email.last_error)
+
+    def test_a_dropped_connection_stops_the_batch(self):
+        self.enqueue(3)
+        with mock.patch('accounts.outbox.get_connection') as get_connection:
+            get_connection.return_value.send_messages.side_effect = [1, smtplib.SMTPServerDisconnected('gone')]
+            self.assertEqual(deliver_batch(), (1, 2))
+            self.assertEqual(get_connection.return_value.send_messages.call_count, 2)
+        self.assertEqual(
+            list(OutboxEmail.objects.order_by('pk').values_list('status', 'attempts')),
+            [(OutboxEmail.STATUS_SENT, 1), (OutboxEmail.STATUS_PENDING, 0), (OutboxEmail.STATUS_PENDING, 0)],
+        )
+
+    @override_settings(
+        EMAIL_BACKEND='accounts.email_backends.PooledEmailBackend', EMAIL_HOST='127.0.0.1',
+        EMAIL_HOST_USER='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+        EMAIL_CIRCUIT_BREAKER_THRESHOLD=2, EMAIL_CIRCUIT_BREAKER_RESET=60,
+    )
+    def test_an_open_circuit_costs_no_attempts(self):
+        reset_pools()
+        self.addCleanup(reset_pools)
+        (email,) = self.enqueue(1)
+        errors = []
+        with override_settings(EMAIL_PORT=unused_port()):
+            for _ in range(4):
+                self.assertEqual(deliver_batch(), (0, 1))
+                email.refresh_from_db()
+                errors.append(email.last_error.split(':')[0])
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(errors, ['ConnectionRefusedError'] * 2 + ['CircuitOpenError'] * 2)
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_PENDING, 0))
+
+    @mock.patch('accounts.management.commands.send_queued_emails.close_old_connections')
+    def test_send_queued_emails_drains_the_outbox(self, _):
+        self.enqueue(3)
+        out = StringIO()
+        call_command('send_queued_emails', '--batch-size', '2', stdout=out)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f'user{i}@example.com' for i in range(3)])
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.STATUS_SENT).count(), 3)
+        self.assertIn('Outbox drained: 3 sent, 0 failed', out.getvalue())
+
+
+@override_settings(DATABASE_BUSY_RETRIES=2, DATABASE_BUSY_BACKOFF=0.1)
+class SQLiteTuningTests(TransactionTestCase):
+    """The connection pragmas, and accounts.db.retry_on_busy."""
+
+    def busy_then(self, *outcomes):
+        func = mock.Mock(side_effect=outcomes)
+        return func, retry_on_busy(func)
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = connections[DEFAULT_DB_ALIAS].__class__(
+                {**connections[DEFAULT_DB_ALIAS].settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')},
+            )
+            try:
+                with wrapper.cursor() as cursor:
+                    pragmas = {}
+                    for name in ('journal_mode', 'busy_timeout', 'synchronous'):
+                        pragmas[name] = cursor.execute(f'PRAGMA {name}').fetchone()[0]
+            finally:
+                wrapper.close()
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'busy_timeout': 5000, 'synchronous': 1})
+
+    @mock.patch('accounts.db.random.uniform', return_value=1.0)
+    @mock.patch('accounts.db.time.sleep')
+    def test_locked_writes_are_retried_with_backoff(self, sleep, _):
+        func, wrapped = self.busy_then(OperationalError('database is locked'), OperationalError('database is locked'), 'ok')
+        self.assertEqual(wrapped(), 'ok')
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [0.1, 0.2])
+
+        func, wrapped = self.busy_then(*[OperationalError('database is locked')] * 4)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            wrapped()
+        self.assertEqual(func.call_count, 3)
+
+    @mock.patch('accounts.db.time.sleep')
+    def test_no_retry_inside_a_transaction(self, sleep):
+        func, wrapped = self.busy_then(OperationalError('database is locked'), 'ok')
+        with transaction.atomic(), self.assertRaisesMessage(OperationalError, 'database is locked'):
+            wrapped()
+        self.assertEqual(func.call_count, 1)
+        sleep.assert_not_called()
+
+    @mock.patch('accounts.db.time.sleep')
+    def test_other_errors_pass_through(self, sleep):
+        error = OperationalError('no such table: accounts_customuser')
+        func, wrapped = self.busy_then(error, 'ok')
+        with self.assertRaises(OperationalError) as raised:
+            wrapped()
+        self.assertIs(raised.exception, error)
+        self.assertEqual(func.call_count, 1)
+        sleep.assert_not_called()
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Runs against a second SQLite file standing in for a replica. The replica
+    only sees the primary's data when `sync_replica()` copies it over, so a
+    read that returns fresh data must have been routed to the primary.
+    """
+    @classmethod
+    def setUpClass(cls):
+        # Registered here rather than in settings so the test runner does not
+        # create it; the fixture below fills it by copying the primary.
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['replica'] = {
+            **connections[DEFAULT_DB_ALIAS].settings_dict,
+            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+            'TEST': {'MIRROR': None},
+        }
+        cls.databases = {DEFAULT_DB_ALIAS, 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        del cls.databases
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.replica_dir)
+
+    def setUp(self):
+        with pinning():
+            self.user = CustomUser.objects.create_user('alice', 'alice@example.com', 'pw', bio='Old bio')
+        self.sync_replica()
+
+    def sync_replica(self):
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        replica = connections['replica']
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+
+    def test_reads_go_to_replica(self):
+        with pinning():
+            CustomUser.objects.create_user('bob', 'bob@example.com', 'pw')
+        with pinning():
+            self.assertFalse(CustomUser.objects.filter(username='bob').exists())
+            self.sync_replica()
+            self.assertTrue(CustomUser.objects.filter(username='bob').exists())
+
+    def test_write_pins_later_reads_to_primary(self):
+        with pinning():
+            CustomUser.objects.filter(pk=self.user.pk).update(bio='New bio')
+            self.assertEqual(CustomUser.objects.get(pk=self.user.pk).bio, 'New bio')
+
+    @override_settings(USER_CACHE_ENABLED=True)
+    def test_profile_update_is_read_back_after_redirect(self):
+        with pinning():
+            reader = CustomUser.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.sync_replica()
+        with pinning():
+            self.client.force_login(self.user)
+        response = self.client.post(reverse('profile_edit'), {'first_name': '', 'last_name': '', 'bio': 'New bio'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        # The redirect target reads from the primary while the cookie lasts
+        self.assertContains(self.client.get(response.url), 'New bio')
+        # Without it the own profile still comes from the user cache, which
+        # only ever loads from the primary
+        del self.client.cookies[ReplicaPinningMiddleware.cookie_name]
+        self.assertContains(self.client.get(response.url), 'New bio')
+        # while other readers get the lagging replica's old row
+        with pinning():
+            self.client.force_login(reader)
+        self.assertContains(self.client.get(response.url), 'Old bio')
+
+    def test_verification_link_for_unreplicated_account(self):
+        with pinning():
+            user = CustomUser.objects.create_user('carol', 'carol@example.com', 'pw')
+        uid = urlsafe_base64_encode(force_bytes(user.pk))
+        self.client.get(reverse('verify-email', args=[uid, default_token_generator.make_token(user)]))
+        with pinning():
+            self.assertTrue(CustomUser.objects.using(DEFAULT_DB_ALIAS).get(pk=user.pk).email_verified)
+
+
+@override_settings(
+    THROTTLE_ENABLED=False, USER_CACHE_ENABLED=True, PROFILE_CACHE_ENABLED=True,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ViewQueryBudgetTests(TestCase):
+    """Every view stays within the query budget declared in accounts.benchmarks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed_users(1000)
+
+    def test_views_within_query_budget(self):
+        ctx = benchmarks.Context(1000)
+        for scenario in benchmarks.SCENARIOS:
+            with self.subTest(scenario.name):
+                result = benchmarks.measure(scenario, ctx, iterations=2)
+                self.assertLessEqual(result['queries'], scenario.budget)
+
+
+class DirectoryQueryPlanTests(TestCase):
+    """The directory and admin user filters are answered from an index, never a full table scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed_users(200)
+        CustomUser.objects.filter(username__in=['seed1', 'seed2', 'seed3']).update(user_type='staff', email_verified=False)
+        cls.admin = CustomUser.objects.create_superuser('directory-admin', 'directory-admin@example.com', benchmarks.PASSWORD)
+
+    def setUp(self):
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite':
+            self.skipTest('Query plan format is SQLite-specific')
+        # Cached users of earlier tests may share primary keys with this one's
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def user_table_plans(self, path):
+        """Run `path` and return the EXPLAIN QUERY PLAN steps of its queries on the user table."""
+        connection = connections[DEFAULT_DB_ALIAS]
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in captured.captured_queries:
+                if query['sql'].startswith('SELECT') and 'FROM "accounts_customuser"' in query['sql']:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append([row[-1] for row in cursor.fetchall()])
+        self.assertTrue(plans, f'{path} ran no query on the user table')
+        return response, plans
+
+    def assertIndexed(self, path):
+        response, plans = self.user_table_plans(path)
+        for steps in plans:
+            for step in steps:
+                self.assertNotRegex(step, r'^SCAN accounts_customuser$', f'{path}: {steps}')
+                self.assertNotIn('TEMP B-TREE', step, f'{path}: {steps}')
+        return response
+
+    def test_directory_filters_use_indexes(self):
+        for query in ('', 'user_type=staff', 'user_type=community', 'email_verified=true', 'email_verified=false',
+                      'is_active=true', 'is_active=false', 'user_type=staff&email_verified=false'):
+            with self.subTest(query):
+                response = self.assertIndexed(f'{reverse("user_directory")}?limit=2&{query}')
+                next_url = response.json()['next']
+                if next_url:
+                    self.assertIndexed(next_url)
+
+    def test_directory_pages_follow_cursor(self):
+        url, seen = f'{reverse("user_directory")}?limit=7', []
+        while url:
+            data = self.client.get(url).json()
+            seen += [user['username'] for user in data['results']]
+            url = data['next']
+        expected = list(CustomUser.objects.order_by('-date_joined', '-id').values_list('username', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get(f'{reverse("user_directory")}?cursor=bogus').status_code, 400)
+
+    def test_admin_list_filters_use_indexes(self):
+        changelist = reverse('admin:accounts_customuser_changelist')
+        for query in ('user_type__exact=staff', 'email_verified__exact=1', 'email_verified__exact=0'):
+            with self.subTest(query):
+                self.assertIndexed(f'{changelist}?{query}')
+
+    def test_members_only_see_active_verified_users(self):
+        member = CustomUser.objects.create_user('member', 'member@example.com', benchmarks.PASSWORD)
+        CustomUser.objects.filter(username='seed4').update(is_active=False)
+        visible = set(CustomUser.objects.filter(is_active=True, email_verified=True).values_list('username', flat=True))
+        self.assertNotIn('seed4', visible)
+        self.client.force_login(member)
+        # seed1-3, the only staff-type users, are unverified
+        for query, count in (('', 100), ('email_verified=false', 0), ('is_active=false', 0), ('user_type=staff', 0)):
+            with self.subTest(query):
+                response = self.assertIndexed(f'{reverse("user_directory")}?limit=100&{query}')
+                usernames = [user['username'] for user in response.json()['results']]
+                self.assertEqual(len(usernames), count)
+                self.assertLessEqual(set(usernames), visible)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+@override_settings(USER_CACHE_ENABLED=True)
+class UserCacheTests(TestCase):
+    """request.user comes from accounts.user_cache and follows every change to the user."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('dana', 'dana@example.com', 'Old-password-1', email_verified=True)
+        self.client.force_login(self.user)
+
+    def test_logged_in_requests_do_not_query_the_user(self):
+        self.client.get(reverse('profile_edit'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('profile', args=['dana']))
+        self.assertEqual(response.context['user'], self.user)
+
+    @override_settings(USER_CACHE_ENABLED=None)
+    def test_off_without_a_shared_cache(self):
+        # The test settings use the per-process LocMem cache
+        self.assertFalse(user_cache.enabled())
+        self.client.get(reverse('profile_edit'))
+        # Not invalidated: only a database read can see this
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('profile_edit')).status_code, 302)
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with self.settings(CACHES=redis):
+            self.assertTrue(user_cache.enabled())
+
+    def test_changes_reach_the_next_request(self):
+        self.client.get(reverse('profile_edit'))
+        self.user.is_staff = True
+        self.user.save()
+        self.assertTrue(self.client.get(reverse('profile_edit')).context['user'].is_staff)
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        user_cache.invalidate_users([self.user.pk])
+        self.assertRedirects(self.client.get(reverse('profile_edit')), f'{reverse("login")}?next={reverse("profile_edit")}')
+
+    def test_permission_changes_invalidate(self):
+        self.client.get(reverse('profile_edit'))
+        version = cache.get(user_cache.USER_VERSION_KEY.format(self.user.pk))
+        self.user.user_permissions.add(Permission.objects.get(codename='view_customuser'))
+        self.assertNotEqual(cache.get(user_cache.USER_VERSION_KEY.format(self.user.pk)), version)
+
+    def test_password_reset_logs_out_other_sessions(self):
+        other = self.client_class()
+        other.force_login(self.user)
+        self.assertEqual(other.get(reverse('profile_edit')).status_code, 200)
+
+        token = default_token_generator.make_token(self.user)
+        response = self.client.get(reverse('password_reset_confirm', args=[self.user.get_uid(), token]))
+        response = self.client.post(response.url, {'new_password1': 'New-password-2', 'new_password2': 'New-password-2'})
+        self.assertRedirects(response, reverse('password_reset_complete'))
+
+        # The cached row is replaced at once, so the old session hash no longer matches
+        self.assertEqual(other.get(reverse('profile_edit')).status_code, 302)
+
+
+class SessionStoreTests(TestCase):
+    """accounts.session_backend: cache first, database written behind."""
+
+    def setUp(self):
+        cache.clear()
+        shared = mock.patch('accounts.session_backend.is_shared', return_value=True)
+        self.is_shared = shared.start()
+        self.addCleanup(shared.stop)
+
+    def stored(self, key):
+        return UserSession.objects.get(session_key=key).get_decoded()
+
+    def create(self, **data):
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    def test_unchanged_session_is_not_saved(self):
+        key = self.create(theme='dark')
+        session = SessionStore(key)
+        session['theme'] = 'dark'
+        with self.assertNumQueries(0), mock.patch.object(session._cache, 'set') as cache_set:
+            session.save()
+        cache_set.assert_not_called()
+
+    def test_changes_are_written_behind_within_the_interval(self):
+        key = self.create(visits=1)
+        session = SessionStore(key)
+        session['visits'] = 2
+        session.save()
+        self.assertEqual(SessionStore(key)['visits'], 2)
+        self.assertEqual(self.stored(key)['visits'], 1)
+
+        later = time.time() + settings.SESSION_DB_WRITE_INTERVAL
+        with mock.patch('accounts.session_backend.time.time', return_value=later):
+            session = SessionStore(key)
+            session['visits'] = 3
+            session.save()
+        self.assertEqual(self.stored(key)['visits'], 3)
+
+    def test_every_save_writes_through_without_a_shared_cache(self):
+        self.is_shared.return_value = False
+        key = self.create(visits=1)
+        session = SessionStore(key)
+        session['visits'] = 2
+        session.save()
+        self.assertEqual(self.stored(key)['visits'], 2)
+
+    def test_cycle_key_writes_one_row_with_the_user(self):
+        user = CustomUser.objects.create_user('pat', 'pat@example.com', 'Password-123')
+        old_key = self.create(cart=['book'])
+        session = SessionStore(old_key)
+        session.cycle_key()
+        self.assertFalse(UserSession.objects.filter(session_key=old_key).exists())
+        self.assertIsNone(cache.get(SessionStore.cache_key_prefix + old_key))
+        session[SESSION_KEY] = str(user.pk)
+        session.save()
+        row = UserSession.objects.get(session_key=session.session_key)
+        self.assertEqual((row.user_id, row.get_decoded()['cart']), (user.pk, ['book']))
+        self.assertEqual(delete_user_sessions([user.pk]), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SweepUnverifiedTests(TestCase):
+    """sweep_unverified removes stale, never-used accounts with their sessions and pictures."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+        storage = CustomUser._meta.get_field('profile_picture').storage
+        self.picture = storage.save('profile_pics/stale.jpg', ContentFile(b'stale picture'))
+        self.stale = self.account('stale', profile_picture=self.picture)
+        self.fresh = self.account('fresh', days=1)
+        self.staff = self.account('staff', is_staff=True)
+        self.used = self.account('used', last_login=timezone.now())
+        self.verified = self.account('verified', email_verified=True)
+
+    def account(self, username, days=30, **fields):
+        user = CustomUser.objects.create_user(username, f'{username}@example.com', 'Password-123', **fields)
+        CustomUser.objects.filter(pk=user.pk).update(date_joined=timezone.now() - timedelta(days=days))
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session.save()
+        return user
+
+    def sweep(self, *args):
+        call_command('sweep_unverified', '--days', '7', '--sleep', '0', '--batch-size', '2', *args, stdout=StringIO())
+
+    def test_only_stale_accounts_are_deleted(self):
+        self.sweep()
+        self.assertQuerySetEqual(
+            CustomUser.objects.order_by('username').values_list('username', flat=True),
+            ['fresh', 'staff', 'used', 'verified'],
+        )
+        self.assertFalse(UserSession.objects.filter(user_id=self.stale.pk).exists())
+        self.assertEqual(UserSession.objects.count(), 4)
+        self.assertEqual(MediaBlob.objects.get(name=self.picture).refcount, 0)
+
+    def test_dry_run_deletes_nothing(self):
+        self.sweep('--dry-run')
+        self.assertEqual(CustomUser.objects.count(), 5)
+        self.assertEqual(UserSession.objects.count(), 5)
+
+    def test_batch_is_checked_again_before_deleting(self):
+        candidates = stale_accounts(timezone.now() - timedelta(days=7))
+        pks = list(candidates.values_list('pk', flat=True))
+        # Verified after the scan, before its batch is deleted
+        CustomUser.objects.filter(pk=self.stale.pk).update(email_verified=True)
+        self.assertEqual(delete_accounts(candidates, pks), (0, 0, 0))
+        self.assertTrue(CustomUser.objects.filter(pk=self.stale.pk).exists())
+
+    def test_migration_copies_live_sessions(self):
+        from django.apps import apps
+        from django.contrib.sessions.backends.db import SessionStore as DatabaseStore
+        from django.contrib.sessions.models import Session
+
+        migration = import_module('accounts.migrations.0011_usersession')
+        UserSession.objects.all().delete()
+        live, expired = DatabaseStore(), DatabaseStore()
+        live[SESSION_KEY] = str(self.used.pk)
+        live.save()
+        expired.set_expiry(-1)
+        expired.save()
+        migration.copy_live_sessions(apps, None)
+        copied = UserSession.objects.get()
+        self.assertEqual((copied.session_key, copied.user_id), (live.session_key, self.used.pk))
+        self.assertEqual(copied.session_data, Session.objects.get(pk=live.session_key).session_data)
+
+
+def png_header(width, height):
+    """A PNG up to the start of its pixel data: all Pillow reads to learn its size."""
+    ihdr = b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + ihdr + struct.pack('>I', zlib.crc32(ihdr))
+        + struct.pack('>I', 1024) + b'IDAT'
+    )
+
+
+class ProfilePictureUploadTests(TestCase):
+    """Profile pictures go through accounts.uploads.ImageUploadHandler and its limits."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+        self.user = CustomUser.objects.create_user('erin', 'erin@example.com', 'Password-123', email_verified=True)
+        self.client.force_login(self.user)
+
+    def upload(self, name, content, client=None):
+        data = {'first_name': 'Erin', 'last_name': '', 'bio': '', 'profile_picture': SimpleUploadedFile(name, content)}
+        return (client or self.client).post(reverse('profile_edit'), data)
+
+    def png(self, size=(32, 32)):
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.effect_noise(size, 64).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def incoming(self):
+        return os.listdir(os.path.join(self.media_root, '.incoming'))
+
+    def test_picture_is_stored_under_the_hash_computed_while_uploading(self):
+        content = self.png()
+        self.assertEqual(self.upload('me.png', content).status_code, 302)
+        self.user.refresh_from_db()
+        self.assertIn(hashlib.sha256(content).hexdigest(), self.user.profile_picture.name)
+        self.assertEqual(self.incoming(), [])
+
+    def test_header_over_the_pixel_limit_is_refused_without_decoding(self):
+        # 40000 x 40000 would be 4.8 GB decoded; only the header is sent
+        response = self.upload('bomb.png', png_header(40000, 40000) + b'\0' * 1024)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('megapixels', response.context['form'].errors['profile_picture'][0])
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_picture)
+        self.assertEqual(self.incoming(), [])
+
+    @override_settings(PROFILE_PICTURE_MAX_BYTES=4096)
+    def test_file_over_the_byte_limit_is_refused(self):
+        response = self.upload('big.png', self.png((128, 128)))
+        self.assertIn('too large', response.context['form'].errors['profile_picture'][0])
+        self.assertEqual(self.incoming(), [])
+
+    def test_not_an_image(self):
+        response = self.upload('notes.png', b'just some text')
+        self.assertIn('valid image', response.context['form'].errors['profile_picture'][0])
+
+    def test_csrf_is_still_checked(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(self.upload('me.png', self.png(), client).status_code, 403)
+
+
+class MediaStorageTests(TestCase):
+    """Content-addressed profile pictures: shared blobs, reference counts and gc_media."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.storage = CustomUser._meta.get_field('profile_picture').storage
+
+    def refcount(self, name):
+        return MediaBlob.objects.get(name=name).refcount
+
+    def age(self, name, hours=48):
+        past = timezone.now() - timedelta(hours=hours)
+        MediaBlob.objects.filter(name=name).update(updated_at=past)
+        os.utime(self.storage.path(name), (past.timestamp(), past.timestamp()))
+
+    def gc(self, *args):
+        call_command('gc_media', '--grace-hours', '24', *args, stdout=StringIO())
+
+    def test_identical_content_shares_one_blob(self):
+        first = self.storage.save('profile_pics/a.jpg', ContentFile(b'same bytes'))
+        second = self.storage.save('profile_pics/b.jpg', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertEqual(self.refcount(first), 2)
+        self.storage.delete(first)
+        self.assertEqual(self.refcount(first), 1)
+        self.assertTrue(self.storage.exists(first))
+
+    def test_replacing_a_picture_releases_the_old_references_on_commit(self):
+        from PIL import Image
+
+        picture = self.storage.save('profile_pics/old.jpg', ContentFile(b'old picture'))
+        variant = self.storage.save('profile_pics/avatars/old_64.webp', ContentFile(b'old variant'))
+        user = CustomUser.objects.create_user(
+            'nina', 'nina@example.com', 'Password-123', profile_picture=picture, avatar_variants={'64.webp': variant}
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, 'PNG')
+        form = UserProfileUpdateForm(
+            {'first_name': 'Nina', 'last_name': '', 'bio': ''},
+            {'profile_picture': SimpleUploadedFile('new.png', buffer.getvalue())},
+            instance=user,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks() as callbacks:
+            form.save()
+            # Still referenced until the new row is committed
+            self.assertEqual((self.refcount(picture), self.refcount(variant)), (1, 1))
+        for callback in callbacks:
+            callback()
+        self.assertEqual((self.refcount(picture), self.refcount(variant)), (0, 0))
+        user.refresh_from_db()
+        self.assertEqual(user.avatar_variants, {})
+        self.assertNotEqual(user.profile_picture.name, picture)
+
+    def test_gc_removes_only_old_unreferenced_blobs(self):
+        kept = self.storage.save('profile_pics/kept.jpg', ContentFile(b'kept'))
+        released = self.storage.save('profile_pics/released.jpg', ContentFile(b'released'))
+        recent = self.storage.save('profile_pics/recent.jpg', ContentFile(b'recent'))
+        self.storage.delete(released)
+        self.storage.delete(recent)
+        self.age(kept)
+        self.age(released)
+        self.gc()
+        self.assertTrue(self.storage.exists(kept))
+        self.assertTrue(self.storage.exists(recent))
+        self.assertFalse(self.storage.exists(released))
+        self.assertFalse(MediaBlob.objects.filter(name=released).exists())
+
+    def test_gc_sweeps_old_files_without_a_row(self):
+        orphan = self.storage.save('profile_pics/orphan.jpg', ContentFile(b'orphan'))
+        fresh = self.storage.save('profile_pics/fresh.jpg', ContentFile(b'fresh'))
+        legacy = self.storage.save('profile_pics/legacy.jpg', ContentFile(b'legacy'))
+        self.age(orphan)
+        MediaBlob.objects.filter(name__in=[orphan, fresh]).delete()
+        # Uploaded before content addressing: not named by hash, so never swept
+        os.rename(self.storage.path(legacy), self.storage.path('profile_pics/legacy.jpg'))
+        MediaBlob.objects.filter(name=legacy).delete()
+        os.utime(self.storage.path('profile_pics/legacy.jpg'), (0, 0))
+
+        self.gc('--dry-run')
+        self.assertTrue(self.storage.exists(orphan))
+        self.gc()
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertFalse(os.path.exists(os.path.dirname(self.storage.path(orphan))))
+        self.assertTrue(self.storage.exists(fresh))
+        self.assertTrue(self.storage.exists('profile_pics/legacy.jpg'))
+
+
+@mock.patch('accounts.images.close_old_connections')  # would close the test's transaction
+class AvatarPipelineTests(TestCase):
+    """Rendered avatars are stored off the process pool's thread, and failures are logged."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, AVATAR_SIZES=(16, 32))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.storage = CustomUser._meta.get_field('profile_picture').storage
+        self.upload = self.storage.save('profile_pics/upload.png', ContentFile(self.picture()))
+        self.user = CustomUser.objects.create_user('olga', 'olga@example.com', 'Password-123', profile_picture=self.upload)
+
+    def picture(self):
+        from PIL import Image
+
+        buffer = BytesIO()
+        image = Image.new('RGB', (64, 48), (200, 40, 40))
+        exif = Image.Exif()
+        exif[0x010E] = 'holiday'  # ImageDescription
+        image.save(buffer, 'PNG', exif=exif)
+        return buffer.getvalue()
+
+    def rendered(self, name=None, sizes=(16, 32)):
+        future = Future()
+        with self.storage.open(name or self.upload) as f:
+            future.set_result(images.render_avatar_variants(f.read(), sizes, 1024))
+        return future
+
+    def store(self, name, rendered):
+        stored = Future()
+        with self.captureOnCommitCallbacks(execute=True):
+            images.store_rendered_avatar(self.user.pk, name, rendered, stored)
+        return stored.result()
+
+    def test_variants_are_stored_and_the_raw_upload_released(self, _):
+        from PIL import Image
+
+        self.assertIs(self.store(self.upload, self.rendered()), True)
+        self.user.refresh_from_db()
+        self.assertEqual(sorted(self.user.avatar_variants), ['16.jpeg', '16.webp', '32.jpeg', '32.webp'])
+        self.assertTrue(self.user.profile_picture.name.endswith('.jpg'))
+        with self.storage.open(self.user.profile_picture.name) as f:
+            # The metadata stays behind with the raw upload
+            self.assertEqual(dict(Image.open(f).getexif()), {})
+        self.assertEqual(MediaBlob.objects.get(name=self.upload).refcount, 0)
+
+    def test_reprocessing_releases_the_previous_variants(self, _):
+        self.store(self.upload, self.rendered())
+        self.user.refresh_from_db()
+        first = dict(self.user.avatar_variants)
+        # process_avatars --all, after AVATAR_SIZES changed
+        self.store(self.user.profile_picture.name, self.rendered(self.user.profile_picture.name, (16, 48)))
+        self.user.refresh_from_db()
+        self.assertEqual(sorted(self.user.avatar_variants), ['16.jpeg', '16.webp', '48.jpeg', '48.webp'])
+        refcounts = dict(MediaBlob.objects.values_list('name', 'refcount'))
+        for key, name in first.items():
+            with self.subTest(key):
+                self.assertEqual(refcounts[name], 1 if self.user.avatar_variants.get(key) == name else 0)
+        for name in self.user.avatar_variants.values():
+            self.assertEqual(refcounts[name], 1)
+
+    def test_variants_for_a_replaced_picture_are_discarded(self, _):
+        CustomUser.objects.filter(pk=self.user.pk).update(profile_picture='profile_pics/newer.jpg')
+        self.assertIs(self.store(self.upload, self.rendered()), False)
+        self.assertFalse(MediaBlob.objects.filter(name__contains='avatars/', refcount__gt=0).exists())
+
+    def test_failures_are_logged_and_passed_on(self, _):
+        rendered, stored = Future(), Future()
+        rendered.set_exception(OSError('cannot identify image file'))
+        with self.assertLogs('accounts.images', 'ERROR') as logs:
+            images.store_rendered_avatar(self.user.pk, self.upload, rendered, stored)
+        self.assertIn(f'user {self.user.pk}', logs.output[0])
+        self.assertIsInstance(stored.exception(), OSError)
+        self.assertIn('accounts_avatar_processing_total{result="failed"}', metrics.render([metrics.snapshot()]))
+
+    def test_results_are_stored_on_another_thread(self, _):
+        with mock.patch('accounts.images.get_store_executor') as executor:
+            rendered, stored = Future(), Future()
+            images._store_from_future(self.user.pk, self.upload, stored, rendered)
+        executor.return_value.submit.assert_called_once_with(
+            images.store_rendered_avatar, self.user.pk, self.upload, rendered, stored
+        )
+
+
+class MediaServingTests(SimpleTestCase):
+    """accounts.serving.serve_media: validators, 304s, ranges and offloading."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, MEDIA_OFFLOAD=None)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.name = f'profile_pics/ab/cd/{"ab" * 32}.png'
+        self.content = bytes(range(256)) * 40
+        os.makedirs(os.path.join(self.media_root, 'profile_pics/ab/cd'))
+        with open(os.path.join(self.media_root, self.name), 'wb') as f:
+            f.write(self.content)
+        self.url = f'/media/{self.name}'
+
+    def test_validators_and_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        not_modified = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': '"other"'}).status_code, 200)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        suffix = self.client.get(self.url, headers={'Range': 'bytes=-10'})
+        self.assertEqual(b''.join(suffix.streaming_content), self.content[-10:])
+        self.assertEqual(self.client.get(self.url, headers={'Range': f'bytes={len(self.content)}-'}).status_code, 416)
+        # A stale If-Range gets the whole, current file
+        stale = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(stale.status_code, 200)
+
+    def test_offloading(self):
+        with self.settings(MEDIA_OFFLOAD='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+        with self.settings(MEDIA_OFFLOAD='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, self.name))
+
+    def test_hidden_and_missing_files(self):
+        os.makedirs(os.path.join(self.media_root, '.incoming'))
+        with open(os.path.join(self.media_root, '.incoming', 'upload.png'), 'wb') as f:
+            f.write(b'partial')
+        self.assertEqual(self.client.get('/media/.incoming/upload.png').status_code, 404)
+        self.assertEqual(self.client.get('/media/profile_pics/missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/media/profile_pics').status_code, 404)
+
+
+class FontFaceTests(SimpleTestCase):
+    """base.css only points browsers at font files that are there."""
+
+    def test_base_css_references_existing_files(self):
+        css_dir = os.path.join(settings.STATICFILES_DIRS[0], 'accounts', 'css')
+        with open(os.path.join(css_dir, 'base.css')) as f:
+            urls = re.findall(r"url\('([^']+)'\)", f.read())
+        for url in urls:
+            with self.subTest(url):
+                self.assertTrue(os.path.exists(os.path.normpath(os.path.join(css_dir, url))))
+
+    def test_fetched_weights_get_a_url_source(self):
+        fonts_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, fonts_dir)
+        open(os.path.join(fonts_dir, 'roboto-500.woff2'), 'wb').close()
+        faces = font_faces(fonts_dir)
+        self.assertEqual(faces.count('@font-face'), 4)
+        self.assertEqual(re.findall(r"url\('([^']+)'\)", faces), ['../fonts/roboto-500.woff2'])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ThrottlingTests(TestCase):
+    """Sliding-window limits from accounts.throttling, and the client address they are keyed on."""
+
+    def setUp(self):
+        cache.clear()
+        throttling.get_limiter().local.clear()
+
+    def test_limiter_blocks_over_the_limit(self):
+        limiter = throttling.SlidingWindowLimiter()
+        self.assertEqual([limiter.hit('key', 3, 60) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(limiter.hit('key', 3, 60), 0)
+        self.assertEqual(limiter.hit('other', 3, 60), 0)
+
+    @override_settings(THROTTLE_RATES={'login_ip': '2/m'})
+    def test_login_gets_429_with_retry_after(self):
+        data = {'username': 'nobody', 'password': 'wrong'}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('login'), data).status_code, 200)
+        response = self.client.post(reverse('login'), data)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # Showing the form is not counted
+        self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+
+    def test_client_ip_counts_trusted_proxies_from_the_right(self):
+        factory = RequestFactory()
+        request = factory.get('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7, 10.0.0.1')
+        self.assertEqual(throttling.client_ip(request), '10.0.0.2')
+        with self.settings(THROTTLE_PROXY_HEADER='HTTP_X_FORWARDED_FOR', THROTTLE_TRUSTED_PROXIES=2):
+            self.assertEqual(throttling.client_ip(request), '203.0.113.7')
+        with self.settings(THROTTLE_PROXY_HEADER='HTTP_X_FORWARDED_FOR', THROTTLE_TRUSTED_PROXIES=5):
+            self.assertEqual(throttling.client_ip(request), '6.6.6.6')
+
+    @override_settings(
+        THROTTLE_RATES={'login_ip': '2/m', 'login_identifier': '100/m'},
+        THROTTLE_PROXY_HEADER='HTTP_X_FORWARDED_FOR', THROTTLE_TRUSTED_PROXIES=1,
+    )
+    def test_spoofed_forwarded_for_does_not_reset_the_limit(self):
+        statuses = [
+            self.client.post(
+                reverse('login'), {'username': f'user{n}', 'password': 'wrong'},
+                headers={'X-Forwarded-For': f'198.51.100.{n}, 203.0.113.7'},
+            ).status_code
+            for n in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+class PasswordHashingTests(TestCase):
+    """The pooled PBKDF2 hasher, its load shedding, and the 503 it turns into."""
+
+    def running_job(self):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        return future
+
+    @override_settings(PASSWORD_HASHING_POOL={'WORKERS': 1, 'MAX_PENDING': 4, 'TIMEOUT': 30})
+    def test_hashes_verify_with_the_stock_hasher(self):
+        encoded = PooledPBKDF2PasswordHasher().encode('s3cret pass', 'saltsaltsalt', iterations=1000)
+        self.assertTrue(PBKDF2PasswordHasher().verify('s3cret pass', encoded))
+        self.assertFalse(PBKDF2PasswordHasher().verify('s3cret pas', encoded))
+
+    def test_hashes_beyond_max_pending_are_shed(self):
+        service = HashingService(workers=1, max_pending=2, timeout=30)
+        jobs = [self.running_job(), self.running_job(), Future()]
+        service._executor = mock.Mock(submit=mock.Mock(side_effect=jobs))
+        service._submit('sha256', b'pw', b'salt', 1)
+        service._submit('sha256', b'pw', b'salt', 1)
+        with self.assertRaisesMessage(HashingOverloaded, 'Too many'):
+            service.pbkdf2('pw', 'salt', 1, 'sha256')
+        jobs[0].set_result(b'hash')
+        service._submit('sha256', b'pw', b'salt', 1)
+
+    def test_a_timed_out_job_keeps_its_slot_until_it_finishes(self):
+        service = HashingService(workers=1, max_pending=1, timeout=0.01)
+        job = self.running_job()
+        service._executor = mock.Mock(submit=mock.Mock(side_effect=[job, Future()]))
+        with self.assertRaisesMessage(HashingOverloaded, 'Timed out'):
+            service.pbkdf2('pw', 'salt', 1, 'sha256')
+        # Still running: cancel() could not stop it, so it is still counted
+        with self.assertRaisesMessage(HashingOverloaded, 'Too many'):
+            service.pbkdf2('pw', 'salt', 1, 'sha256')
+        job.set_result(b'hash')
+        with self.assertRaisesMessage(HashingOverloaded, 'Timed out'):
+            service.pbkdf2('pw', 'salt', 1, 'sha256')
+
+    @override_settings(THROTTLE_ENABLED=False, PASSWORD_HASHING_POOL={'WORKERS': 0, 'MAX_PENDING': 4, 'TIMEOUT': 5})
+    def test_an_overloaded_pool_answers_503_with_retry_after(self):
+        CustomUser.objects.create_user('ann', 'ann@example.com', 'correct horse')
+        overloaded = HashingOverloaded('Timed out waiting for the password hashing pool')
+        with mock.patch.object(HashingService, 'pbkdf2', side_effect=overloaded), \
+                mock.patch.object(HashingService, 'apbkdf2', side_effect=overloaded):
+            response = self.client.post(reverse('login'), {'username': 'ann', 'password': 'correct horse'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+
+class UserSearchTests(TestCase):
+    """Autocomplete search matches names only; the admin also matches email."""
+
+    def setUp(self):
+        self.victim = CustomUser.objects.create_user(
+            'alice', 'victim@example.com', 'Password-123', first_name='Alice', last_name='Wonderland',
+        )
+        self.searcher = CustomUser.objects.create_user('mallory', 'mallory@example.com', 'Password-123')
+        self.client.force_login(self.searcher)
+
+    def usernames(self, query):
+        response = self.client.get(reverse('search_users'), {'q': query})
+        return [result['username'] for result in response.json()['results']]
+
+    def assert_email_is_not_searchable(self):
+        self.assertEqual(self.usernames('ali wond'), ['alice'])
+        self.assertEqual(self.usernames('victim@example.com'), [])
+        self.assertEqual(self.usernames('victim'), [])
+
+    def test_fts_search(self):
+        self.assert_email_is_not_searchable()
+
+    def test_search_without_fts(self):
+        with mock.patch('accounts.search.is_supported', return_value=False):
+            self.assert_email_is_not_searchable()
+
+    def test_admin_search_matches_email(self):
+        admin = CustomUser.objects.create_superuser('root', 'root@example.com', 'Password-123')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:accounts_customuser_changelist'), {'q': 'victim'})
+        self.assertEqual([user.username for user in response.context['cl'].result_list], ['alice'])
+
+
+class EmailRenderingTests(SimpleTestCase):
+    """HTML email templates and the plain-text part accounts.emails derives from them."""
+
+    def test_plain_text_drops_head_and_style_but_keeps_links(self):
+        source = plain_text_source(
+            '<html><head><title>Hidden title</title><style>p { color: red; }</style></head>'
+            '<body><p>Hello {{ name }},</p><p><a href="{{ url }}" class="button">Log in</a></p>'
+            '<p><a href="https://example.com/help">https://example.com/help</a></p></body></html>'
+        )
+        self.assertEqual(source, (
+            '{% autoescape off %}Hello {{ name }},\nLog in ({{ url }})\nhttps://example.com/help\n'
+            '{% endautoescape %}'
+        ))
+
+    def test_variables_are_escaped_in_the_html_part_only(self):
+        plain, html = render_email('accounts/email/welcome.html', {
+            'user': {'first_name': 'Tom & <Jerry>', 'username': 'tom'}, 'login_url': 'https://example.com/login/?next=/a&b=1',
+        })
+        self.assertIn('Hello Tom & <Jerry>,', plain)
+        self.assertIn('Log In Now (https://example.com/login/?next=/a&b=1)', plain)
+        self.assertNotIn('color:', plain)
+        self.assertIn('Hello Tom &amp; &lt;Jerry&gt;,', html)
+        self.assertIn('href="https://example.com/login/?next=/a&amp;b=1"', html)
+
+    def test_a_batch_renders_each_recipient_with_their_own_context(self):
+        contexts = [
+            {'user': {'username': f'user{i}'}, 'verification_url': f'https://example.com/verify/{i}/'}
+            for i in range(3)
+        ]
+        rendered = render_email_batch('accounts/email/verification.html', contexts)
+        self.assertEqual(len(rendered), 3)
+        for i, (plain, html) in enumerate(rendered):
+            for part in (plain, html):
+                self.assertIn(f'Hello user{i},', part)
+                self.assertIn(f'https://example.com/verify/{i}/', part)
+                self.assertNotIn(f'user{(i + 1) % 3}', part)
+        self.assertEqual(rendered[0], render_email('accounts/email/verification.html', contexts[0]))
+
+
+class ImportUsersTests(TestCase):
+    """manage.py import_users."""
+
+    def test_rejects_file_never_contains_passwords(self):
+        CustomUser.objects.create_user('taken', 'taken@example.com', 'Password-123')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source, rejects = os.path.join(directory, 'users.jsonl'), os.path.join(directory, 'rejects.jsonl')
+        with open(source, 'w') as f:
+            f.write(json.dumps({'username': 'taken', 'email': 'new@example.com', 'password': 'Secret-plaintext-1'}) + '\n')
+            f.write(json.dumps({'username': 'hashed', 'email': 'bad', 'password_hash': 'md5$salt$secrethash'}) + '\n')
+            f.write(json.dumps({'username': 'fresh', 'email': 'fresh@example.com', 'password': 'Fresh-password-1'}) + '\n')
+
+        call_command('import_users', source, '--rejects', rejects, '--workers', '0', stdout=StringIO())
+
+        self.assertTrue(CustomUser.objects.get(username='fresh').check_password('Fresh-password-1'))
+        with open(rejects) as f:
+            written = f.read()
+        self.assertEqual(len(written.splitlines()), 2)
+        self.assertNotIn('Secret-plaintext-1', written)
+        self.assertNotIn('secrethash', written)
+        by_row = {reject['row']: reject for reject in map(json.loads, written.splitlines())}
+        self.assertEqual(by_row[1]['data']['password'], '********')
+        self.assertEqual(by_row[2]['data']['password_hash'], '********')
+
+    def test_passwords_are_hashed_exactly_as_given(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'users.jsonl')
+        with open(source, 'w') as f:
+            f.write(json.dumps({'username': 'spaced', 'email': 'spaced@example.com', 'password': ' padded secret '}) + '\n')
+            f.write(json.dumps({'username': 'blank', 'email': 'blank@example.com', 'password': '   '}) + '\n')
+            f.write(json.dumps({'username': 'missing', 'email': 'missing@example.com', 'password': ''}) + '\n')
+
+        call_command('import_users', source, '--workers', '0', stdout=StringIO())
+
+        spaced = CustomUser.objects.get(username='spaced')
+        self.assertTrue(spaced.check_password(' padded secret '))
+        self.assertFalse(spaced.check_password('padded secret'))
+        self.assertTrue(CustomUser.objects.get(username='blank').check_password('   '))
+        self.assertFalse(CustomUser.objects.get(username='missing').has_usable_password())
+
+
+class ProfilingTests(TestCase):
+    """Requests are only profiled on demand, and profiling leaves the response alone."""
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        settings_override = self.settings(PROFILING={'DIR': self.profile_dir, 'MAX_FILES': 10, 'INTERVAL': 0.001})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(profiling, '_toggle', profiling.Toggle())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_user('ann', 'ann@example.com', 'Password-123')
+        self.client.force_login(self.user)
+
+    def get_directory(self, **headers):
+        return self.client.get(reverse('user_directory'), headers=headers)
+
+    def test_off_by_default(self):
+        response = self.get_directory()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-File', response)
+        # The header is for staff only
+        self.assertNotIn('X-Profile-File', self.get_directory(**{'X-Profile': 'cprofile'}))
+        self.assertEqual(profiling.profile_files(), [])
+
+    def test_staff_header_profiles_without_changing_the_response(self):
+        self.user.is_staff = True
+        self.user.save()
+        plain = self.get_directory()
+        profiled = self.get_directory(**{'X-Profile': 'cprofile'})
+        self.assertEqual((profiled.status_code, profiled.content), (plain.status_code, plain.content))
+        name = profiled['X-Profile-File']
+        self.assertEqual(profiling.profile_files(), [name])
+        self.assertEqual(profiling.parse_name(name)[2], 'user_directory')
+        stats = pstats.Stats(os.path.join(self.profile_dir, name))
+        self.assertTrue(any(func[2] == 'user_directory' for func in stats.stats))
+
+    def test_toggle_samples_the_chosen_views(self):
+        profiling.write_toggle(['user_directory'], 1.0, 'sample', 60)
+        self.client.get(reverse('search_users'), {'q': 'ann'})
+        self.assertEqual(profiling.profile_files(), [])
+        response = self.get_directory()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-File', response)
+        [name] = profiling.profile_files()
+        self.assertTrue(name.endswith('.folded'))
+        profiling.clear_toggle()
+        profiling._toggle.checked_at = -profiling.TOGGLE_CHECK_INTERVAL
+        self.get_directory()
+        self.assertEqual(profiling.profile_files(), [name])
+
+
+@override_settings(PASSWORD_HASHING_POOL={'WORKERS': 1, 'MAX_PENDING': 4, 'TIMEOUT': 30})
+class WarmupTests(TestCase):
+    """accounts.warmup, as run by `manage.py warmup` and at import of the WSGI/ASGI application."""
+
+    def test_every_step_reports_what_it_warmed(self):
+        counts = {name: count for name, count, _ in warm_up()}
+        self.assertEqual(list(counts), ['urls', 'templates', 'forms', 'databases', 'hashing pool'])
+        self.assertGreaterEqual(counts['urls'], len(import_module('accounts.urls').urlpatterns))
+        self.assertEqual(counts['templates'], len(template_names()))
+        self.assertIn('accounts/email/verification.html', template_names())
+        self.assertEqual(counts['forms'], 5)
+        self.assertEqual(counts['databases'], len(connections.settings))
+        self.assertEqual(counts['hashing pool'], 1)
+
+    @override_settings(PASSWORD_HASHING_POOL={'WORKERS': 0, 'MAX_PENDING': 4, 'TIMEOUT': 5})
+    def test_command_prints_one_line_per_step(self):
+        out = StringIO()
+        call_command('warmup', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split('  ')[0].strip() for line in lines[:-1]], [name for name, _ in STEPS])
+        self.assertRegex(lines[-2], r'^hashing pool\s+0\s')
+        self.assertTrue(lines[-1].startswith('Warm in '))
+
+    def test_applications_warm_up_unless_disabled(self):
+        for module in ('usermgmt.wsgi', 'usermgmt.asgi'):
+            for value, calls in (('1', 1), ('0', 0)):
+                with self.subTest(module, WARMUP=value), mock.patch.dict(os.environ, {'WARMUP': value}), \
+                        mock.patch('accounts.warmup.warm_up') as warm:
+                    sys.modules.pop(module, None)
+                    import_module(module)
+                    self.assertEqual(warm.call_count, calls)
+                sys.modules.pop(module, None)
+
+
+@override_settings(THROTTLE_ENABLED=False, METRICS_DIR=None)
+class MetricsTests(TestCase):
+    """MetricsMiddleware and the /metrics exposition."""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_requests_are_counted_by_view(self):
+        self.client.get(reverse('login'))
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('accounts_http_requests_total{method="GET",status="200",view="login"} 1', body)
+        self.assertIn('accounts_http_request_duration_seconds_count{view="login"} 1', body)
+        self.assertIn('# TYPE accounts_db_queries_per_request histogram', body)
+
+    def test_only_allowed_addresses_and_staff_may_scrape(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 404)
+        staff = CustomUser.objects.create_user('ops', 'ops@example.com', 'Password-123', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 200)
+
+    def test_failed_registration_is_logged_and_counted(self):
+        data = {
+            'username': 'newbie', 'email': 'newbie@example.com', 'first_name': 'New', 'last_name': 'Bie',
+            'user_type': 'community', 'password1': 'Unusual-password-42', 'password2': 'Unusual-password-42',
+        }
+        failing = mock.Mock(side_effect=RuntimeError('relay down'))
+        # Either view may be routed, depending on ASYNC_VIEWS
+        with mock.patch('accounts.views.create_unverified_user', failing), \
+                mock.patch('accounts.async_views.create_unverified_user', failing), \
+                self.assertLogs('accounts', 'ERROR') as logs:
+            response = self.client.post(reverse('register'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('relay down', logs.output[0])
+        self.assertIn('accounts_registration_errors_total{error="RuntimeError"} 1', metrics.render([metrics.snapshot()]))
+
+    def test_exited_threads_leave_their_counts_but_not_their_shards(self):
+        def record():
+            metrics.inc('accounts_registration_errors_total', error='ThreadTest')
+
+        shards = len(metrics._shards)
+        for _ in range(20):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        gc.collect()
+        self.assertLessEqual(len(metrics._shards), shards)
+        self.assertIn(
+            'accounts_registration_errors_total{error="ThreadTest"} 20', metrics.render([metrics.snapshot()])
+        )
+
+
+def reload_urlconf():
+    """accounts.urls picks the sync or async views at import, from ASYNC_VIEWS."""
+    importlib.reload(import_module('accounts.urls'))
+    importlib.reload(import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@override_settings(THROTTLE_ENABLED=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncViewTests(TestCase):
+    """The accounts.async_views flow through the ASGI handler, with ASYNC_VIEWS=1."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.async_views = override_settings(ASYNC_VIEWS=True)
+        cls.async_views.enable()
+        reload_urlconf()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.async_views.disable()
+        reload_urlconf()
+        super().tearDownClass()
+
+    async def test_register_login_profile_logout(self):
+        self.assertIs(resolve(reverse('login')).func, async_views.login)
+        await CustomUser.objects.acreate(username='other', email='other@example.com')
+        client = AsyncClient()
+
+        response = await client.post(reverse('register'), {
+            'username': 'newbie', 'email': 'newbie@example.com', 'first_name': 'New', 'last_name': 'Bie',
+            'user_type': 'community', 'password1': 'Unusual-password-42', 'password2': 'Unusual-password-42',
+        })
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        await CustomUser.objects.filter(username='newbie').aupdate(email_verified=True)
+
+        response = await client.post(reverse('login'), {'username': 'newbie', 'password': 'Unusual-password-42'})
+        self.assertRedirects(response, reverse('profile', args=['newbie']), fetch_redirect_response=False)
+        response = await client.get(reverse('profile', args=['newbie']))
+        self.assertContains(response, 'newbie')
+        self.assertTrue(response.context['is_self'])
+        response = await client.get(reverse('profile', args=['OTHER']))
+        self.assertRedirects(response, reverse('profile', args=['other']), fetch_redirect_response=False)
+        self.assertEqual((await client.get(reverse('profile', args=['other']))).status_code, 200)
+
+        self.assertEqual((await client.post(reverse('logout'))).status_code, 302)
+        response = await client.get(reverse('profile_edit'))
+        self.assertRedirects(response, f'{reverse("login")}?next={reverse("profile_edit")}', fetch_redirect_response=False)
+
+
+@override_settings(PROFILE_CACHE_ENABLED=True)
+class ProfileCardCacheTests(TestCase):
+    """Cached profile cards are found by the exact username, and dropped when the user changes."""
+
+    def setUp(self):
+        cache.clear()
+        viewer = CustomUser.objects.create_user('viewer', 'viewer@example.com', 'Password-123')
+        CustomUser.objects.create_user('Bob', 'bob1@example.com', 'Password-123', bio='Upper-case Bob')
+        CustomUser.objects.create_user('bob', 'bob2@example.com', 'Password-123', bio='Lower-case bob')
+        self.client.force_login(viewer)
+
+    def test_usernames_differing_in_case_keep_their_own_cards(self):
+        for _ in range(2):  # rendered, then served from the cache
+            self.assertContains(self.client.get(reverse('profile', args=['Bob'])), 'Upper-case Bob')
+            self.assertContains(self.client.get(reverse('profile', args=['bob'])), 'Lower-case bob')
+        with self.assertNumQueries(1):  # the viewer, for request.user
+            self.assertContains(self.client.get(reverse('profile', args=['Bob'])), 'Upper-case Bob')
+
+    def test_other_spellings_redirect(self):
+        self.client.get(reverse('profile', args=['Bob']))
+        self.assertRedirects(
+            self.client.get(reverse('profile', args=['BOB'])), reverse('profile', args=['Bob']),
+            fetch_redirect_response=False,
+        )
+
+    def test_deactivating_a_user_drops_their_card(self):
+        self.client.get(reverse('profile', args=['Bob']))
+        self.assertIsNotNone(profile_cache.get_cached_card('Bob'))
+        bob = CustomUser.objects.get(username='Bob')
+        bob.is_active = False
+        bob.save()
+        self.assertIsNone(profile_cache.get_cached_card('Bob'))
+        with self.assertNumQueries(2):  # the viewer, then Bob from the database
+            self.client.get(reverse('profile', args=['Bob']))
+
+    @override_settings(PROFILE_CACHE_ENABLED=None)
+    def test_a_per_process_cache_is_not_used(self):
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                self.assertContains(self.client.get(reverse('profile', args=['Bob'])), 'Upper-case Bob')
+        self.assertIsNone(cache.get(profile_cache.INDEX_KEY.format('Bob')))
+
+
+@override_settings(THROTTLE_ENABLED=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserLookupTests(TestCase):
+    """Login identifiers and profile URLs resolve to the right account."""
+
+    def setUp(self):
+        self.backend = EmailOrUsernameModelBackend()
+
+    def test_backend_accepts_username_or_email(self):
+        user = CustomUser.objects.create_user('grace', 'Grace@Example.com', 'Password-123')
+        self.assertEqual(self.backend.authenticate(None, username='grace', password='Password-123'), user)
+        self.assertEqual(self.backend.authenticate(None, username='grace@example.COM', password='Password-123'), user)
+        self.assertIsNone(self.backend.authenticate(None, username='Grace', password='Password-123'))
+        self.assertIsNone(self.backend.authenticate(None, username='grace', password='wrong'))
+
+    def test_backend_prefers_email_for_identifiers_with_at(self):
+        by_email = CustomUser.objects.create_user('heidi', 'ivan@example.com', 'Email-owner-1')
+        by_username = CustomUser.objects.create_user('ivan@example.com', 'other@example.com', 'Username-owner-1')
+        self.assertEqual(self.backend.authenticate(None, username='ivan@example.com', password='Email-owner-1'), by_email)
+        self.assertIsNone(self.backend.authenticate(None, username='ivan@example.com', password='Username-owner-1'))
+        self.assertEqual(by_username.username, 'ivan@example.com')
+
+    def test_profile_lookup_prefers_the_exact_username(self):
+        viewer = CustomUser.objects.create_user('viewer', 'viewer@example.com', 'Password-123')
+        for number, name in enumerate(('Judy', 'JUDY', 'jUdY', 'judy')):
+            CustomUser.objects.create_user(name, f'judy{number}@example.com', 'Password-123')
+        self.client.force_login(viewer)
+        for name in ('Judy', 'JUDY', 'jUdY', 'judy'):
+            with self.subTest(name):
+                response = self.client.get(reverse('profile', args=[name]))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['profile_user'].username, name)
+        # No exact match: redirect to a case-insensitive one
+        response = self.client.get(reverse('profile', args=['jUDy']))
+        self.assertEqual(response.status_code, 302)
+        self.assertRaises(Http404, lookup_profile_user, 'nobody')
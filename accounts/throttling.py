@@ -0,0 +1,219 @@
+"""
+Request throttling for the endpoints that are expensive to abuse.
+
+Limits are sliding windows, approximated from two fixed-window counters in
+the cache: the previous window's count weighted by how much of it still
+overlaps the sliding window, plus the current count. Counters live in the
+cache (shared across processes with Redis). Once a key goes over its limit,
+the process also remembers locally until when it is blocked, so repeated
+rejections cost neither a cache round-trip nor a database query.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+DEFAULT_RATES = {
+    'login_ip': '30/m',
+    'login_identifier': '10/m',
+    'register_ip': '10/h',
+    'password_reset_ip': '10/h',
+    'password_reset_identifier': '3/h',
+}
+
+
+class Throttled(Exception):
+    """Raised by `throttle` when a request is over its limit."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f'Rate limit exceeded for {scope}')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60)"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period.strip()[0].lower()]
+
+
+class LocalBlocklist:
+    """Bounded per-process map of key -> blocked-until timestamp."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def blocked_for(self, key, now):
+        with self._lock:
+            until = self._entries.get(key)
+            if until is None:
+                return 0
+            if until <= now:
+                del self._entries[key]
+                return 0
+            return until - now
+
+    def block(self, key, until):
+        with self._lock:
+            self._entries[key] = until
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SlidingWindowLimiter:
+    key_prefix = 'throttle:'
+
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+        self.local = LocalBlocklist()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def hit(self, key, limit, period):
+        """
+        Count one request for `key`. Returns 0 if it is allowed, otherwise the
+        number of seconds until it would be; rejected requests are not counted.
+        """
+        now = time.time()
+        blocked = self.local.blocked_for(key, now)
+        if blocked:
+            return blocked
+
+        window = int(now // period)
+        elapsed = now - window * period
+        current_key = f'{self.key_prefix}{key}:{window}'
+        previous_key = f'{self.key_prefix}{key}:{window - 1}'
+        counts = self.cache.get_many([previous_key, current_key])
+        previous, current = counts.get(previous_key, 0), counts.get(current_key, 0)
+
+        if previous * (period - elapsed) / period + current >= limit:
+            retry_after = self.retry_after(previous, current, limit, period, elapsed)
+            self.local.block(key, now + retry_after)
+            return retry_after
+
+        # Two windows' worth of lifetime: the count is still read as "previous"
+        if not self.cache.add(current_key, 1, timeout=2 * period):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # Expired between add() and incr()
+                self.cache.add(current_key, 1, timeout=2 * period)
+        return 0
+
+    @staticmethod
+    def retry_after(previous, current, limit, period, elapsed):
+        """Seconds until the weighted count drops below `limit` with no further hits."""
+        remaining = period - elapsed
+        if current >= limit:
+            # Wait out this window, then for `current` to decay as the previous one
+            return remaining + period * (1 - limit / current)
+        # Only the previous window's share has to decay
+        return max(remaining - (limit - current) * period / previous, 1)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = SlidingWindowLimiter(getattr(settings, 'THROTTLE_CACHE', 'default'))
+        return _limiter
+
+
+@receiver(setting_changed)
+def reset_limiter(*, setting, **kwargs):
+    global _limiter
+    if setting.startswith('THROTTLE_'):
+        with _limiter_lock:
+            _limiter = None
+
+
+def get_rate(scope):
+    rates = {**DEFAULT_RATES, **getattr(settings, 'THROTTLE_RATES', {})}
+    rate = rates.get(scope)
+    return parse_rate(rate) if rate else None
+
+
+def client_ip(request):
+    """
+    The client address. Behind reverse proxies set THROTTLE_PROXY_HEADER
+    (e.g. 'HTTP_X_FORWARDED_FOR') and THROTTLE_TRUSTED_PROXIES to the number
+    of proxies that append to it. Each proxy appends the address it was
+    connected from, so the client is that many entries from the right;
+    anything further left was written by the client and could be made up.
+    """
+    header = getattr(settings, 'THROTTLE_PROXY_HEADER', None)
+    if header and request.META.get(header):
+        addresses = [address.strip() for address in request.META[header].split(',')]
+        trusted = max(getattr(settings, 'THROTTLE_TRUSTED_PROXIES', 1), 1)
+        return addresses[max(len(addresses) - trusted, 0)]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def posted_field(field):
+    """Key function for a submitted form field such as a username or email, compared case-insensitively."""
+    def key(request):
+        value = request.POST.get(field, '').strip().lower()
+        # Hashed so raw emails never end up in cache keys
+        return hashlib.sha256(value.encode()).hexdigest()[:32] if value else None
+    return key
+
+
+def check(scope, key):
+    """Count a request for `key` in `scope`, raising `Throttled` if it is over the limit."""
+    rate = get_rate(scope)
+    if not key or rate is None or not getattr(settings, 'THROTTLE_ENABLED', True):
+        return
+    retry_after = get_limiter().hit(f'{scope}:{key}', *rate)
+    if retry_after:
+        raise Throttled(scope, retry_after)
+
+
+def throttle(scope, key=client_ip, methods=('POST',)):
+    """
+    Limit a view to THROTTLE_RATES[scope] requests per `key(request)`.
+
+    Runs before the view, so a rejected request never reaches form
+    validation, a database lookup or a password hash. Only `methods` are
+    counted; rendering the form is free. Stack the decorator to apply
+    several limits.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def awrapped(request, *args, **kwargs):
+                if request.method in methods:
+                    # The limiter's cache may be on the network (Redis)
+                    await sync_to_async(check, thread_sensitive=False)(scope, key(request))
+                return await view(request, *args, **kwargs)
+            return awrapped
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method in methods:
+                check(scope, key(request))
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
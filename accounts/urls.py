@@ -1,16 +1,23 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import async_views, views
+
+# Native async versions of the busiest views, on by default under ASGI
+if settings.ASYNC_VIEWS:
+    endpoints, login_view = async_views, async_views.login
+else:
+    endpoints, login_view = views, views.CustomLoginView.as_view()
 
 urlpatterns = [
-    path('register/', views.register, name='register'),
-    path('verify-email/<uidb64>/<token>/', views.verify_email, name='verify-email'),
+    path('register/', endpoints.register, name='register'),
+    path('verify-email/<uidb64>/<token>/', endpoints.verify_email, name='verify-email'),
     path('verification-failed/', views.verification_failed, name='verification_failed'),
     path('test-email/', views.test_email, name='test_email'),  # Test email endpoint
     
     # Login/Logout
-    path('login/', views.CustomLoginView.as_view(), name='login'),
-    path('logout/', views.custom_logout, name='logout'),
+    path('login/', login_view, name='login'),
+    path('logout/', endpoints.custom_logout, name='logout'),
     
     # Password Reset
     path('password-reset/', 
@@ -27,6 +34,10 @@ urlpatterns = [
          name='password_reset_complete'),
     
     # Profile
-    path('profile/', views.profile_edit, name='profile_edit'),
-    path('profile/<str:username>/', views.profile, name='profile'),
+    path('profile/', endpoints.profile_edit, name='profile_edit'),
+    path('profile/<str:username>/', endpoints.profile, name='profile'),
+
+    # Search
+    path('search/', views.search_users, name='search_users'),
+    path('directory/', views.user_directory, name='user_directory'),
 ]
@@ -0,0 +1,124 @@
+"""
+Cached loading of the logged-in user for `AuthenticationMiddleware`.
+
+`EmailOrUsernameModelBackend.get_user()` serves rows from here instead of
+querying the database on every request.
+
+- The shared cache holds a version token per user (`USER_VERSION_KEY`) and
+  the row pickled under that version (`USER_ROW_KEY`).
+- Each process also keeps the newest `USER_CACHE_LOCAL_SIZE` rows in an LRU,
+  checked against the shared version on every lookup. A hit there costs one
+  small cache read and no unpickling of the row from the shared cache.
+- Saving or deleting a user, and changing their groups or permissions,
+  replaces the version, so every process reloads the row on its next
+  request. A password reset therefore changes the session auth hash
+  immediately and other sessions are logged out on their next request.
+
+A loader reads the version before it queries the database, so a row read
+just before an invalidation is filed under the old version and never served.
+
+Invalidations only reach workers that share the cache. With the default
+per-process LocMem cache the user cache is therefore off and every request
+loads its user from the database, unless USER_CACHE_ENABLED says otherwise.
+"""
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from . import metrics
+from .caching import is_shared
+
+USER_VERSION_KEY = 'auth:user:{}'
+USER_ROW_KEY = 'auth:user:{}:{}'
+
+
+def enabled():
+    """USER_CACHE_ENABLED, or by default whether every worker shares the default cache."""
+    setting = getattr(settings, 'USER_CACHE_ENABLED', None)
+    return is_shared() if setting is None else setting
+
+
+def _timeout():
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+
+
+class LocalUsers:
+    """A small thread-safe LRU of `pk -> (version, pickled row)`."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pk, version):
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(pk)
+            return entry[1]
+
+    def put(self, pk, version, row):
+        size = getattr(settings, 'USER_CACHE_LOCAL_SIZE', 1000)
+        with self._lock:
+            self._entries[pk] = (version, row)
+            self._entries.move_to_end(pk)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def discard(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = LocalUsers()
+
+
+def _current_version(pk):
+    key = USER_VERSION_KEY.format(pk)
+    version = cache.get(key)
+    if version is None:
+        # First lookup since the last eviction: whoever adds first wins
+        cache.add(key, uuid.uuid4().hex, _timeout())
+        version = cache.get(key)
+    return version
+
+
+def get_user(model, pk):
+    """
+    The user with primary key `pk`, a fresh instance per call (callers may
+    modify it), or `model.DoesNotExist`.
+    """
+    pk = model._meta.pk.to_python(pk)
+    version = _current_version(pk)
+    row = _local.get(pk, version)
+    if row is not None:
+        metrics.inc('accounts_cache_requests_total', cache='user', result='hit')
+        return pickle.loads(row)
+
+    user = cache.get(USER_ROW_KEY.format(pk, version))
+    metrics.inc('accounts_cache_requests_total', cache='user', result='miss' if user is None else 'hit')
+    if user is None:
+        # From the primary: a row read from a lagging replica would stay
+        # cached under the new version after the write that invalidated it
+        user = model._default_manager.db_manager(DEFAULT_DB_ALIAS).get(pk=pk)
+        cache.set(USER_ROW_KEY.format(pk, version), user, _timeout())
+    if version is not None:
+        _local.put(pk, version, pickle.dumps(user, pickle.HIGHEST_PROTOCOL))
+    return user
+
+
+def invalidate_users(pks):
+    """Make every process reload these users from the database on their next lookup."""
+    pks = list(pks)
+    for pk in pks:
+        _local.discard(pk)
+    cache.set_many({USER_VERSION_KEY.format(pk): uuid.uuid4().hex for pk in pks}, _timeout())
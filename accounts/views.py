@@ -1,4 +1,7 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import logging
+
+from django.shortcuts import render, redirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.contrib import messages
 from django.contrib.auth import login, logout, get_user_model
 from django.contrib.auth.views import LoginView, PasswordResetView, PasswordResetConfirmView
@@ -7,78 +10,101 @@ from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 from django.contrib.auth.tokens import default_token_generator
 from django.views.decorators.http import require_POST
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from . import metrics, search
 from .forms import (
     UserRegisterForm, CustomAuthenticationForm, CustomPasswordResetForm,
     CustomSetPasswordForm, UserProfileUpdateForm
 )
-from .models import CustomUser
+from .models import USER_TYPE_CHOICES, CustomUser
+from .db import retry_on_busy
+from .emails import render_email
+from .images import schedule_avatar_processing
+from .outbox import enqueue_email
+from .pagination import InvalidCursor, keyset_page
+from .profile_cache import get_cached_card, render_card
+from .routers import replica_aliases
+from .throttling import posted_field, throttle
+from .uploads import image_uploads
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+def create_unverified_user(user, current_site):
+    """Save a new registration and queue its verification email in one transaction."""
+    with transaction.atomic():
+        user.is_active = True
+        user.email_verified = False
+        user.save()
+
+        # Generate verification token
+        uid = user.get_uid()
+        token = user.get_verification_token()
+
+        # Build verification URL
+        verification_url = f"http://{current_site}/accounts/verify-email/{uid}/{token}/"
+
+        # Prepare email
+        context = {
+            'user': user,
+            'verification_url': verification_url,
+        }
+        plain_message, html_message = render_email('accounts/email/verification.html', context)
+
+        # Queue the verification email; the outbox worker delivers it
+        enqueue_email('Verify your email address', plain_message, [user.email], html_message)
+    return user
+
 
+@throttle('register_ip')
 def register(request):
     if request.method == 'POST':
         form = UserRegisterForm(request.POST)
         if form.is_valid():
             try:
-                user = form.save(commit=False)
-                user.is_active = True
-                user.email_verified = False
-                user.save()
-
-                # Generate verification token
-                uid = user.get_uid()
-                token = user.get_verification_token()
-                
-                # Build verification URL
-                current_site = request.get_host()
-                verification_url = f"http://{current_site}/accounts/verify-email/{uid}/{token}/"
-                
-                # Prepare email
-                context = {
-                    'user': user,
-                    'verification_url': verification_url,
-                }
-                html_message = render_to_string('accounts/email/verification.html', context)
-                plain_message = strip_tags(html_message)
-                
-                try:
-                    # Send verification email
-                    email = EmailMultiAlternatives(
-                        'Verify your email address',
-                        plain_message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [user.email],
-                    )
-                    email.attach_alternative(html_message, "text/html")
-                    email.send(fail_silently=False)
-                    print(f"Verification email sent successfully to {user.email}")
-                    
-                    messages.success(request, 'Account created successfully! Please check your email to verify your account.')
-                    return redirect('login')
-                except Exception as e:
-                    print(f"Failed to send verification email: {str(e)}")
-                    messages.error(request, 'Failed to send verification email. Please try again or contact support.')
-                    user.delete()  # Delete the user if email sending fails
-                    return redirect('register')
-                    
+                create_unverified_user(form.save(commit=False), request.get_host())
+                messages.success(request, 'Account created successfully! Please check your email to verify your account.')
+                return redirect('login')
+
             except Exception as e:
-                print(f"Error during registration: {str(e)}")
+                logger.exception('Error during registration')
+                metrics.inc('accounts_registration_errors_total', error=type(e).__name__)
                 messages.error(request, 'An error occurred during registration. Please try again.')
     else:
         form = UserRegisterForm()
     return render(request, 'accounts/register.html', {'form': form})
 
 
+def get_user_fresh(pk):
+    """Look the user up on a replica, falling back to the primary for accounts too new to have replicated."""
+    try:
+        return User.objects.get(pk=pk)
+    except User.DoesNotExist:
+        if not replica_aliases():
+            raise
+        return User.objects.using(DEFAULT_DB_ALIAS).get(pk=pk)
+
+
+@retry_on_busy
+def mark_email_verified(user, plain_message, html_message):
+    """Mark the email as verified and queue the welcome email in one transaction."""
+    with transaction.atomic():
+        user.email_verified = True
+        user.save(update_fields=['email_verified', 'last_updated'])
+        enqueue_email('Welcome to our platform!', plain_message, [user.email], html_message)
+
+
 def verify_email(request, uidb64, token):
     try:
         # Decode the UID from base64
         uid = force_str(urlsafe_base64_decode(uidb64))
-        user = User.objects.get(pk=uid)
+        user = get_user_fresh(uid)
     except (TypeError, ValueError, OverflowError, User.DoesNotExist):
         user = None
     
@@ -87,27 +113,14 @@ def verify_email(request, uidb64, token):
         if user.email_verified:
             messages.info(request, 'Your email has already been verified.')
         else:
-            # Mark email as verified
-            user.email_verified = True
-            user.save()
-            
-            # Send welcome email
             context = {
                 'user': user,
                 'login_url': request.build_absolute_uri(reverse_lazy('login'))
             }
-            html_message = render_to_string('accounts/email/welcome.html', context)
-            plain_message = strip_tags(html_message)
-            
-            email = EmailMultiAlternatives(
-                'Welcome to our platform!',
-                plain_message,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-            )
-            email.attach_alternative(html_message, "text/html")
-            email.send()
-            
+            plain_message, html_message = render_email('accounts/email/welcome.html', context)
+
+            mark_email_verified(user, plain_message, html_message)
+
             messages.success(request, 'Email verified successfully! You can now log in.')
         
         return redirect('login')
@@ -120,6 +133,9 @@ def verification_failed(request):
     return render(request, 'accounts/verification_failed.html')
 
 
+# Throttled before the form runs, so rejected attempts never hash a password
+@method_decorator(throttle('login_ip'), name='dispatch')
+@method_decorator(throttle('login_identifier', key=posted_field('username')), name='dispatch')
 class CustomLoginView(LoginView):
     form_class = CustomAuthenticationForm
     template_name = 'accounts/login.html'
@@ -151,6 +167,8 @@ class CustomLoginView(LoginView):
             raise
 
 
+@method_decorator(throttle('password_reset_ip'), name='dispatch')
+@method_decorator(throttle('password_reset_identifier', key=posted_field('email')), name='dispatch')
 class CustomPasswordResetView(PasswordResetView):
     form_class = CustomPasswordResetForm
     template_name = 'accounts/password_reset.html'
@@ -182,7 +200,8 @@ class CustomPasswordResetView(PasswordResetView):
             },
         }
         form.save(**opts)
-        return super().form_valid(form)
+        # PasswordResetView.form_valid would call form.save() a second time
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class CustomPasswordResetConfirmView(PasswordResetConfirmView):
@@ -191,19 +210,53 @@ class CustomPasswordResetConfirmView(PasswordResetConfirmView):
     success_url = reverse_lazy('password_reset_complete')
 
 
+def lookup_profile_user(username):
+    """
+    The user `/profile/<username>/` shows. Usernames are unique only when
+    case matches, so the exact username is looked up first; only if there is
+    none does a case-insensitive match (via the Lower(username) index) stand
+    in. Raises Http404.
+    """
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        user = User.objects.filter_by_username_ci(username).order_by('pk').first()
+    if user is None:
+        raise Http404("No user found with this username.")
+    return user
+
+
 @login_required
+@image_uploads
 def profile(request, username=None):
-    if username:
-        user = get_object_or_404(User, username=username)
+    if username and request.method == 'GET' and username.lower() != request.user.username.lower():
+        # Someone else's profile: serve the card from cache without touching the DB
+        card = get_cached_card(username)
+        if card is not None:
+            context = {
+                'profile_card': mark_safe(card),
+                'is_self': False,
+                'form': None,
+            }
+            return render(request, 'accounts/profile.html', context)
+
+    if username and username == request.user.username:
+        # Your own profile: request.user is already loaded
+        user = request.user
+        is_self = True
+    elif username:
+        user = lookup_profile_user(username)
+        if user.username != username:
+            return redirect('profile', username=user.username)
         is_self = request.user == user
     else:
         user = request.user
         is_self = True
     
     if request.method == 'POST' and is_self:
-        form = UserProfileUpdateForm(request.POST, request.FILES, instance=user)
-        if form.is_valid():
-            form.save()
+        form = UserProfileUpdateForm(
+            request.POST, request.FILES, instance=user, upload_errors=getattr(request, 'upload_errors', None),
+        )
+        if update_profile(form, user):
             messages.success(request, 'Your profile has been updated.')
             return redirect('profile', username=user.username)
     elif is_self:
@@ -216,14 +269,102 @@ def profile(request, username=None):
         'is_self': is_self,
         'form': form,
     }
+    if not is_self:
+        context['profile_card'] = mark_safe(render_card(user))
     return render(request, 'accounts/profile.html', context)
 
 
+def update_profile(form, user):
+    """Validate and save a profile form, queueing avatar processing for a new picture."""
+    if not form.is_valid():
+        return False
+    form.save()
+    if 'profile_picture' in form.changed_data and user.profile_picture:
+        schedule_avatar_processing(user)
+    return True
+
+
 @login_required
+@image_uploads
 def profile_edit(request):
     return profile(request)
 
 
+@login_required
+def search_users(request):
+    """JSON user search for autocomplete: `?q=<terms>&limit=<n>`, best match first."""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    users = search.search_users(User, query, limit) if query else []
+    results = [
+        {
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'url': reverse('profile', args=[user.username]),
+        }
+        for user in users
+    ]
+    return JsonResponse({'query': query, 'results': results})
+
+
+# Each filter has an index leading with it, followed by the keyset columns
+BOOLEAN_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+DIRECTORY_FILTERS = {
+    'user_type': dict(USER_TYPE_CHOICES),
+    'email_verified': BOOLEAN_VALUES,
+    'is_active': BOOLEAN_VALUES,
+}
+
+
+@login_required
+def user_directory(request):
+    """
+    JSON user directory, newest members first:
+    `?user_type=&email_verified=&is_active=&limit=<n>&cursor=<next from the previous page>`.
+    Only staff see inactive and unverified accounts.
+    """
+    filters = {}
+    for name, allowed in DIRECTORY_FILTERS.items():
+        value = request.GET.get(name)
+        if value is None:
+            continue
+        if value.lower() not in allowed:
+            return JsonResponse({'error': f'Invalid {name}: choose from {", ".join(allowed)}'}, status=400)
+        filters[name] = value.lower() if name == 'user_type' else allowed[value.lower()]
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 100)
+    except ValueError:
+        limit = 50
+
+    users = User.objects.visible_to(request.user).filter(**filters).only('username', 'first_name', 'last_name', 'user_type', 'date_joined')
+    try:
+        users, cursor = keyset_page(users, 'date_joined', request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    next_url = None
+    if cursor:
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        next_url = f'{request.path}?{params.urlencode()}'
+    results = [
+        {
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'user_type': user.user_type,
+            'date_joined': user.date_joined.isoformat(),
+            'url': reverse('profile', args=[user.username]),
+        }
+        for user in users
+    ]
+    return JsonResponse({'results': results, 'next': next_url})
+
+
 def test_email(request):
     try:
         # Send a test email
@@ -246,12 +387,15 @@ def test_email(request):
 
 def custom_logout(request):
     """Custom logout view to handle any pre-logout actions"""
-    # Clear any custom session data if needed
-    for key in list(request.session.keys()):
-        if not key.startswith('_'):  # Don't remove Django's session keys
-            del request.session[key]
-    
-    # Perform the logout
+    # logout() flushes the whole session (row and cache entry) in one go
     logout(request)
     messages.success(request, 'You have been successfully logged out.')
     return redirect('login')
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, limited to METRICS_ALLOWED_IPS and staff users."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if request.META.get('REMOTE_ADDR') not in allowed and not request.user.is_staff:
+        raise Http404()
+    return HttpResponse(metrics.render(metrics.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,103 @@
+"""
+Work a fresh worker would otherwise do while serving its first requests.
+
+`usermgmt.wsgi` and `usermgmt.asgi` call `warm_up()` before returning the
+application (set `WARMUP=0` to skip it). `manage.py warmup` runs the same steps and reports
+how long each took.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.urls import URLResolver, get_resolver
+
+
+def compile_url_patterns(resolver=None):
+    """Populate the reverse lookup tables and compile every route's regex."""
+    resolver = resolver or get_resolver()
+    resolver.reverse_dict  # populates the resolver (and its namespaces)
+    count = 0
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex  # compiled lazily on first access
+        if isinstance(pattern, URLResolver):
+            count += compile_url_patterns(pattern)
+        else:
+            count += 1
+    return count
+
+
+def template_names(prefix='accounts'):
+    """Every template under `<template dir>/<prefix>/`."""
+    names = set()
+    for engine in settings.TEMPLATES:
+        for directory in engine.get('DIRS', []):
+            root = os.path.join(directory, prefix)
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    names.add(os.path.relpath(os.path.join(dirpath, filename), directory).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def compile_templates(prefix='accounts'):
+    """Load the templates through the cached loader so requests get them pre-parsed."""
+    names = template_names(prefix)
+    for engine in engines.all():
+        # Context processors are imported on first render
+        engine.engine.template_context_processors
+        for name in names:
+            engine.get_template(name)
+    return len(names)
+
+
+def render_forms():
+    """Render each form once, which loads the widget templates of the form renderer."""
+    from . import forms
+
+    rendered = [
+        forms.UserRegisterForm(), forms.CustomAuthenticationForm(), forms.CustomPasswordResetForm(),
+        forms.CustomSetPasswordForm(user=None), forms.UserProfileUpdateForm(),
+    ]
+    for form in rendered:
+        str(form)
+    return len(rendered)
+
+
+def open_connections():
+    """Connect to every database (persistent with CONN_MAX_AGE, for this thread)."""
+    for alias in connections:
+        connections[alias].ensure_connection()
+    return len(connections.settings)
+
+
+def start_hashing_pool():
+    """Spawn the password hashing processes now rather than on the first login."""
+    from .hashing import get_hashing_service
+
+    service = get_hashing_service()
+    if not service.workers:
+        return 0
+    futures = [service.executor.submit(int) for _ in range(service.workers)]
+    for future in futures:
+        future.result()
+    return service.workers
+
+
+STEPS = (
+    ('urls', compile_url_patterns),
+    ('templates', compile_templates),
+    ('forms', render_forms),
+    ('databases', open_connections),
+    ('hashing pool', start_hashing_pool),
+)
+
+
+def warm_up():
+    """Run every step; returns `[(step, count, seconds)]`."""
+    timings = []
+    for name, step in STEPS:
+        started = time.perf_counter()
+        count = step()
+        timings.append((name, count, time.perf_counter() - started))
+    return timings
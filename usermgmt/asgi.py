@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'usermgmt.settings')
+# accounts.async_views instead of the sync views; set ASYNC_VIEWS=0 to compare
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Resolve URLs, compile templates and connect before taking traffic
+if os.environ.get('WARMUP', '1') != '0':
+    from accounts.warmup import warm_up
+
+    warm_up()
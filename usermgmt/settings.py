@@ -12,20 +12,20 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from dotenv import load_dotenv
-import certifi
-os.environ['SSL_CERT_FILE'] = certifi.where()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Load environment variables from .env file
-env_path = os.path.join(BASE_DIR, '.env')
-load_dotenv(dotenv_path=env_path)
-
-# For development, if .env doesn't exist, try .env.example
-if not os.path.exists(env_path):
-    load_dotenv(dotenv_path=os.path.join(BASE_DIR, '.env.example'))
+# Load environment variables from .env file. For development, if .env doesn't
+# exist, try .env.example. python-dotenv is only imported when there is a
+# file to read, so deployments that pass the environment directly skip it.
+# (certifi's CA bundle is applied by accounts.email_backends when it connects.)
+for env_name in ('.env', '.env.example'):
+    env_path = os.path.join(BASE_DIR, env_name)
+    if os.path.exists(env_path):
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=env_path)
+        break
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -59,13 +59,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'accounts.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'accounts.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'accounts.middleware.HashingOverloadMiddleware',
+    'accounts.middleware.ThrottleMiddleware',
 ]
 
 ROOT_URLCONF = 'usermgmt.urls'
@@ -88,16 +93,108 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'usermgmt.wsgi.application'
 
+# Route register, verify_email, login/logout and profile to accounts.async_views.
+# usermgmt/asgi.py turns this on; under WSGI the sync views are faster.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite is tuned for concurrent web traffic: WAL lets readers run alongside
+# the single writer, synchronous=NORMAL is durable under WAL except on power
+# loss, and busy_timeout makes a writer wait for the lock instead of failing
+# with "database is locked". The pragmas run on every new connection.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'cache_size': -20000,  # negative = KiB, i.e. ~20 MB page cache per connection
+    'mmap_size': 268435456,  # 256 MB of the file memory-mapped for reads
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections (and their warm page cache) across requests
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # Take the write lock at BEGIN so busy_timeout applies; a DEFERRED
+            # transaction that upgrades to a writer fails immediately instead.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,
+        },
+    }
+}
+
+# Read replicas: DB_REPLICAS is a comma-separated list of database names
+# (SQLite files here), kept in sync with the primary by external replication
+# (e.g. Litestream/LiteFS). Reads are spread across them; writes, and reads by
+# a client for REPLICA_PIN_SECONDS after its own write, go to the primary.
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': name.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['accounts.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
+# Bounded retry for writes that still hit SQLITE_BUSY (accounts.db.retry_on_busy)
+DATABASE_BUSY_RETRIES = 3
+DATABASE_BUSY_BACKOFF = 0.05  # seconds, doubled on each retry
+
+
+# Cache
+# Per-process memory by default; point REDIS_URL at a shared Redis so cached
+# profile cards and other cached data are shared across worker processes.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'usermgmt',
+        }
     }
+
+# Profile cards are served from the cache (accounts.profile_cache). As with
+# USER_CACHE_ENABLED, None turns it on only with a cache shared by all workers.
+PROFILE_CACHE_ENABLED = None
+PROFILE_CACHE_TIMEOUT = 300  # seconds a rendered profile card stays cached
+# Logged-in users are loaded from the cache (accounts.user_cache). None turns
+# it on only when the default cache is shared by all workers (REDIS_URL); a
+# per-process cache would keep serving users changed in another worker.
+USER_CACHE_ENABLED = None
+USER_CACHE_TIMEOUT = 300  # seconds
+USER_CACHE_LOCAL_SIZE = 1000  # users kept unpickled per process
+
+# Sliding-window limits (count/s|m|h|d) for login, registration and password
+# reset, per client IP and per submitted username/email; see accounts.throttling
+THROTTLE_ENABLED = True
+THROTTLE_CACHE = 'default'
+THROTTLE_RATES = {
+    'login_ip': '30/m',
+    'login_identifier': '10/m',
+    'register_ip': '10/h',
+    'password_reset_ip': '10/h',
+    'password_reset_identifier': '3/h',
 }
+# Behind reverse proxies: THROTTLE_PROXY_HEADER = 'HTTP_X_FORWARDED_FOR', and
+# the number of proxies in front of the app that append to that header
+THROTTLE_TRUSTED_PROXIES = 1
 
 
 # Password validation
@@ -119,6 +216,58 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
+# Log in with a username or an email address in a single indexed query
+AUTHENTICATION_BACKENDS = ['accounts.backends.EmailOrUsernameModelBackend']
+
+# PBKDF2 runs on a bounded process pool (accounts.hashing). The pooled hasher
+# keeps the pbkdf2_sha256 name, so it replaces Django's PBKDF2PasswordHasher.
+# Size WORKERS and the iteration count with `manage.py benchmark_hashers`.
+PASSWORD_HASHERS = [
+    'accounts.hashing.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASHING_POOL = {
+    # Each web worker process has its own pool: split the CPUs between them.
+    # WEB_CONCURRENCY is the worker count gunicorn and uvicorn read.
+    'WORKERS': int(os.getenv(
+        'PASSWORD_HASHING_WORKERS', max(1, (os.cpu_count() or 1) // int(os.getenv('WEB_CONCURRENCY', 1)))
+    )),
+    'MAX_PENDING': 32,  # queued + running hashes before requests get a 503
+    'TIMEOUT': 5,  # seconds a request waits for its hash
+}
+
+# Metrics (accounts.metrics), scraped from /metrics. With several worker
+# processes point METRICS_DIR at a directory they all can write; each flushes
+# its values there every METRICS_FLUSH_INTERVAL seconds.
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # staff users may scrape from anywhere
+
+# Errors from the accounts app (failed registrations, avatar processing) go
+# to stderr with their tracebacks
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'accounts': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# On-demand request profiling (accounts.profiling): staff can send
+# `X-Profile: sample|cprofile`, or run `manage.py toggle_profiling on`.
+PROFILING = {
+    'DIR': os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles')),
+    'MAX_FILES': 200,  # ring buffer size, across all workers
+    'MODE': 'sample',
+    'INTERVAL': 0.005,
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -138,10 +287,32 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+# collectstatic writes content-hashed names plus .gz/.br copies (accounts.staticfiles)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'accounts.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+STATIC_MAX_AGE = 31536000  # seconds; hashed static files are cached for a year
 
 # Media files (User uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_MAX_AGE = 31536000  # seconds; content-addressed uploads are cached for a year
+# Let the front server send media bodies: 'x-accel-redirect' (nginx, with an
+# `internal` location at MEDIA_OFFLOAD_PREFIX aliased to MEDIA_ROOT) or
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd). Unset, Python streams them.
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD') or None
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+# Profile picture processing (accounts.images)
+AVATAR_SIZES = (64, 128, 256)  # square variants rendered as WebP and JPEG
+AVATAR_MAX_DIMENSION = 1024  # longest side of the cleaned-up original
+AVATAR_WORKERS = 2  # processes in the image pool
+
+# Limits on profile picture uploads, checked while they stream in (accounts/uploads.py)
+PROFILE_PICTURE_MAX_BYTES = 5 * 1024 * 1024
+PROFILE_PICTURE_MAX_PIXELS = 24_000_000  # width x height, read from the header
+PROFILE_PICTURE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -149,7 +320,7 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Email configuration
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'accounts.email_backends.PooledEmailBackend'
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
 EMAIL_USE_TLS = True
@@ -157,6 +328,25 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
+EMAIL_TIMEOUT = 10  # seconds; never let a slow relay hang a worker
+
+# SMTP connection pool and circuit breaker (accounts.email_backends)
+EMAIL_POOL_SIZE = 4  # idle authenticated connections kept per process
+EMAIL_POOL_MAX_IDLE = 300  # seconds before an idle connection is dropped
+EMAIL_POOL_MAX_MESSAGES = 100  # messages per connection before it is recycled
+EMAIL_CIRCUIT_BREAKER_THRESHOLD = 5  # consecutive failures that open the circuit
+EMAIL_CIRCUIT_BREAKER_RESET = 30  # seconds to fail fast before trying the relay again
+
+# Email outbox (delivered by `manage.py send_queued_emails`)
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_BACKOFF_BASE = 30  # seconds, doubled on each failed attempt
+EMAIL_OUTBOX_BACKOFF_MAX = 3600
+
+# Accounts still unverified this long after registering are removed by
+# `manage.py sweep_unverified`. Keep it longer than PASSWORD_RESET_TIMEOUT
+# (3 days), which is how long verification links stay valid.
+UNVERIFIED_ACCOUNT_TTL_DAYS = 7
 
 # Authentication Settings
 LOGIN_URL = 'login'
@@ -173,6 +363,11 @@ SESSION_COOKIE_AGE = 3600  # 1 hour in seconds
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SESSION_COOKIE_HTTPONLY = True
+# Sessions live in the cache and are written behind to the database
+# (accounts.session_backend). With the default per-process LocMem cache each
+# worker has its own copy, so set REDIS_URL when running several workers.
+SESSION_ENGINE = 'accounts.session_backend'
+SESSION_DB_WRITE_INTERVAL = 60  # seconds between write-throughs of an active session
 
 # Site ID for django.contrib.sites
 SITE_ID = 1
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'usermgmt.settings')
 
 application = get_wsgi_application()
+
+# Resolve URLs, compile templates and connect before taking traffic
+if os.environ.get('WARMUP', '1') != '0':
+    from accounts.warmup import warm_up
+
+    warm_up()